@@ -0,0 +1,9 @@
+"""
+benchmarks/
+- corpus.py: deterministic synthetic StackOverflow-style Q&A corpora in the scraper's
+  datasets/train.jsonl format ({"question", "answer", "tags"}) or the RAG train.jsonl format
+  ({"id", "text", "tags", ...})
+- fake_embedder.py: deterministic hashing encoder installed through embedding_model.set_model(),
+  so runs need no model download, no torch and no network
+- run.py: end-to-end runner (ingest, shard fold/load, search latency, dataset_merge) writing JSON
+"""
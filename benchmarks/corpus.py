@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+benchmarks/corpus.py
+- Synthetic Q&A corpus generator; the same (seed, index) always yields the same item
+- fmt="dataset": scraper output as appended to datasets/train.jsonl ({"question", "answer", "tags"})
+- fmt="train":   rag_builder output as read by sharded_rag_update.py ({"id", "text", "tags", ...})
+
+    python -m benchmarks.corpus --docs 10000 --format train --out train.jsonl
+"""
+
+import argparse
+import json
+import random
+
+TAGS = {
+    "python": ["list", "dict", "pandas", "dataframe", "asyncio", "decorator", "generator", "virtualenv"],
+    "java": ["stream", "hashmap", "spring", "maven", "thread", "interface", "jvm", "gradle"],
+    "javascript": ["promise", "array", "react", "closure", "fetch", "node", "event", "json"],
+    "sql": ["join", "index", "query", "transaction", "postgres", "sqlite", "schema", "view"],
+    "git": ["rebase", "merge", "branch", "commit", "stash", "remote", "tag", "submodule"],
+    "docker": ["container", "image", "volume", "compose", "network", "layer", "registry", "build"],
+}
+VERBS = ["sort", "merge", "parse", "convert", "filter", "debug", "optimize", "serialize", "iterate over", "configure"]
+ERRORS = ["KeyError", "NullPointerException", "TypeError", "timeout", "deadlock", "permission denied", "OOM"]
+FILLER = ("the docs say this should work but it fails when the input is large and I am not sure "
+          "whether the problem is in my code or in the library version I am using").split()
+
+
+def make_qa(i, seed=0):
+    """Scraper-style {"question", "answer", "tags"} item number `i`."""
+    rng = random.Random(f"{seed}:{i}")
+    tag = rng.choice(sorted(TAGS))
+    tags = [tag] + rng.sample(sorted(set(TAGS) - {tag}), k=rng.randint(0, 1))
+    noun, other = rng.sample(TAGS[tag], 2)
+    verb = rng.choice(VERBS)
+    question = f"How do I {verb} a {noun} in {tag} without a {rng.choice(ERRORS)}? (#{i})"
+    body = " ".join(rng.choices(FILLER, k=rng.randint(20, 60)))
+    answer = (f"<p>Use the {other} helper to {verb} the {noun} first; {body}.</p>"
+              f"<pre><code>{noun}.{verb.split()[0]}({other})</code></pre>")
+    return {"question": question, "answer": answer, "tags": tags}
+
+
+def make_item(i, seed=0):
+    """RAG train.jsonl item (as built by rag_builder.py) for Q&A number `i`."""
+    qa = make_qa(i, seed)
+    return {
+        "id": f"synthetic-{seed}-{i}",
+        "text": f"Q: {qa['question']} A: {qa['answer']}",
+        "tags": qa["tags"],
+        "source": "synthetic",
+    }
+
+
+def iter_corpus(n, fmt="train", seed=0, offset=0):
+    make = make_item if fmt == "train" else make_qa
+    for i in range(offset, offset + n):
+        yield make(i, seed)
+
+
+def write_corpus(path, n, fmt="train", seed=0, offset=0):
+    """Write `n` items to `path` (JSONL). Returns the number of bytes written."""
+    size = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for item in iter_corpus(n, fmt, seed, offset):
+            line = json.dumps(item, ensure_ascii=False) + "\n"
+            f.write(line)
+            size += len(line.encode("utf-8"))
+    return size
+
+
+def sample_queries(n, seed=0, corpus_size=None):
+    """Query strings paraphrasing random corpus questions (plus some that match nothing exactly)."""
+    rng = random.Random(f"queries:{seed}")
+    queries = []
+    for _ in range(n):
+        if corpus_size and rng.random() < 0.8:
+            qa = make_qa(rng.randrange(corpus_size), seed)
+            queries.append(qa["question"].split("?")[0].replace("How do I", "how to"))
+        else:
+            tag = rng.choice(sorted(TAGS))
+            queries.append(f"{rng.choice(VERBS)} {rng.choice(TAGS[tag])} {tag}")
+    return queries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--format", choices=("train", "dataset"), default="train")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--offset", type=int, default=0)
+    parser.add_argument("--out", default="train.jsonl")
+    args = parser.parse_args()
+    size = write_corpus(args.out, args.docs, args.format, args.seed, args.offset)
+    print(f"[BENCH] Wrote {args.docs} {args.format} items ({size / 1e6:.1f} MB) to {args.out}")
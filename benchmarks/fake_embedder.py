@@ -0,0 +1,48 @@
+"""
+benchmarks/fake_embedder.py
+- Deterministic stand-in for SentenceTransformer: a text's embedding is the L2-normalized sum of
+  fixed random vectors of its lowercase word tokens, so texts sharing words land close together
+  and search results stay meaningful
+- install() registers it with embedding_model.set_model(), which every encode path goes through
+"""
+
+import hashlib
+import re
+
+import numpy as np
+
+import embedding_model
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class FakeEmbedder:
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._vectors = {}
+
+    def _token_vector(self, token):
+        vec = self._vectors.get(token)
+        if vec is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec = self._vectors[token] = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+        return vec
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            for token in TOKEN_RE.findall((text or "").lower()):
+                out[i] += self._token_vector(token)
+            norm = np.linalg.norm(out[i])
+            if norm:
+                out[i] /= norm
+        return out
+
+
+def install(name=None, dim=384):
+    """Use a FakeEmbedder for model `name` (default embedding_model.MODEL_NAME). Returns it."""
+    model = FakeEmbedder(dim)
+    embedding_model.set_model(model, name)
+    return model
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+benchmarks/run.py
+- End-to-end benchmark on synthetic corpora with the fake embedder (no model, no network, no HF):
+    ingest      sharded_rag_update.main() throughput (docs/s) into delta segments
+    fold        main(fold=True): writing the base shards (MAX_SHARD_MB decides the shard count)
+    load        ShardedSearcher startup for each load mode (eager / mmap)
+    search      inference_search p50/p95/p99 latency per search mode (query cache off)
+    memory      peak RSS of the run
+  Every corpus size runs in its own interpreter and temp directory, so peak RSS is per size and
+  larger sizes give the latency-vs-shard-count curve
+- dataset_merge.py throughput on a scraper-format corpus with 50% overlap
+- Results are written as JSON (default benchmarks/results/<commit>.json); `--compare OLD NEW`
+  prints the relative change of every metric
+
+    python -m benchmarks.run --sizes 2000,10000 --queries 200
+    python -m benchmarks.run --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+LOAD_MODES = ("eager", "mmap")
+
+
+def _percentiles(samples_ms):
+    import numpy as np
+
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+            "mean_ms": round(float(np.mean(samples_ms)), 3)}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _dir_mb(path, pattern):
+    return round(sum(p.stat().st_size for p in Path(path).glob(pattern)) / 1e6, 3)
+
+
+def run_case(docs, queries=200, top_k=10, modes=("vector",), seed=0):
+    """
+    One corpus size, run inside an empty working directory by a dedicated interpreter
+    (the pipeline modules read their paths and limits at import time).
+    """
+    from benchmarks import corpus, fake_embedder
+
+    import embedding_model
+    import inference_search
+    import sharded_rag_update
+
+    for name in {embedding_model.MODEL_NAME, inference_search.MODEL_NAME}:
+        fake_embedder.install(name, dim=sharded_rag_update.DIM)
+
+    result = {"docs": docs, "max_shard_mb": sharded_rag_update.MAX_SHARD_MB}
+    result["corpus_mb"] = round(corpus.write_corpus(sharded_rag_update.TRAIN_JSON, docs, "train", seed) / 1e6, 3)
+
+    # pipeline progress goes to stderr; stdout carries only the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        sharded_rag_update.main()
+        elapsed = time.perf_counter() - start
+        manifest = sharded_rag_update.load_local_manifest()
+        result["ingest"] = {"seconds": round(elapsed, 3), "docs_per_s": round(docs / elapsed, 1),
+                            "delta_segments": len(manifest.get("deltas", []))}
+
+        start = time.perf_counter()
+        sharded_rag_update.main(fold=True)
+        elapsed = time.perf_counter() - start
+        manifest = sharded_rag_update.load_local_manifest()
+        result["fold"] = {"seconds": round(elapsed, 3), "shards": len(manifest.get("shards", [])),
+                          "shard_mb": _dir_mb(sharded_rag_update.RAG_DIR, "shard_*.faiss")}
+
+        result["load"] = {}
+        searchers = {}
+        for mode in LOAD_MODES:
+            searcher = inference_search.ShardedSearcher(load_mode=mode, cache=False)
+            start = time.perf_counter()
+            searcher.refresh(force=True)
+            result["load"][mode] = {"seconds": round(time.perf_counter() - start, 4)}
+            searchers[mode] = searcher
+
+        searcher = searchers["eager"]
+        query_texts = corpus.sample_queries(queries, seed, corpus_size=docs)
+        result["search"] = {"queries": len(query_texts), "top_k": top_k, "shards": len(searcher.shards())}
+        for mode in modes:
+            for q in query_texts[:5]:
+                searcher.search(q, top_k=top_k, mode=mode)
+            samples = []
+            for q in query_texts:
+                start = time.perf_counter()
+                searcher.search(q, top_k=top_k, mode=mode)
+                samples.append((time.perf_counter() - start) * 1000)
+            result["search"][mode] = _percentiles(samples)
+
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def bench_dataset_merge(docs, seed=0):
+    """dataset_merge.py on `docs` old items plus `docs` new ones, half of which are already present."""
+    from benchmarks import corpus
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_merge_"))
+    try:
+        (workdir / "pipeline").mkdir()
+        corpus.write_corpus(workdir / "train.jsonl", docs, "dataset", seed)
+        corpus.write_corpus(workdir / "pipeline" / "train.jsonl", docs, "dataset", seed, offset=docs // 2)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(REPO_ROOT / "dataset_merge.py")], cwd=workdir, check=True,
+                       stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        with open(workdir / "merged_train.jsonl", "rb") as f:
+            merged = sum(1 for _ in f)
+        return {"old": docs, "new": docs, "merged": merged, "seconds": round(elapsed, 3),
+                "items_per_s": round(2 * docs / elapsed, 1)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def spawn_case(docs, args):
+    """run_case() in a fresh interpreter and temp directory; returns its JSON result."""
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench_{docs}_"))
+    env = dict(os.environ)
+    for var in ("HF_REPO", "HF_TOKEN"):
+        env.pop(var, None)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")])),
+        "MAX_SHARD_MB": str(args.max_shard_mb),
+        "EMBED_CACHE_PATH": str(workdir / ".cache" / "embeddings.sqlite"),
+        "DELTA_AUTO_FOLD": "0",
+    })
+    case = json.dumps({"docs": docs, "queries": args.queries, "top_k": args.top_k, "modes": args.modes,
+                       "seed": args.seed})
+    try:
+        out = subprocess.run([sys.executable, "-m", "benchmarks.run", "--case", case], cwd=workdir, env=env,
+                             check=True, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL,
+                             text=True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+    finally:
+        if args.keep:
+            print(f"[BENCH] Kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                             check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _flatten(v, f"{prefix}.{k}" if prefix else k)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(old_path, new_path):
+    """Print every numeric metric of two result files side by side with the relative change."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    def metrics(report):
+        flat = dict(_flatten(report.get("dataset_merge") or {}, "dataset_merge"))
+        for case in report.get("cases", []):
+            flat.update(_flatten(case, f"docs={case['docs']}"))
+        return flat
+
+    before, after = metrics(old), metrics(new)
+    print(f"{'metric':60} {old.get('commit') or 'old':>12} {new.get('commit') or 'new':>12} {'change':>8}")
+    for key in sorted(before.keys() & after.keys()):
+        a, b = before[key], after[key]
+        change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+        print(f"{key:60} {a:>12} {b:>12} {change:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="2000,10000", help="comma-separated corpus sizes (docs)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--modes", default="vector,hybrid", help="search modes to time")
+    parser.add_argument("--max-shard-mb", type=int, default=1, help="shard rollover size (small = more shards)")
+    parser.add_argument("--merge-docs", type=int, default=50000, help="dataset_merge corpus size (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="result file (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="keep the temp working directories")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        case = json.loads(args.case)
+        print(json.dumps(run_case(case["docs"], case["queries"], case["top_k"], case["modes"].split(","),
+                                  case["seed"])))
+        sys.exit(0)
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"sizes": args.sizes, "queries": args.queries, "top_k": args.top_k, "modes": args.modes,
+                   "max_shard_mb": args.max_shard_mb, "seed": args.seed},
+        "cases": [],
+    }
+    for docs in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"[BENCH] {docs} docs ...", file=sys.stderr)
+        case = spawn_case(docs, args)
+        print(json.dumps(case), file=sys.stderr)
+        report["cases"].append(case)
+    if args.merge_docs:
+        print(f"[BENCH] dataset_merge {args.merge_docs} + {args.merge_docs} items ...", file=sys.stderr)
+        report["dataset_merge"] = bench_dataset_merge(args.merge_docs, args.seed)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{commit or 'local'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Wrote {out}")
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+compact_shards.py
+- Rewrites every segment listed in rag_storage/manifest.json (base shards and deltas) into a fresh
+  set of balanced base shards:
+    * duplicate rows (same content_hash; the oldest copy is kept) are dropped
+    * rows tombstoned in the id map (id_map.py: replaced or deleted doc_ids) are dropped; the id map
+      is then pointed at the new shards. `--delete-id` / `--delete-hash` delete the live rows with
+      that metadata "id" / content hash through the id map first (id_map.delete_records), so
+      searches skip them right away and their texts can be re-added
+    * live rows are spread evenly over ceil(live size / --target-mb) shards
+    * `--index-type` rebuilds the shards with another index type (default INDEX_TYPE)
+- Segments are streamed one at a time; new shards get fresh ids, so the old files stay intact and
+  searchable until the new manifest is saved (one atomic replace). Old files are deleted after
+  `--grace` seconds, giving running searchers time to pick up the new manifest
+- The swap is abandoned (and the new files removed) if manifest.json changed during the rewrite
+- Prints a JSON report: vectors / duplicates / tombstoned removed, shards and bytes before and
+  after, mean per-query search time over all segments before and after
+
+    python compact_shards.py --dry-run
+    python compact_shards.py --target-mb 64 --index-type sq8
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+import metrics
+from embedding_cache import content_hash
+from index_factory import INDEX_TYPE, RECALL_K, RECALL_QUERIES, apply_search_params, reconstruct_vectors, vector_bytes
+from metadata_store import index_path_for, open_metadata
+from shard_catalog import ShardCatalog
+from shard_io import read_shard_index
+from tag_index import tags_path_for
+from lexical_index import lexical_path_for
+from id_map import delete_records, id_map_path, open_id_map, stable_id
+from sharded_rag_update import CATALOG, DIM, MAX_SHARD_MB, MODEL_NAME, RAG_DIR, ShardWriter, record_locations
+
+# pending deletions written by older versions of --delete-id / --delete-hash: applied through the id map once
+LEGACY_TOMBSTONES_FILE = RAG_DIR / "tombstones.json"
+COMPACT_BATCH = int(os.environ.get("COMPACT_BATCH", "10000"))   # kept rows handed to the writer per add()
+COMPACT_GRACE_S = float(os.environ.get("COMPACT_GRACE_S", "10"))
+# shards hold ceil(live / shards) rows, which can exceed --target-mb by one vector: the size cap gets
+# this much slack so that max_vectors alone decides where shards split (no stray one-row shard)
+SHARD_SIZE_SLACK_MB = 1
+
+
+def _row_key(meta):
+    return meta.get("content_hash") or content_hash(meta.get("text", ""), MODEL_NAME)
+
+
+def _dead_rows():
+    id_map = open_id_map(RAG_DIR, readonly=True)
+    if id_map is None:
+        return {}
+    try:
+        return id_map.dead_rows_by_segment()
+    finally:
+        id_map.close()
+
+
+def delete_rows(ids=(), content_hashes=()):
+    """
+    Delete the live rows whose metadata "id" is in `ids` or whose content hash is in
+    `content_hashes`, through the id map (id_map.delete_records). Returns the doc_ids deleted.
+    """
+    ids, content_hashes = {str(i) for i in ids}, set(content_hashes)
+    manifest = CATALOG.load()
+    if not id_map_path(RAG_DIR).exists():
+        # shards written before the id map existed: build it (and publish it) first
+        record_locations(manifest, [])
+    dead_rows = _dead_rows()
+    doc_ids = set()
+    for entry in CATALOG.entries(manifest):
+        if not entry.get("meta_file"):
+            continue
+        superseded = set(dead_rows.get(entry["shard_file"], np.zeros(0, "int64")).tolist())
+        for row, meta in zip(range(entry.get("vectors", 0)), open_metadata(RAG_DIR / entry["meta_file"])):
+            if row not in superseded and (str(meta.get("id")) in ids or _row_key(meta) in content_hashes):
+                doc_ids.add(stable_id(meta))
+    return sorted(delete_records(sorted(doc_ids), RAG_DIR)) if doc_ids else []
+
+
+def apply_legacy_tombstones(path=LEGACY_TOMBSTONES_FILE):
+    if not path.exists():
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    deleted = delete_rows(data.get("ids", []), data.get("content_hashes", []))
+    path.unlink()
+    print(f"[COMPACT] Applied {path.name} through the id map ({len(deleted)} records deleted)")
+
+
+def plan_segments(manifest, dead_rows=None):
+    """
+    Metadata-only pass over all segments, oldest first. `dead_rows` maps a segment to its
+    id-map tombstones. Returns ([(entry, keep_mask)], stats).
+    """
+    seen = set()
+    stats = {"vectors_before": 0, "duplicates": 0, "replaced_or_deleted": 0}
+    segments = []
+    for entry in CATALOG.entries(manifest):
+        n = entry.get("vectors", 0)
+        keep = np.zeros(n, dtype=bool)
+        metas = open_metadata(RAG_DIR / entry["meta_file"]) if entry.get("meta_file") else []
+        superseded = set((dead_rows or {}).get(entry["shard_file"], np.zeros(0, "int64")).tolist())
+        for row, meta in zip(range(n), metas):
+            key = _row_key(meta)
+            if row in superseded:
+                stats["replaced_or_deleted"] += 1
+            elif key in seen:
+                stats["duplicates"] += 1
+            else:
+                seen.add(key)
+                keep[row] = True
+        stats["vectors_before"] += n
+        segments.append((entry, keep))
+    return segments, stats
+
+
+def _search_ms(entries, queries, k):
+    """Mean time per query of searching every segment in `entries` (mmap'd, one after another)."""
+    total = 0.0
+    for entry in entries:
+        index = read_shard_index(RAG_DIR / entry["shard_file"], mode="mmap")
+        if index.ntotal == 0:
+            continue
+        apply_search_params(index, entry.get("index"))
+        start = time.perf_counter()
+        index.search(queries, min(k, index.ntotal))
+        total += time.perf_counter() - start
+    return total * 1000 / len(queries)
+
+
+def _segment_files(entry):
+    files = [RAG_DIR / entry["shard_file"]]
+    if entry.get("meta_file"):
+        meta_path = RAG_DIR / entry["meta_file"]
+        files += [meta_path, index_path_for(meta_path), tags_path_for(meta_path), lexical_path_for(meta_path)]
+    return files
+
+
+def _remove_files(entries):
+    for entry in entries:
+        for p in _segment_files(entry):
+            if p.exists():
+                p.unlink()
+
+
+def rewrite(segments, target_mb, per_shard, index_type, next_ids):
+    """Stream the kept rows of `segments` into new base shards. Returns (work manifest, row locations)."""
+    work = {"shards": [], "deltas": [], **next_ids}
+    writer = ShardWriter(work, kind="shard", max_mb=target_mb + SHARD_SIZE_SLACK_MB, max_vectors=per_shard,
+                         index_type=index_type)
+    for entry, keep in segments:
+        if not keep.any():
+            continue
+        index = read_shard_index(RAG_DIR / entry["shard_file"], mode="eager")
+        vectors = reconstruct_vectors(index)
+        if vectors is None:
+            raise RuntimeError(f"Cannot read the vectors of {entry['shard_file']}")
+        metas = open_metadata(RAG_DIR / entry["meta_file"])
+        for start in range(0, len(keep), COMPACT_BATCH):
+            rows = np.flatnonzero(keep[start:start + COMPACT_BATCH]) + start
+            if len(rows):
+                writer.add(vectors[rows], [metas[int(r)] for r in rows])
+        del index, vectors
+    writer.close()
+    return work, writer.locations
+
+
+def compact(target_mb=None, index_type=None, dry_run=False, grace=COMPACT_GRACE_S, k=RECALL_K,
+            n_queries=RECALL_QUERIES):
+    if not CATALOG.exists():
+        print("[COMPACT] No manifest.json in", RAG_DIR)
+        return None
+    target_mb = target_mb or MAX_SHARD_MB
+    if not dry_run:
+        apply_legacy_tombstones()
+    manifest = CATALOG.load()
+    generation = manifest.get("generation")
+    old_entries = CATALOG.entries(manifest)
+
+    with metrics.span("compact.plan"):
+        segments, report = plan_segments(manifest, _dead_rows())
+    live = sum(int(keep.sum()) for _, keep in segments)
+    n_shards = max(1, math.ceil(live * vector_bytes(DIM, index_type) / (target_mb * 1024 * 1024))) if live else 0
+    report.update({
+        "vectors_after": live,
+        "segments_before": len(old_entries),
+        "shards_after": n_shards,
+        "bytes_before": sum(e.get("bytes", 0) for e in old_entries),
+        "target_mb": target_mb,
+        "index_type": index_type or INDEX_TYPE,
+    })
+    if dry_run:
+        print(json.dumps(report))
+        return report
+
+    next_ids = {"next_shard_id": ShardCatalog.next_id(dict(manifest), "shards"),
+                "next_delta_id": ShardCatalog.next_id(dict(manifest), "deltas")}
+    with metrics.span("compact.rewrite"):
+        work, locations = rewrite(segments, target_mb, math.ceil(live / n_shards) if live else None, index_type, next_ids)
+    new_entries = work["shards"]
+
+    if new_entries:
+        queries = reconstruct_vectors(read_shard_index(RAG_DIR / new_entries[0]["shard_file"], mode="eager"),
+                                      n_queries)
+        report["search_ms_before"] = round(_search_ms(old_entries, queries, k), 4)
+        report["search_ms_after"] = round(_search_ms(new_entries, queries, k), 4)
+
+    with metrics.span("compact.swap"):
+        current = CATALOG.load()
+        if current.get("generation") != generation:
+            _remove_files(new_entries)
+            print("[COMPACT] manifest.json changed during compaction; new shards discarded, nothing swapped")
+            return None
+        current["shards"] = new_entries
+        current["deltas"] = []
+        current["next_shard_id"] = work["next_shard_id"]
+        current["next_delta_id"] = work["next_delta_id"]
+        CATALOG.update_totals(current)
+        # one save publishes the new shards together with their id-map locations
+        record_locations(current, locations, [e["shard_file"] for e in old_entries])
+
+    report["shards_after"] = len(new_entries)
+    report["bytes_after"] = sum(e.get("bytes", 0) for e in new_entries)
+    report["bytes_saved"] = report["bytes_before"] - report["bytes_after"]
+    report["vectors_removed"] = report["vectors_before"] - report["vectors_after"]
+
+    if grace:
+        print(f"[COMPACT] New manifest saved; removing old segment files in {grace:g}s")
+        time.sleep(grace)
+    _remove_files(old_entries)
+    metrics.count("compact.vectors_removed", report["vectors_removed"])
+    metrics.count("compact.bytes_saved", report["bytes_saved"])
+    print(json.dumps(report))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-mb", type=float, default=None, help=f"shard size target (default MAX_SHARD_MB={MAX_SHARD_MB})")
+    parser.add_argument("--index-type", default=None, help="index type of the new shards (default INDEX_TYPE)")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed; write nothing")
+    parser.add_argument("--grace", type=float, default=COMPACT_GRACE_S, help="seconds to keep old files after the swap")
+    parser.add_argument("--delete-id", action="append", default=[], help="delete a row by metadata id (repeatable)")
+    parser.add_argument("--delete-hash", action="append", default=[], help="delete rows by content hash (repeatable)")
+    args = parser.parse_args()
+
+    if args.delete_id or args.delete_hash:
+        if args.dry_run:
+            print("[COMPACT] --dry-run: deletions not applied")
+        else:
+            deleted = delete_rows(args.delete_id, args.delete_hash)
+            print(f"[COMPACT] Deleted {len(deleted)} record(s) through the id map")
+    with metrics.run("compact"):
+        compact(args.target_mb, args.index_type, dry_run=args.dry_run, grace=args.grace)
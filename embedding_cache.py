@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+embedding_cache.py
+- Persistent on-disk embedding cache (SQLite) keyed by sha256(model name + normalized text)
+- Size-bounded: least recently used vectors are evicted once the cache exceeds EMBED_CACHE_MB
+- Also remembers which content hashes are already in rag_storage/ so sharded_rag_update can
+  skip texts the scraper returns again instead of adding duplicate vectors; the hashes of rows the
+  id map tombstones (replaced or deleted) are forgotten again, so those texts can come back
+- Lives outside rag_storage/ (EMBED_CACHE_PATH) so it is never uploaded with the shards
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+EMBED_CACHE_PATH = Path(os.environ.get("EMBED_CACHE_PATH", ".cache/embeddings.sqlite"))
+EMBED_CACHE_MB = float(os.environ.get("EMBED_CACHE_MB", "512"))
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE", "1") == "1"
+
+
+def normalize_text(text):
+    """Unicode NFC + collapsed whitespace, so trivially re-formatted texts share a key."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def content_hash(text, model_name):
+    h = hashlib.sha256()
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    text -> embedding cache for one model, backed by SQLite.
+    encode() returns vectors for a list of texts, calling the real encoder only for misses.
+    """
+
+    def __init__(self, model_name, path=EMBED_CACHE_PATH, max_mb=EMBED_CACHE_MB):
+        self.model_name = model_name
+        self.path = Path(path)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS indexed (key TEXT PRIMARY KEY)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def key(self, text):
+        return content_hash(text, self.model_name)
+
+    def close(self):
+        self.db.close()
+
+    # ---------------- embeddings ----------------
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache (and refresh their LRU stamp)."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = self.db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype="float32")
+        if found:
+            now = time.time()
+            self.db.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, k) for k in found])
+            self.db.commit()
+        return found
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        rows = []
+        for key, vec in zip(keys, vectors):
+            blob = np.ascontiguousarray(vec, dtype="float32").tobytes()
+            rows.append((key, blob, len(blob), now))
+        self.db.executemany("INSERT OR REPLACE INTO embeddings(key, vector, nbytes, last_used) VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+        # put_many() is only called for misses, so every row is new
+        self.total_bytes += sum(r[2] for r in rows)
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used vectors until the cache is back under 90% of max_bytes."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        while self.total_bytes > target:
+            rows = self.db.execute("SELECT key, nbytes FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            self.db.executemany("DELETE FROM embeddings WHERE key=?", [(k,) for k, _ in rows])
+            self.total_bytes -= sum(n for _, n in rows)
+        self.db.commit()
+
+    def encode(self, texts, encode_fn, keys=None):
+        """
+        Embeddings for `texts` in order, as a float32 matrix. Only cache misses are passed to
+        encode_fn(list_of_texts) -> array; their vectors are then stored.
+        """
+        keys = keys or [self.key(t) for t in texts]
+        found = self.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = np.asarray(encode_fn(list(missing.values())), dtype="float32")
+            self.put_many(list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), vectors))
+        return np.vstack([found[k] for k in keys]).astype("float32") if keys else np.zeros((0, 0), "float32")
+
+    # ---------------- indexed content ----------------
+
+    def indexed_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+
+    def is_indexed_many(self, keys):
+        """Subset of `keys` already present in rag_storage/."""
+        present = set()
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = self.db.execute(
+                f"SELECT key FROM indexed WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            present.update(k for (k,) in rows)
+        return present
+
+    def mark_indexed(self, keys):
+        self.db.executemany("INSERT OR IGNORE INTO indexed(key) VALUES (?)", [(k,) for k in keys])
+        self.db.commit()
+
+    def unmark_indexed(self, keys):
+        """Forget `keys` (their rows were deleted from rag_storage/, so the texts may be added again)."""
+        self.db.executemany("DELETE FROM indexed WHERE key = ?", [(k,) for k in keys])
+        self.db.commit()
+
+    def meta_key(self, meta):
+        """Content hash of a shard metadata row (rows written before content_hash existed are re-hashed)."""
+        return meta.get("content_hash") or self.key(meta.get("text", ""))
+
+    def unmark_metadata(self, metas):
+        """unmark_indexed() for the metadata rows of tombstoned (replaced or deleted) rows."""
+        self.unmark_indexed({self.meta_key(meta) for meta in metas})
+
+    def rebuild_indexed(self, metadata_sources):
+        """
+        Re-derive the indexed set from shard metadata (iterables of metadata dicts), e.g. on a
+        fresh machine whose cache file is empty while rag_storage/ already holds vectors.
+        """
+        batch, total = [], 0
+        for metas in metadata_sources:
+            for meta in metas:
+                batch.append(self.meta_key(meta))
+                if len(batch) >= 10000:
+                    self.mark_indexed(batch)
+                    total += len(batch)
+                    batch = []
+        if batch:
+            self.mark_indexed(batch)
+            total += len(batch)
+        return total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.total_bytes, "indexed": self.indexed_count()}
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+embedding_model.py
+- Process-wide, lazily loaded SentenceTransformer models shared by inference_search.py,
+  sharded_rag_update.py and vector_db.py
+- sentence_transformers (and torch) are only imported on the first get_model()/encode() call, so
+  importing a helper, `--help`, or a run with nothing to embed never pays for the model load
+- warm_up() loads the model and runs one encode up front (used by `inference_search.py --serve`)
+- set_model() installs a ready-made encoder object (anything with .encode()) for a model name
+- `python embedding_model.py --import-cost inference_search sharded_rag_update` reports the import
+  time of each module in a fresh interpreter and whether it pulled in torch/sentence_transformers;
+  `--warm-up` reports the model load + first encode time
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+MODEL_NAME = os.environ.get("EMBED_MODEL", "all-MiniLM-L6-v2")
+ENCODE_BATCH = int(os.environ.get("ENCODE_BATCH", "64"))
+HEAVY_MODULES = ("torch", "sentence_transformers")
+
+_models = {}
+_lock = threading.Lock()
+
+
+def get_model(name=None):
+    """The shared model for `name` (default MODEL_NAME), loaded on first use."""
+    name = name or MODEL_NAME
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _models:
+            from sentence_transformers import SentenceTransformer
+            start = time.perf_counter()
+            _models[name] = SentenceTransformer(name)
+            print(f"[EMBED] Loaded {name} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        return _models[name]
+
+
+def set_model(model, name=None):
+    """Use `model` (any object with a SentenceTransformer-style encode()) for `name`."""
+    with _lock:
+        _models[name or MODEL_NAME] = model
+
+
+def is_loaded(name=None):
+    return (name or MODEL_NAME) in _models
+
+
+def encode(texts, name=None, batch_size=ENCODE_BATCH):
+    """float32 (len(texts), dim) embeddings from the shared model."""
+    emb = get_model(name).encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(emb, dtype="float32")
+
+
+def warm_up(name=None):
+    """Load the model and run one encode so the first real request is not slowed down. Returns seconds."""
+    start = time.perf_counter()
+    encode(["warm up"], name=name)
+    return time.perf_counter() - start
+
+
+def import_cost(module):
+    """Import `module` in a fresh interpreter; returns its import time and which heavy modules it loaded."""
+    code = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(json.dumps({'import_s': round(time.perf_counter() - t, 4),"
+        f" 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return dict(module=module, **json.loads(out.stdout.strip().splitlines()[-1]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--import-cost", nargs="+", metavar="MODULE", help="measure import time of MODULE(s)")
+    parser.add_argument("--warm-up", action="store_true", help="measure model load + first encode")
+    parser.add_argument("--model", default=MODEL_NAME)
+    args = parser.parse_args()
+
+    if args.import_cost:
+        for mod in args.import_cost:
+            print(json.dumps(import_cost(mod)))
+    elif args.warm_up:
+        print(json.dumps({"model": args.model, "warm_up_s": round(warm_up(args.model), 4)}))
+    else:
+        parser.print_help()
@@ -1,10 +1,16 @@
 import shutil
 from huggingface_hub import hf_hub_download, HfApi
-from shard_manager import get_active_rag_shard
+from shard_manager import get_active_rag_shard, record_append
+from rag_parts import RAG_PUBLISH_MODE, publish_part
+import metrics
 
 HF_REPO = "Sachin21112004/final-rag-dataset"
 
 def merge_and_upload_rag(temp_rag_file):
+    # incremental mode: upload only this run's records as a new part (see rag_parts.py)
+    if RAG_PUBLISH_MODE == "parts":
+        return publish_part(temp_rag_file, HF_REPO, repo_type="dataset", folder="")
+
     api = HfApi()
     active_shard = get_active_rag_shard()
 
@@ -21,9 +27,11 @@ def merge_and_upload_rag(temp_rag_file):
 
     with open(temp_rag_file, "r") as src, open(active_shard, "a") as dst:
         dst.write(src.read())
+    record_append(active_shard)
 
-    api.upload_folder(
-        folder_path="rag_components",
-        repo_id=HF_REPO,
-        repo_type="dataset"
-    )
+    with metrics.span("upload.folder"):
+        api.upload_folder(
+            folder_path="rag_components",
+            repo_id=HF_REPO,
+            repo_type="dataset"
+        )
@@ -1,11 +1,17 @@
 import shutil
 from huggingface_hub import HfApi, hf_hub_download
-from shard_manager import get_active_rag_version
+from shard_manager import get_active_rag_version, record_append
+from rag_parts import RAG_PUBLISH_MODE, publish_part
+import metrics
 
 HF_REPO = "Sachin21112004/distilbart-news-summarizer"
 HF_FOLDER = "rag"   # the folder you specified
 
 def merge_and_upload_rag(temp_rag):
+    # incremental mode: upload only this run's records as a new part (see rag_parts.py)
+    if RAG_PUBLISH_MODE == "parts":
+        return publish_part(temp_rag, HF_REPO, repo_type="model", folder=HF_FOLDER)
+
     api = HfApi()
     active_file = get_active_rag_version()
     filename = active_file.split("/")[-1]
@@ -24,11 +30,13 @@ def merge_and_upload_rag(temp_rag):
     # Append new data
     with open(temp_rag, "r") as src, open(active_file, "a") as dst:
         dst.write(src.read())
+    record_append(active_file)
 
     # Upload updated rag folder to HF
-    api.upload_folder(
-        folder_path="rag",
-        repo_id=HF_REPO,
-        repo_type="model",
-        path_in_repo="rag"
-    )
+    with metrics.span("upload.folder"):
+        api.upload_folder(
+            folder_path="rag",
+            repo_id=HF_REPO,
+            repo_type="model",
+            path_in_repo="rag"
+        )
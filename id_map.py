@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+id_map.py
+- Stable 64-bit record ids ("doc_id") and the doc_id -> (segment, row) table of rag_storage/
+- doc_id is the StackOverflow question id when the record has one; otherwise a 62-bit hash of its
+  "id" (or text) with bit 62 set, so hashed ids never collide with question ids
+- rag_storage/idmap.sqlite (listed as "id_map" in manifest.json, uploaded with the shards):
+    docs(doc_id, segment, row)   where the live copy of each record is
+    tombstones(segment, row)     rows replaced by a newer copy (upsert) or deleted
+- FAISS ids stay row positions inside each segment (metadata offsets, tag and lexical indexes are
+  keyed by them). Re-ingesting a doc_id tombstones its previous row, delete() tombstones it outright;
+  inference_search excludes tombstoned rows through an id selector, fold_deltas / compact_shards drop
+  them for good. Changes cost O(changed records): no shard is rewritten
+- Tombstoned rows' texts are dropped from the embedding cache's indexed set (forget_content()), so
+  deleting a record or reverting an edit does not leave its text skipped as a duplicate forever
+- Writers record locations (apply()) before saving the manifest that lists the new rows, and save
+  it once (publish()): a searcher never sees the new rows without the tombstones of the rows they
+  replace. A run that dies in between leaves entries for unlisted segments, which the next writer
+  detects and rebuilds from segment metadata
+
+    python id_map.py --lookup 78452   |   --delete 78452 78453   |   --rebuild   |   --stats
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+import embedding_model
+from embedding_cache import EMBED_CACHE_ENABLED, EmbeddingCache, normalize_text
+from metadata_store import open_metadata
+from shard_catalog import ShardCatalog
+
+RAG_DIR = Path("rag_storage")
+ID_MAP_NAME = "idmap.sqlite"
+HASHED_ID_BIT = 1 << 62
+BATCH = 500
+
+
+def stable_id(item):
+    """doc_id of a train.jsonl item or a metadata row."""
+    for source in (item, item.get("extra") or {}):
+        for key in ("doc_id", "question_id"):
+            if source.get(key) is not None:
+                return int(source[key])
+    basis = item.get("id") or normalize_text(item.get("text", ""))
+    digest = int.from_bytes(hashlib.blake2b(str(basis).encode("utf-8"), digest_size=8).digest(), "little")
+    return (digest & (HASHED_ID_BIT - 1)) | HASHED_ID_BIT
+
+
+def id_map_path(rag_dir=RAG_DIR):
+    return Path(rag_dir) / ID_MAP_NAME
+
+
+class IdMap:
+    def __init__(self, path, readonly=False):
+        self.path = Path(path)
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS docs (doc_id INTEGER PRIMARY KEY, segment TEXT NOT NULL, row INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS docs_segment ON docs(segment)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS tombstones (segment TEXT NOT NULL, row INTEGER NOT NULL, PRIMARY KEY (segment, row))")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _locations(self, doc_ids):
+        found = {}
+        for i in range(0, len(doc_ids), BATCH):
+            batch = doc_ids[i:i + BATCH]
+            rows = self.db.execute(
+                f"SELECT doc_id, segment, row FROM docs WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((d, (s, r)) for d, s, r in rows)
+        return found
+
+    def apply(self, locations, moved_from=()):
+        """
+        Record [(doc_id, segment, row)] as the live copies; a doc_id's previous row (if any) is
+        tombstoned, unless it lies in one of `moved_from` (segments a fold / compaction is about to
+        unlist: the row moved, it was not replaced). Later entries win. Returns the tombstoned
+        [(segment, row)].
+        """
+        locations = list(locations)
+        moved_from = set(moved_from)
+        current = self._locations(list({d for d, _, _ in locations}))
+        dead = []
+        for doc_id, segment, row in locations:
+            old = current.get(doc_id)
+            if old is not None and old != (segment, row) and old[0] not in moved_from:
+                dead.append(old)
+            current[doc_id] = (segment, row)
+        self.db.executemany("INSERT OR IGNORE INTO tombstones(segment, row) VALUES (?, ?)", dead)
+        self.db.executemany("INSERT OR REPLACE INTO docs(doc_id, segment, row) VALUES (?, ?, ?)",
+                            [(d, s, r) for d, (s, r) in current.items()])
+        self.db.commit()
+        return dead
+
+    def delete(self, doc_ids):
+        """Tombstone the live rows of `doc_ids`. Returns {doc_id: (segment, row)} of the rows deleted."""
+        found = self._locations([int(d) for d in doc_ids])
+        self.db.executemany("INSERT OR IGNORE INTO tombstones(segment, row) VALUES (?, ?)", list(found.values()))
+        self.db.executemany("DELETE FROM docs WHERE doc_id = ?", [(d,) for d in found])
+        self.db.commit()
+        return found
+
+    def lookup(self, doc_id):
+        row = self.db.execute("SELECT segment, row FROM docs WHERE doc_id = ?", (int(doc_id),)).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def dead_rows(self, segment):
+        """Sorted int64 tombstoned rows of `segment`."""
+        rows = self.db.execute("SELECT row FROM tombstones WHERE segment = ? ORDER BY row", (segment,)).fetchall()
+        return np.asarray([r for (r,) in rows], dtype="int64")
+
+    def dead_rows_by_segment(self):
+        out = {}
+        for segment, row in self.db.execute("SELECT segment, row FROM tombstones ORDER BY segment, row"):
+            out.setdefault(segment, []).append(row)
+        return {segment: np.asarray(rows, dtype="int64") for segment, rows in out.items()}
+
+    def drop_segments(self, segments):
+        """Forget rows of segments that were removed (after a fold or compaction moved their live rows)."""
+        segments = [(s,) for s in segments]
+        self.db.executemany("DELETE FROM tombstones WHERE segment = ?", segments)
+        self.db.executemany("DELETE FROM docs WHERE segment = ?", segments)
+        self.db.commit()
+
+    def segments(self):
+        """Segments the live rows are recorded in."""
+        return {s for (s,) in self.db.execute("SELECT DISTINCT segment FROM docs")}
+
+    def stats(self):
+        return {"docs": self.db.execute("SELECT COUNT(*) FROM docs").fetchone()[0],
+                "tombstones": self.db.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]}
+
+    def rebuild(self, catalog, manifest):
+        """
+        Re-derive docs from segment metadata (later segments win); existing tombstones are kept.
+        Returns the superseded [(segment, row)] tombstoned on the way.
+        """
+        self.db.execute("DELETE FROM docs")
+        self.db.commit()
+        tombstoned = []
+        for entry in catalog.entries(manifest):
+            if not entry.get("meta_file"):
+                continue
+            dead = set(self.dead_rows(entry["shard_file"]).tolist())
+            metas = open_metadata(catalog.root / entry["meta_file"])
+            batch = []
+            for row, meta in zip(range(entry.get("vectors", 0)), metas):
+                if row not in dead:
+                    batch.append((stable_id(meta), entry["shard_file"], row))
+                if len(batch) >= 10000:
+                    tombstoned.extend(self.apply(batch))
+                    batch = []
+            tombstoned.extend(self.apply(batch))
+        return tombstoned
+
+
+def open_id_map(rag_dir=RAG_DIR, readonly=False):
+    """IdMap of `rag_dir` (None if readonly and there is no id map yet)."""
+    path = id_map_path(rag_dir)
+    if readonly and not path.exists():
+        return None
+    return IdMap(path, readonly=readonly)
+
+
+def row_metadata(catalog, manifest, locations):
+    """Metadata dicts of [(segment, row)] (rows of segments `manifest` does not list are skipped)."""
+    rows = {}
+    for segment, row in locations:
+        rows.setdefault(segment, []).append(row)
+    out = []
+    for entry in catalog.entries(manifest):
+        if entry["shard_file"] in rows and entry.get("meta_file"):
+            metas = open_metadata(catalog.root / entry["meta_file"])
+            out.extend(metas[row] for row in rows[entry["shard_file"]] if row < len(metas))
+    return out
+
+
+def forget_content(catalog, manifest, locations, cache=None):
+    """
+    Drop the content hashes of tombstoned rows from the embedding cache's indexed set (`cache`, or
+    the default cache file unless EMBED_CACHE=0), so a deleted record or a reverted text is ingested
+    again instead of being skipped as a duplicate.
+    """
+    locations = list(locations)
+    if not locations:
+        return
+    own = cache is None and EMBED_CACHE_ENABLED
+    if own:
+        cache = EmbeddingCache(embedding_model.MODEL_NAME)
+    if cache is None:
+        return
+    try:
+        cache.unmark_metadata(row_metadata(catalog, manifest, locations))
+    finally:
+        if own:
+            cache.close()
+
+
+def publish(catalog, manifest, id_map):
+    """Record the id map and its tombstone count in the manifest and save it (searchers then refresh)."""
+    manifest["id_map"] = id_map.path.name
+    listed = {e["shard_file"] for e in catalog.entries(manifest)}
+    # tombstones of segments a fold / compaction just unlisted are dropped only after this save
+    manifest["tombstones"] = sum(n for segment, n in id_map.db.execute(
+        "SELECT segment, COUNT(*) FROM tombstones GROUP BY segment") if segment in listed)
+    catalog.update_totals(manifest)
+    catalog.save(manifest)
+
+
+def delete_records(doc_ids, rag_dir=RAG_DIR, cache=None):
+    """
+    Delete records by doc_id: tombstone their rows, forget their texts in the embedding cache and
+    publish the manifest. Returns the rows deleted.
+    """
+    catalog = ShardCatalog(rag_dir)
+    manifest = catalog.load()
+    id_map = open_id_map(rag_dir)
+    try:
+        deleted = id_map.delete(doc_ids)
+        if deleted:
+            forget_content(catalog, manifest, deleted.values(), cache)
+            publish(catalog, manifest, id_map)
+    finally:
+        id_map.close()
+    return deleted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lookup", type=int, nargs="+", metavar="DOC_ID")
+    parser.add_argument("--delete", type=int, nargs="+", metavar="DOC_ID", help="tombstone records by doc_id")
+    parser.add_argument("--rebuild", action="store_true", help="re-derive the id map from segment metadata")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    args = parser.parse_args()
+
+    if args.delete:
+        deleted = delete_records(args.delete, args.rag_dir)
+        print(f"[IDMAP] Deleted {len(deleted)} of {len(args.delete)} record(s)")
+    elif args.lookup:
+        id_map = open_id_map(args.rag_dir, readonly=True)
+        for doc_id in args.lookup:
+            print(json.dumps({"doc_id": doc_id, "location": id_map.lookup(doc_id) if id_map else None}))
+    elif args.rebuild:
+        catalog = ShardCatalog(args.rag_dir)
+        manifest = catalog.load()
+        id_map = open_id_map(args.rag_dir)
+        superseded = id_map.rebuild(catalog, manifest)
+        forget_content(catalog, manifest, superseded)
+        publish(catalog, manifest, id_map)
+        print(f"[IDMAP] Rebuilt: {id_map.stats()} ({len(superseded)} superseded rows tombstoned)")
+    elif args.stats:
+        id_map = open_id_map(args.rag_dir, readonly=True)
+        print(json.dumps(id_map.stats() if id_map else None))
+    else:
+        parser.print_help()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+index_factory.py
+- Builds the FAISS index used for new rag_storage/ shards, chosen by INDEX_TYPE:
+    flat  -> IndexFlatL2 (exact, default)
+    ivf   -> IVF-Flat      (IVF_NLIST, query knob IVF_NPROBE)
+    hnsw  -> HNSW-Flat     (HNSW_M, HNSW_EF_CONSTRUCTION, query knob HNSW_EF_SEARCH)
+    ivfpq -> IVF-PQ        (IVF_NLIST, PQ_M, PQ_NBITS, query knob IVF_NPROBE)
+    fp16  -> scalar-quantized flat, float16 codes (2 bytes/dim, no training)
+    sq8   -> scalar-quantized flat, int8 codes    (1 byte/dim, trained per-dimension ranges)
+- Trained index types are trained when a shard is created (rollover); if there is not enough
+  training data the shard falls back to flat
+- The index description ({"type", "params", "recall_at_k"}) is stored per shard in manifest.json
+  and inference_search applies the query-time knobs (nprobe / efSearch) from it
+- `python index_factory.py --check-recall` reports recall@k of every approximate shard
+  against an exact flat baseline
+- quantize_shards.py converts existing float32 flat shards to fp16/sq8 offline
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import faiss
+import numpy as np
+from shard_io import read_shard_index
+
+RAG_DIR = Path("rag_storage")
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8")
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")
+
+DEFAULT_PARAMS = {
+    "ivf": {
+        "nlist": int(os.environ.get("IVF_NLIST", "256")),
+        "nprobe": int(os.environ.get("IVF_NPROBE", "16")),
+    },
+    "hnsw": {
+        "M": int(os.environ.get("HNSW_M", "32")),
+        "efConstruction": int(os.environ.get("HNSW_EF_CONSTRUCTION", "80")),
+        "efSearch": int(os.environ.get("HNSW_EF_SEARCH", "64")),
+    },
+    "ivfpq": {
+        "nlist": int(os.environ.get("IVF_NLIST", "256")),
+        "nprobe": int(os.environ.get("IVF_NPROBE", "16")),
+        "pq_m": int(os.environ.get("PQ_M", "48")),
+        "pq_nbits": int(os.environ.get("PQ_NBITS", "8")),
+    },
+    "fp16": {},
+    "sq8": {},
+    "flat": {},
+}
+
+# FAISS k-means wants ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+RECALL_K = 10
+RECALL_QUERIES = 100
+# vectors sampled from the previous (full) shard to train a rolled-over shard
+TRAIN_SAMPLE = int(os.environ.get("INDEX_TRAIN_SAMPLE", "50000"))
+FLAT_INFO = {"type": "flat", "params": {}}
+
+
+def _factory_string(dim, index_type, params):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{params['nlist']},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{params['M']}"
+    if index_type == "ivfpq":
+        if dim % params["pq_m"]:
+            raise ValueError(f"PQ_M={params['pq_m']} must divide the embedding dim {dim}")
+        return f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    if index_type == "fp16":
+        return "SQfp16"
+    if index_type == "sq8":
+        return "SQ8"
+    raise ValueError(f"Unknown INDEX_TYPE {index_type!r} (expected one of {INDEX_TYPES})")
+
+
+def _min_training_points(index_type, params):
+    if index_type == "ivf":
+        return params["nlist"]
+    if index_type == "ivfpq":
+        return max(params["nlist"], 2 ** params["pq_nbits"])
+    if index_type == "sq8":
+        return 1
+    return 0
+
+
+def needs_training(index_type=None):
+    """True if a new `index_type` index learns from its data (ivf, ivfpq, sq8) and wants a full training sample."""
+    index_type = index_type or INDEX_TYPE
+    return _min_training_points(index_type, DEFAULT_PARAMS.get(index_type, {})) > 0
+
+
+def build_shard_index(dim, train_vectors=None, index_type=None, params=None):
+    """
+    Create (and train, if needed) a new shard index.
+    Returns (index, info) where info is the manifest description of the index.
+    `train_vectors` should be a float32 (n, dim) sample of the data going into the shard.
+    """
+    index_type = index_type or INDEX_TYPE
+    params = dict(DEFAULT_PARAMS.get(index_type, {}), **(params or {}))
+    n_train = 0 if train_vectors is None else len(train_vectors)
+
+    if index_type in ("ivf", "ivfpq"):
+        # small shards get fewer lists instead of an undertrained quantizer
+        params["nlist"] = max(1, min(params["nlist"], n_train // MIN_POINTS_PER_CENTROID))
+        if n_train < _min_training_points(index_type, params):
+            print(f"[INDEX] Only {n_train} training vectors for {index_type} -> using flat")
+            return faiss.IndexFlatL2(dim), dict(FLAT_INFO)
+    elif n_train < _min_training_points(index_type, params):
+        print(f"[INDEX] No training vectors for {index_type} -> using flat")
+        return faiss.IndexFlatL2(dim), dict(FLAT_INFO)
+
+    index = faiss.index_factory(dim, _factory_string(dim, index_type, params))
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params["efConstruction"]
+    info = {"type": index_type, "params": params}
+    apply_search_params(index, info)
+
+    if not index.is_trained:
+        print(f"[INDEX] Training {index_type} index on {n_train} vectors (params={params})")
+        index.train(np.ascontiguousarray(train_vectors, dtype="float32"))
+    if index_type != "flat" and n_train:
+        info["recall_at_k"] = round(recall_at_k(index, train_vectors), 4)
+        info["recall_k"] = RECALL_K
+    return index, info
+
+
+def apply_search_params(index, info):
+    """Apply the query-time knobs recorded in a manifest index description."""
+    if not info:
+        return index
+    params = info.get("params", {})
+    ps = faiss.ParameterSpace()
+    if "nprobe" in params:
+        ps.set_index_parameter(index, "nprobe", params["nprobe"])
+    if "efSearch" in params:
+        ps.set_index_parameter(index, "efSearch", params["efSearch"])
+    return index
+
+
+def selector_search_params(index, ids, exclude=False):
+    """
+    SearchParameters restricting a search on `index` to the row ids `ids` (IDSelectorBatch),
+    or to every row except `ids` with exclude=True (e.g. tombstoned rows).
+    IVF / HNSW indexes need their own parameter subclass, which also carries the index's
+    current nprobe / efSearch so the filter does not reset the query knobs.
+    """
+    sel = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype="int64"))
+    if exclude:
+        sel = faiss.IDSelectorNot(sel)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=hnsw.efSearch)
+    return faiss.SearchParameters(sel=sel)
+
+
+def reconstruct_vectors(index, max_vectors=None):
+    """
+    Best-effort copy of the vectors stored in `index` (at most `max_vectors`, evenly spaced).
+    IVF indexes need a direct map; PQ reconstructions are approximate. Returns None if unsupported.
+    """
+    n = index.ntotal
+    if n == 0:
+        return None
+    try:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.make_direct_map()
+        if max_vectors is None or max_vectors >= n:
+            return index.reconstruct_n(0, n)
+        rows = np.linspace(0, n - 1, max_vectors).astype("int64")
+        return np.vstack([index.reconstruct(int(i)) for i in rows])
+    except RuntimeError as e:
+        print("[INDEX] Cannot reconstruct vectors:", e)
+        return None
+
+
+def _bytes_per_vector(index):
+    hnsw = getattr(index, "hnsw", None)
+    codes = faiss.downcast_index(index.storage) if hnsw is not None else index
+    try:
+        per_vector = codes.sa_code_size()
+    except RuntimeError:
+        per_vector = index.d * 4
+    if hnsw is not None:
+        per_vector += hnsw.nb_neighbors(0) * 4   # level-0 graph links dominate
+    if faiss.try_extract_index_ivf(index) is not None:
+        per_vector += 8   # ids stored in the inverted lists
+    return per_vector
+
+
+def estimate_index_mb(index):
+    """Approximate on-disk size of `index` in MB without serializing it (rollover checks between batches)."""
+    return index.ntotal * _bytes_per_vector(index) / (1024 * 1024)
+
+
+def vector_bytes(dim, index_type=None, params=None):
+    """Approximate bytes per stored vector for a shard of `index_type` (sizing shards before building them)."""
+    index_type = index_type or INDEX_TYPE
+    params = dict(DEFAULT_PARAMS.get(index_type, {}), **(params or {}))
+    return _bytes_per_vector(faiss.index_factory(dim, _factory_string(dim, index_type, params)))
+
+
+def sample_shard_vectors(shard_path, max_vectors=TRAIN_SAMPLE):
+    """Training sample taken from an existing shard file (memory-mapped, so the shard is not copied into RAM)."""
+    if not Path(shard_path).exists():
+        return None
+    try:
+        index = read_shard_index(shard_path, mode="mmap")
+    except RuntimeError as e:
+        print("[INDEX] Cannot read", shard_path, e)
+        return None
+    return reconstruct_vectors(index, max_vectors)
+
+
+def recall_at_k(index, vectors, k=RECALL_K, n_queries=RECALL_QUERIES):
+    """
+    recall@k of `index` against an exact IndexFlatL2 over `vectors`.
+    `index` must be trained; a copy is filled with `vectors` so the original stays untouched.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if len(vectors) == 0:
+        return 1.0
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+
+    approx = faiss.clone_index(index)
+    approx.reset()
+    approx.add(vectors)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+
+    _, truth = exact.search(queries, k)
+    _, got = approx.search(queries, k)
+    hits = sum(len(set(t) & set(g)) for t, g in zip(truth, got))
+    return hits / float(truth.size)
+
+
+def check_recall(rag_dir=RAG_DIR, k=RECALL_K, n_queries=RECALL_QUERIES):
+    """
+    recall@k of every non-flat shard listed in manifest.json against a flat baseline built
+    from the shard's own (reconstructed) vectors. For IVF-PQ that baseline is itself quantized,
+    so this measures the search path (nprobe/efSearch); the build-time `recall_at_k` in the
+    manifest also covers quantization loss.
+    """
+    manifest_path = Path(rag_dir) / "manifest.json"
+    if not manifest_path.exists():
+        print("[INDEX] No manifest.json in", rag_dir)
+        return []
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    report = []
+    for entry in manifest.get("shards", []):
+        info = entry.get("index") or FLAT_INFO
+        if info["type"] == "flat":
+            continue
+        index = read_shard_index(Path(rag_dir) / entry["shard_file"], mode="eager")
+        apply_search_params(index, info)
+        vectors = reconstruct_vectors(index)
+        if vectors is None:
+            continue
+        exact = faiss.IndexFlatL2(index.d)
+        exact.add(vectors)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+        kk = min(k, index.ntotal)
+        _, truth = exact.search(queries, kk)
+        _, got = index.search(queries, kk)
+        recall = sum(len(set(t) & set(g)) for t, g in zip(truth, got)) / float(truth.size)
+        row = {"shard": entry["shard_file"], "type": info["type"], "params": info.get("params", {}),
+               f"recall@{kk}": round(recall, 4)}
+        print(json.dumps(row))
+        report.append(row)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check-recall", action="store_true", help="report recall@k of approximate shards")
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    parser.add_argument("--k", type=int, default=RECALL_K)
+    parser.add_argument("--queries", type=int, default=RECALL_QUERIES)
+    args = parser.parse_args()
+
+    if args.check_recall:
+        check_recall(args.rag_dir, k=args.k, n_queries=args.queries)
+    else:
+        parser.print_help()
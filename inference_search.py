@@ -1,66 +1,736 @@
 #!/usr/bin/env python3
 """
 inference_search.py
-- Load all shard_*.faiss and matching metadata_*.json from rag_storage/
+- Load all shard_*.faiss and matching metadata_* files from rag_storage/
+  (metadata rows are read on demand from metadata_XXXX.jsonl/.idx; legacy .json lists still load)
 - Query each shard, collect top_k, merge and return final top_k by distance (L2 small-is-better)
+- ShardedSearcher keeps shards resident and only reloads shards whose manifest `updated_at` changed
+- Delta segments listed under "deltas" in manifest.json are searched alongside the base shards
+- `--serve` runs a local HTTP server (TCP or Unix socket) around one resident ShardedSearcher
+- search_batch() / `--batch` encode many queries together and run one FAISS call per shard per batch
+- Shards are searched in parallel on a thread pool (FAISS releases the GIL) and merged with a bounded heap
+- Query-time knobs (nprobe / efSearch) of approximate shards come from each shard's manifest "index" entry
+- `--load-mode mmap` (or SHARD_LOAD_MODE=mmap) maps shards read-only instead of reading them into RAM
+- The query encoder comes from embedding_model.py and is loaded on the first query; `--serve`
+  warms it up before accepting connections (`--no-warm-up` to skip)
+- `tags=` / `--tags python,pandas` restricts the search to rows carrying any of the tags: each
+  segment's tag index (tag_index.py) gives the row ids, passed to FAISS as an id selector
+- `mode="hybrid"` / `--mode hybrid` also runs a BM25 search over each segment's lexical index
+  (lexical_index.py) and fuses both rankings: FUSION=rrf (reciprocal rank fusion, RRF_K) or
+  FUSION=linear (min-max normalized scores, HYBRID_ALPHA = vector weight); `--mode lexical` is BM25 only.
+  BM25 scores come from per-segment statistics, so cross-segment lexical order is approximate
+- Query embeddings and merged results are cached in memory (query_cache.py, QUERY_CACHE=0 to disable);
+  cached results are dropped whenever manifest.json's `last_updated` changes. `/health` reports the
+  cache's hit/miss counters
+- Rows tombstoned in the id map (id_map.py: replaced by a newer copy of the same doc_id, or
+  deleted) are excluded from every search through an id selector / SQL filter
+- METRICS=1 times encode / vector / lexical search (metrics.py); `--serve` then exposes the
+  stage timings in Prometheus format on GET /metrics
+- `--shard-subset I/N` (or SHARD_SUBSET) makes the searcher own only the manifest segments whose name
+  hashes to partition I of N: a shard server. Its POST /retrieve returns the unfused per-retriever
+  hits for query texts (and, from the coordinator, ready-made query vectors); shard_coordinator.py
+  fans queries out to N such servers and merges their hits
 """
 
 import argparse
+import heapq
 import json
+import os
+import socketserver
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-import faiss
+from urllib.parse import parse_qs, urlparse
 import numpy as np
+from shard_io import LOAD_MODES, SHARD_LOAD_MODE, read_shard_index
+from metadata_store import metadata_path_for, open_metadata
+from index_factory import apply_search_params, selector_search_params
+from tag_index import TagIndex, parse_tags, tags_path_for
+from lexical_index import LexicalIndex, lexical_path_for
+from shard_catalog import ShardCatalog, numeric_suffix
+from id_map import open_id_map
+from embedding_model import get_model, warm_up
+from query_cache import QUERY_CACHE_ENABLED, QueryCache
+import metrics
 
 RAG_DIR = Path("rag_storage")
 MODEL_NAME = "all-MiniLM-L6-v2"
 DIM = 384
+ENCODE_BATCH = int(os.environ.get("ENCODE_BATCH", "64"))
+SEARCH_THREADS = int(os.environ.get("SEARCH_THREADS", str(min(8, os.cpu_count() or 1))))
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "vector")
+FUSION_METHODS = ("rrf", "linear")
+FUSION = os.environ.get("FUSION", "rrf")
+RRF_K = int(os.environ.get("RRF_K", "60"))
+HYBRID_ALPHA = float(os.environ.get("HYBRID_ALPHA", "0.5"))           # linear fusion: weight of the vector score
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "50"))    # hits taken from each retriever before fusing
+SHARD_SUBSET = os.environ.get("SHARD_SUBSET")                         # "I/N": serve partition I of N
 
-model = SentenceTransformer(MODEL_NAME)
 
-def load_shards():
-    shards = []
-    for p in sorted(RAG_DIR.glob("shard_*.faiss")):
-        try:
-            idx = faiss.read_index(str(p))
-            # derive metadata filename (match same number)
-            num = p.stem.split("_")[1]
-            meta_file = RAG_DIR / f"metadata_{num}.json"
-            metas = []
-            if meta_file.exists():
-                with open(meta_file, "r", encoding="utf-8") as f:
-                    metas = json.load(f)
-            print(f"[INFER] Loaded {p.name} (vectors={idx.ntotal})")
-            shards.append((p.name, idx, metas))
-        except Exception as e:
-            print("[INFER] Failed to load", p, e)
-    return shards
+def parse_subset(value):
+    """"I/N" -> (I, N) with 0 <= I < N; None / "" -> None (all segments)."""
+    if not value:
+        return None
+    try:
+        part, total = (int(v) for v in str(value).split("/"))
+    except ValueError:
+        raise ValueError(f"Shard subset must look like I/N, got {value!r}")
+    if not 0 <= part < total:
+        raise ValueError(f"Shard subset {value!r} out of range (need 0 <= I < N)")
+    return part, total
 
-def search(query, top_k=10):
-    emb = model.encode([query], convert_to_numpy=True).astype("float32")
-    shards = load_shards()
-    results = []
-    for name, idx, metas in shards:
-        if idx.ntotal == 0:
-            continue
-        D, I = idx.search(emb, top_k)
-        for dist, i in zip(D[0], I[0]):
+
+def shard_partition(shard_file, total):
+    """Partition (0..total-1) a segment belongs to; stable as other segments come and go."""
+    return zlib.crc32(shard_file.encode("utf-8")) % total
+
+
+def load_shard(shard_path, meta_path, load_mode=None):
+    """Read one shard index and open its metadata. Returns (index, metas)."""
+    idx = read_shard_index(shard_path, load_mode)
+    return idx, open_metadata(meta_path)
+
+
+def merge_topk(shard_hits, top_k):
+    """
+    k-way merge of per-shard hits for one query.
+    shard_hits: [(name, metas, dists, ids)] where each dists row is sorted ascending (FAISS order).
+    Keeps a bounded max-heap of the best top_k; a shard is cut off as soon as its next
+    distance cannot beat the current k-th best, so most shards contribute only a few rows.
+    """
+    heap = []  # (-distance, seq, name, metas, row)
+    seq = 0
+    # visit shards best-first so the heap fills with good candidates early
+    for name, metas, dists, ids in sorted(shard_hits, key=lambda h: h[2][0]):
+        for dist, i in zip(dists, ids):
+            if len(heap) == top_k and dist >= -heap[0][0]:
+                break
             if i < 0:
                 continue
-            meta = metas[i] if i < len(metas) else {}
-            results.append({
-                "shard": name,
-                "distance": float(dist),
-                "meta": meta
-            })
-    # smaller L2 distance is better
-    results = sorted(results, key=lambda x: x["distance"])[:top_k]
+            seq += 1
+            entry = (-float(dist), seq, name, metas, int(i))
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+
+    results = []
+    for neg_dist, _, name, metas, i in sorted(heap, key=lambda e: (-e[0], e[1])):
+        results.append({
+            "shard": name,
+            "row": i,
+            "distance": -neg_dist,
+            "meta": metas[i] if i < len(metas) else {}
+        })
     return results
 
+
+def _normalized(values, higher_is_better):
+    lo, hi = min(values), max(values)
+    if hi == lo:
+        return [1.0] * len(values)
+    return [(v - lo) / (hi - lo) if higher_is_better else (hi - v) / (hi - lo) for v in values]
+
+
+def fuse_results(vector_hits, lexical_hits, top_k, method=FUSION, rrf_k=RRF_K, alpha=HYBRID_ALPHA):
+    """
+    Fuse two ranked hit lists for one query (items identified by (shard, row)).
+    rrf: score = sum of 1 / (rrf_k + rank); linear: alpha * vector + (1 - alpha) * bm25, each
+    min-max normalized within its list. Returns the top_k hits with "score", "distance" and "bm25".
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method {method!r} (expected one of {FUSION_METHODS})")
+    fused = {}
+    for hits, field in ((vector_hits, "distance"), (lexical_hits, "bm25")):
+        if not hits:
+            continue
+        if method == "rrf":
+            scores = [1.0 / (rrf_k + rank) for rank in range(1, len(hits) + 1)]
+        else:
+            weight = alpha if field == "distance" else 1.0 - alpha
+            # both L2 distance and FTS5 bm25 are smaller-is-better
+            scores = [weight * s for s in _normalized([h[field] for h in hits], higher_is_better=False)]
+        for hit, score in zip(hits, scores):
+            key = (hit["shard"], hit["row"])
+            item = fused.get(key)
+            if item is None:
+                item = fused[key] = {"shard": hit["shard"], "row": hit["row"], "score": 0.0,
+                                     "distance": None, "bm25": None, "meta": hit["meta"]}
+            item["score"] += score
+            item[field] = hit[field]
+    return sorted(fused.values(), key=lambda h: -h["score"])[:top_k]
+
+
+class ShardedSearcher:
+    """
+    Resident search engine over rag_storage/.
+    Shards are loaded once; refresh() re-reads manifest.json (only when its mtime moved)
+    and reloads just the shards whose `updated_at` changed.
+    With `subset=(I, N)` only the segments of partition I (see shard_partition) are loaded.
+    """
+
+    def __init__(self, rag_dir=RAG_DIR, embed_model=None, threads=SEARCH_THREADS, load_mode=SHARD_LOAD_MODE,
+                 cache=QUERY_CACHE_ENABLED, subset=None):
+        self.rag_dir = Path(rag_dir)
+        self.subset = subset
+        self.catalog = ShardCatalog(self.rag_dir)
+        self._model = embed_model
+        self.load_mode = load_mode
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shard-search") if threads > 1 else None
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        # manifest last_updated/generation (or shard mtimes without a manifest): the result cache's version
+        self._data_version = None
+        self.cache = QueryCache(MODEL_NAME) if cache else None
+        # ({shard_file: (version, name, index, metas, tags_path, lexical_path)}, {shard_file: sorted
+        # tombstoned rows}): swapped in one assignment, so a search never pairs shards and tombstones
+        # of different manifests
+        self._snapshot = ({}, {})
+        # (shard_file, version) -> TagIndex, loaded on the first filtered search
+        self._tag_indexes = {}
+        # (shard_file, version) -> LexicalIndex (or None if the segment has none)
+        self._lexical_indexes = {}
+
+    def _owns(self, shard_file):
+        return self.subset is None or shard_partition(shard_file, self.subset[1]) == self.subset[0]
+
+    def _manifest_entries(self):
+        """
+        Return [(shard_file, meta_file, version, index_info, tags_file, lexical_file)] from
+        manifest.json, or from a directory scan.
+        """
+        if self.catalog.exists():
+            # the manifest is replaced atomically and only lists fully written files
+            manifest = self.catalog.load()
+            self._data_version = f"{manifest.get('last_updated')}#{manifest.get('generation')}"
+            return [
+                (e["shard_file"], e.get("meta_file"), (e.get("updated_at"), e.get("sha256")), e.get("index"),
+                 e.get("tags_file"), e.get("lexical_file"))
+                for e in self.catalog.entries(manifest)
+                if e.get("shard_file") and self._owns(e["shard_file"])
+            ]
+        # no manifest: fall back to the shard files on disk, versioned by mtime
+        entries = []
+        for p in sorted(self.rag_dir.glob("shard_*.faiss"), key=lambda p: numeric_suffix(p.name)):
+            if not self._owns(p.name):
+                continue
+            num = p.stem.split("_")[1]
+            meta_path = metadata_path_for(self.rag_dir, num)
+            entries.append((p.name, meta_path.name, p.stat().st_mtime, None, tags_path_for(meta_path).name,
+                            lexical_path_for(meta_path).name))
+        self._data_version = str(max((e[2] for e in entries), default=None))
+        return entries
+
+    def refresh(self, force=False):
+        """Sync resident shards with manifest.json. Returns the number of shards (re)loaded."""
+        mtime = self.catalog.mtime_ns()
+        with self._lock:
+            resident = self._snapshot[0]
+            if not force and resident and mtime is not None and mtime == self._manifest_mtime:
+                return 0
+
+            loaded = 0
+            shards = {}
+            for shard_file, meta_file, version, index_info, tags_file, lexical_file in self._manifest_entries():
+                current = resident.get(shard_file)
+                if current is not None and current[0] == version and not force:
+                    shards[shard_file] = current
+                    continue
+                shard_path = self.rag_dir / shard_file
+                if not shard_path.exists():
+                    print("[INFER] Missing shard file", shard_path, file=sys.stderr)
+                    continue
+                try:
+                    idx, metas = load_shard(shard_path, self.rag_dir / meta_file if meta_file else None, self.load_mode)
+                except Exception as e:
+                    print("[INFER] Failed to load", shard_path, e, file=sys.stderr)
+                    if current is not None:
+                        shards[shard_file] = current
+                    continue
+                apply_search_params(idx, index_info)
+                print(f"[INFER] Loaded {shard_file} (vectors={idx.ntotal})", file=sys.stderr)
+                tags_path = self.rag_dir / tags_file if tags_file else None
+                lexical_path = self.rag_dir / lexical_file if lexical_file else None
+                shards[shard_file] = (version, shard_file, idx, metas, tags_path, lexical_path)
+                loaded += 1
+
+            id_map = open_id_map(self.rag_dir, readonly=True)
+            if id_map is not None:
+                dead_rows = id_map.dead_rows_by_segment()
+                id_map.close()
+            else:
+                dead_rows = {}
+
+            # swap in one assignment so concurrent searches see a consistent shard set
+            self._snapshot = (shards, dead_rows)
+            self._tag_indexes = {k: v for k, v in self._tag_indexes.items() if k[0] in shards and shards[k[0]][0] == k[1]}
+            # dropped, not closed: searches still on the previous snapshot may be using them (the
+            # connection closes once the last one lets go)
+            self._lexical_indexes = {k: v for k, v in self._lexical_indexes.items()
+                                     if k[0] in shards and shards[k[0]][0] == k[1]}
+            self._manifest_mtime = mtime
+            if self.cache is not None:
+                self.cache.set_version(self._data_version)
+            return loaded
+
+    @property
+    def model(self):
+        # shared process-wide encoder, loaded on first use
+        return self._model or get_model(MODEL_NAME)
+
+    def shards(self):
+        return [(name, idx, metas) for _, name, idx, metas, _, _ in self._snapshot[0].values()]
+
+    def tag_index(self, shard):
+        """
+        TagIndex of `shard`, an entry of the snapshot a search started with (built from its metadata
+        if the shard has no tags file). A refresh swapping the segment out meanwhile does not matter.
+        """
+        version, shard_file, _, metas, tags_path, _ = shard
+        key = (shard_file, version)
+        tags = self._tag_indexes.get(key)
+        if tags is None:
+            if tags_path is not None and tags_path.exists():
+                tags = TagIndex.load(tags_path)
+            else:
+                tags = TagIndex.from_metadata(metas)
+            self._tag_indexes[key] = tags
+        return tags
+
+    def lexical_index(self, shard):
+        """
+        Read-only LexicalIndex of `shard`, an entry of the snapshot a search started with, or None if
+        it has none (see lexical_index.py --build).
+        """
+        version, shard_file, _, _, _, lexical_path = shard
+        key = (shard_file, version)
+        if key not in self._lexical_indexes:
+            lex = None
+            if lexical_path is not None and lexical_path.exists():
+                lex = LexicalIndex(lexical_path, readonly=True)
+            self._lexical_indexes[key] = lex
+        return self._lexical_indexes[key]
+
+    def encode(self, queries, batch_size=ENCODE_BATCH):
+        if self.cache is None:
+            with metrics.span("search.encode"):
+                emb = self.model.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+            return np.ascontiguousarray(emb, dtype="float32")
+        cached = [self.cache.get_embedding(q) for q in queries]
+        missing = [i for i, vec in enumerate(cached) if vec is None]
+        if missing:
+            with metrics.span("search.encode"):
+                emb = self.model.encode([queries[i] for i in missing], batch_size=batch_size, convert_to_numpy=True)
+            for i, vec in zip(missing, np.asarray(emb, dtype="float32")):
+                self.cache.put_embedding(queries[i], vec)
+                cached[i] = vec
+        return np.ascontiguousarray(np.stack(cached), dtype="float32")
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def last_status(self):
+        # a local search always covers every segment; see ShardCoordinator.last_status
+        return None
+
+    def _map_shards(self, fn, shards):
+        # scatter: shards in parallel (FAISS and sqlite release the GIL)
+        if self._pool is not None and len(shards) > 1:
+            hits = list(self._pool.map(fn, shards))
+        else:
+            hits = [fn(shard) for shard in shards]
+        return [h for h in hits if h is not None]
+
+    def search_batch(self, queries, top_k=10, tags=None, mode=None, fusion=None):
+        """
+        Search many queries at once: one encode pass and one idx.search per shard
+        with the whole query matrix. Returns one result list per query, in order.
+        With `tags`, only rows carrying any of them are searched.
+        mode: "vector" (default SEARCH_MODE), "lexical" (BM25 only) or "hybrid" (both, fused with `fusion`).
+        """
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r} (expected one of {SEARCH_MODES})")
+        if not queries:
+            return []
+        with metrics.span("search.refresh"):
+            self.refresh()
+        metrics.count("search.queries", len(queries))
+        tags = parse_tags(tags)
+        fusion = fusion or FUSION
+        if self.cache is None:
+            return self._search(queries, top_k, tags, mode, fusion)
+
+        # results are cached under the data version the search starts with (skipped if a refresh changes it)
+        version = self.cache.version
+        keys = [self.cache.result_key(q, top_k, tags, mode, fusion if mode == "hybrid" else None) for q in queries]
+        results = [self.cache.get_results(key) for key in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        metrics.count("search.result_cache_hits", len(queries) - len(missing))
+        if missing:
+            fresh = self._search([queries[i] for i in missing], top_k, tags, mode, fusion)
+            for i, r in zip(missing, fresh):
+                self.cache.put_results(keys[i], r, version)
+                results[i] = r
+        return results
+
+    def retrieve(self, queries, top_k=10, tags=None, mode=None, embeddings=None):
+        """
+        Unfused hits of this searcher's segments, one {"vector": [...], "lexical": [...]} per query
+        (only the retrievers `mode` uses). For hybrid, top_k is the candidate count of each
+        retriever. `embeddings` ((len(queries), dim) query vectors) skips encoding.
+        This is a shard server's answer to the coordinator, which merges and fuses across servers.
+        """
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r} (expected one of {SEARCH_MODES})")
+        if not queries:
+            return []
+        with metrics.span("search.refresh"):
+            self.refresh()
+        metrics.count("search.queries", len(queries))
+        tags = parse_tags(tags)
+        out = [{} for _ in queries]
+        if mode != "lexical":
+            emb = None if embeddings is None else np.ascontiguousarray(embeddings, dtype="float32")
+            for o, hits in zip(out, self._vector_search(queries, top_k, tags, emb)):
+                o["vector"] = hits
+        if mode != "vector":
+            for o, q in zip(out, queries):
+                o["lexical"] = self._lexical_search(q, top_k, tags)
+        return out
+
+    def _search(self, queries, top_k, tags, mode, fusion):
+        if mode == "lexical":
+            return [self._lexical_search(q, top_k, tags) for q in queries]
+        if mode == "vector":
+            return self._vector_search(queries, top_k, tags)
+        n = max(top_k, HYBRID_CANDIDATES)
+        vector_hits = self._vector_search(queries, n, tags)
+        return [
+            fuse_results(v, self._lexical_search(q, n, tags), top_k, method=fusion)
+            for q, v in zip(queries, vector_hits)
+        ]
+
+    def _lexical_search(self, query, top_k, tags):
+        """BM25 top_k for one query across all segments that have a lexical index."""
+        loaded, dead_rows = self._snapshot
+        shards = [s for s in loaded.values() if s[2].ntotal > 0]
+
+        def search_one(shard):
+            _, name, idx, metas, _, _ = shard
+            lex = self.lexical_index(shard)
+            if lex is None:
+                return None
+            allowed, dead = None, dead_rows.get(name)
+            if tags:
+                allowed = self.tag_index(shard).ids_for(tags)
+                if dead is not None:
+                    allowed, dead = np.setdiff1d(allowed, dead, assume_unique=True), None
+                if len(allowed) == 0:
+                    return None
+            return [(score, name, metas, row) for row, score in lex.search(query, top_k, idx.ntotal, allowed, dead)]
+
+        with metrics.span("search.lexical"):
+            # ties (common: many rows share a BM25 score) broken by (segment, row), as shard_coordinator does
+            hits = heapq.nsmallest(top_k, (h for rows in self._map_shards(search_one, shards) for h in rows),
+                                   key=lambda h: (h[0], h[1], h[3]))
+        return [
+            {"shard": name, "row": row, "bm25": score, "meta": metas[row] if row < len(metas) else {}}
+            for score, name, metas, row in hits
+        ]
+
+    def _vector_search(self, queries, top_k, tags, emb=None):
+        if emb is None:
+            emb = self.encode(list(queries))
+        loaded, dead_rows = self._snapshot
+        shards = [s for s in loaded.values() if s[2].ntotal > 0]
+
+        def search_one(shard):
+            _, name, idx, metas, _, _ = shard
+            dead = dead_rows.get(name)
+            if not tags:
+                params = selector_search_params(idx, dead, exclude=True) if dead is not None else None
+                D, I = idx.search(emb, top_k, params=params)
+                return name, metas, D, I
+            ids = self.tag_index(shard).ids_for(tags)
+            if dead is not None:
+                ids = np.setdiff1d(ids, dead, assume_unique=True)
+            if len(ids) == 0:
+                return None
+            D, I = idx.search(emb, top_k, params=selector_search_params(idx, ids))
+            return name, metas, D, I
+
+        # one FAISS call per shard for the whole query batch
+        with metrics.span("search.vector"):
+            hits = self._map_shards(search_one, shards)
+
+        # gather: smaller L2 distance is better
+        return [
+            merge_topk([(name, metas, D[q], I[q]) for name, metas, D, I in hits], top_k)
+            for q in range(len(queries))
+        ]
+
+    def search(self, query, top_k=10, tags=None, mode=None, fusion=None):
+        return self.search_batch([query], top_k=top_k, tags=tags, mode=mode, fusion=fusion)[0]
+
+
+_default_searcher = None
+
+
+def get_searcher(load_mode=None, subset=None):
+    """Process-wide ShardedSearcher, created on first use."""
+    global _default_searcher
+    if _default_searcher is None:
+        _default_searcher = ShardedSearcher(load_mode=load_mode or SHARD_LOAD_MODE,
+                                            subset=subset or parse_subset(SHARD_SUBSET))
+    return _default_searcher
+
+
+def search(query, top_k=10, tags=None, mode=None, fusion=None):
+    return get_searcher().search(query, top_k=top_k, tags=tags, mode=mode, fusion=fusion)
+
+
+def search_batch(queries, top_k=10, tags=None, mode=None, fusion=None):
+    return get_searcher().search_batch(queries, top_k=top_k, tags=tags, mode=mode, fusion=fusion)
+
+
+def iter_batch_queries(stream):
+    """
+    Parse JSONL queries: each line is either a JSON string or an object with
+    "query" (plus optional "id"). Plain non-JSON lines are taken as the query text.
+    """
+    for n, line in enumerate(stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            obj = line
+        if isinstance(obj, str):
+            yield {"id": n, "query": obj}
+        elif isinstance(obj, dict) and obj.get("query"):
+            yield {"id": obj.get("id", n), "query": obj["query"]}
+        else:
+            print(f"[INFER] Skipping batch line {n}: no query", file=sys.stderr)
+
+
+def run_batch(stream, out, top_k=10, batch_size=ENCODE_BATCH, searcher=None, tags=None, mode=None, fusion=None):
+    """Stream queries from `stream` and write one JSONL result line per query to `out`."""
+    searcher = searcher or get_searcher()
+    pending = []
+
+    def flush():
+        outs = searcher.search_batch([p["query"] for p in pending], top_k=top_k, tags=tags, mode=mode, fusion=fusion)
+        for p, results in zip(pending, outs):
+            out.write(json.dumps({"id": p["id"], "query": p["query"], "results": results}, ensure_ascii=False) + "\n")
+        out.flush()
+        pending.clear()
+
+    for item in iter_batch_queries(stream):
+        pending.append(item)
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+
+
+# --------------------- SERVER ---------------------
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /search?q=...&top_k=10&tags=python,pandas&mode=hybrid&fusion=rrf
+    POST /search  {"query": "...", "top_k": 10, "tags": ["python"], "mode": "hybrid"}
+    POST /search_batch  {"queries": ["...", ...], "top_k": 10, "tags": ["python"], "mode": "hybrid"}
+    POST /retrieve  {"queries": [...], "embeddings": [[...], ...], "top_k": 50, "mode": "hybrid"}  (shard servers)
+    GET  /health
+    GET  /metrics  (Prometheus text; METRICS=1)
+    """
+
+    searcher = None
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) pair
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def _write(self, body):
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # client gone, e.g. the losing copy of a coordinator's hedged request
+            pass
+
+    def _send_text(self, status, text, content_type="text/plain; version=0.0.4"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    @staticmethod
+    def _options(get):
+        """tags / mode / fusion search options from a request (`get(name)` returns a value or None)."""
+        return {"tags": get("tags") or None, "mode": get("mode") or None, "fusion": get("fusion") or None}
+
+    def _run_search(self, query, top_k, options):
+        if not query:
+            self._send_json(400, {"error": "missing query"})
+            return
+        try:
+            results = self.searcher.search(query, top_k=int(top_k), **options)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"query": query, "results": results, **(self.searcher.last_status() or {})})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(200, {"status": "ok", "shards": len(self.searcher.shards()),
+                                  "cache": self.searcher.cache_stats()})
+            return
+        if url.path == "/metrics":
+            if not metrics.ENABLED:
+                self._send_json(404, {"error": "metrics disabled (set METRICS=1)"})
+                return
+            self._send_text(200, metrics.prometheus_text(metrics.report("search_server")))
+            return
+        if url.path != "/search":
+            self._send_json(404, {"error": "not found"})
+            return
+        params = parse_qs(url.query)
+        options = self._options(lambda name: params.get(name, [None])[0])
+        self._run_search(params.get("q", [""])[0], params.get("top_k", ["10"])[0], options)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path not in ("/search", "/search_batch", "/retrieve"):
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON body"})
+            return
+        options = self._options(payload.get)
+        if path == "/search":
+            self._run_search(payload.get("query"), payload.get("top_k", 10), options)
+            return
+        queries = payload.get("queries") or []
+        top_k = int(payload.get("top_k", 10))
+        try:
+            if path == "/retrieve":
+                results = self.searcher.retrieve(queries, top_k=top_k, tags=options["tags"], mode=options["mode"],
+                                                 embeddings=payload.get("embeddings"))
+            else:
+                results = self.searcher.search_batch(queries, top_k=top_k, **options)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        if path == "/retrieve":
+            self._send_json(200, {"results": results, "shards": [name for name, _, _ in self.searcher.shards()]})
+            return
+        self._send_json(200, {"results": results, **(self.searcher.last_status() or {})})
+
+    def log_message(self, fmt, *args):
+        print("[INFER-SERVER]", self.address_string(), fmt % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(searcher, host="127.0.0.1", port=8765, unix_socket=None):
+    handler = type("BoundSearchRequestHandler", (SearchRequestHandler,), {"searcher": searcher})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, handler)
+        where = f"unix:{unix_socket}"
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        where = f"http://{host}:{port}"
+    subset = getattr(searcher, "subset", None)
+    part = f" (partition {subset[0]}/{subset[1]})" if subset else ""
+    print(f"[INFER-SERVER] Serving {len(searcher.shards())} shards{part} on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("query", type=str)
+    parser.add_argument("query", type=str, nargs="?")
     parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--tags", default=None, help="comma-separated tags; only rows with any of them are searched")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default=SEARCH_MODE,
+                        help="vector (FAISS), lexical (BM25) or hybrid (both, fused)")
+    parser.add_argument("--fusion", choices=FUSION_METHODS, default=FUSION, help="hybrid score fusion method")
+    parser.add_argument("--serve", action="store_true", help="run a resident query server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None, help="serve on a Unix socket instead of TCP")
+    parser.add_argument("--batch", default=None, metavar="JSONL",
+                        help="read queries from a JSONL file ('-' for stdin) and stream JSONL results")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH)
+    parser.add_argument("--no-warm-up", action="store_true", help="with --serve: load the model on the first query")
+    parser.add_argument("--load-mode", choices=LOAD_MODES, default=SHARD_LOAD_MODE,
+                        help="eager: read shards into RAM; mmap: map them read-only (shared page cache)")
+    parser.add_argument("--shard-subset", default=SHARD_SUBSET, metavar="I/N",
+                        help="only load partition I of N of the segments (shard server for shard_coordinator.py)")
     args = parser.parse_args()
-    out = search(args.query, top_k=args.top_k)
-    print(json.dumps(out, indent=2, ensure_ascii=False))
+    try:
+        subset = parse_subset(args.shard_subset)
+    except ValueError as e:
+        parser.error(str(e))
+    get_searcher(load_mode=args.load_mode, subset=subset)
+
+    if args.batch:
+        with metrics.run("search_batch"):
+            if args.batch == "-":
+                run_batch(sys.stdin, sys.stdout, top_k=args.top_k, batch_size=args.batch_size, tags=args.tags,
+                          mode=args.mode, fusion=args.fusion)
+            else:
+                with open(args.batch, "r", encoding="utf-8") as f:
+                    run_batch(f, sys.stdout, top_k=args.top_k, batch_size=args.batch_size, tags=args.tags,
+                              mode=args.mode, fusion=args.fusion)
+    elif args.serve:
+        searcher = get_searcher()
+        searcher.refresh()
+        # shard servers get query vectors from the coordinator: their model loads only if queried directly
+        if not args.no_warm_up and subset is None:
+            print(f"[INFER-SERVER] Model warm-up took {warm_up(MODEL_NAME):.2f}s", file=sys.stderr)
+        serve(searcher, host=args.host, port=args.port, unix_socket=args.unix_socket)
+    else:
+        if not args.query:
+            parser.error("query is required unless --serve or --batch is given")
+        out = search(args.query, top_k=args.top_k, tags=args.tags, mode=args.mode, fusion=args.fusion)
+        print(json.dumps(out, indent=2, ensure_ascii=False))
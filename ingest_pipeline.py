@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+ingest_pipeline.py
+- Pipelined embedding for large backfills: reading, encoding and index writes run concurrently
+  instead of taking turns
+    reader   thread: parses train.jsonl chunks, drops duplicates, looks up cached vectors and
+             queues the remaining texts (its cache lookups use their own SQLite connections)
+    encoders INGEST_WORKERS processes, each with its own copy of the model, pinned to its own
+             cores (INGEST_PIN=1) with as many BLAS / torch threads, encoding in ENCODE_BATCH batches
+    writer   the calling thread: gets the vectors back in input order, stores them in the embedding
+             cache and adds them to FAISS / metadata
+- Stages are connected by bounded queues and at most INGEST_INFLIGHT chunks (default 2 per worker)
+  are between reader and writer, so memory stays capped at a few chunks whatever the input size
+- sharded_rag_update.py uses it when INGEST_WORKERS > 1; output is the same as the in-process path
+- Workers are started with INGEST_START_METHOD (default spawn: no model or FAISS state is inherited)
+
+    python ingest_pipeline.py --bench --workers 0 1 2 4 --docs 20000 [--fake]
+  reports docs/sec (encode + FAISS add) per worker count on a synthetic corpus; 0 is the in-process
+  baseline, --fake uses the benchmark embedder instead of the real model
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+
+import embedding_model
+import metrics
+from embedding_cache import EmbeddingCache
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))
+INGEST_INFLIGHT = int(os.environ.get("INGEST_INFLIGHT", "0"))   # 0: 2 chunks per worker
+INGEST_PIN = os.environ.get("INGEST_PIN", "1") == "1"
+INGEST_START_METHOD = os.environ.get("INGEST_START_METHOD", "spawn")
+ENCODE_BATCH = embedding_model.ENCODE_BATCH
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+POLL_S = 0.5
+_DONE = -1
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _worker(tasks, results, model_name, batch_size, cores, threads, setup):
+    # before the model (and torch) is imported, so its thread pools are sized for this worker
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    if setup:
+        setup()
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    while True:
+        job = tasks.get()
+        if job is None:
+            return
+        seq, texts = job
+        try:
+            results.put((seq, embedding_model.encode(texts, model_name, batch_size=batch_size), None))
+        except Exception:
+            results.put((seq, None, traceback.format_exc()))
+
+
+class EncodePool:
+    """
+    N encoder processes. map() streams (payload, texts) jobs through them and yields
+    (payload, vectors) in input order. `setup` (a picklable callable) runs in every worker before
+    the first job, e.g. to install a stand-in model.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS, batch_size=ENCODE_BATCH, model_name=None, setup=None,
+                 inflight=None, pin=INGEST_PIN):
+        ctx = mp.get_context(INGEST_START_METHOD)
+        self.workers = max(1, workers)
+        self.inflight = inflight or INGEST_INFLIGHT or 2 * self.workers
+        self.tasks = ctx.Queue(maxsize=self.inflight)
+        self.results = ctx.Queue(maxsize=self.inflight + 1)
+        cores = _available_cores()
+        per = max(1, len(cores) // self.workers)
+        self.procs = []
+        for i in range(self.workers):
+            mine = [cores[(i * per + j) % len(cores)] for j in range(per)] if pin else None
+            p = ctx.Process(target=_worker, name=f"encoder-{i}", daemon=True,
+                            args=(self.tasks, self.results, model_name, batch_size, mine, per, setup))
+            p.start()
+            self.procs.append(p)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(abort=exc_type is not None)
+
+    def close(self, abort=False):
+        if not abort:
+            for _ in self.procs:
+                self.tasks.put(None)
+            for p in self.procs:
+                p.join(timeout=30)
+        else:
+            # jobs nobody will read may still sit in the queues' feeder threads, which the
+            # interpreter would otherwise wait for at exit (a dead encoder hung the whole run)
+            for q in (self.tasks, self.results):
+                q.cancel_join_thread()
+                q.close()
+        for p in self.procs:
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+    def _put(self, q, item, stop):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=POLL_S)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self):
+        while True:
+            try:
+                return self.results.get(timeout=POLL_S)
+            except queue.Empty:
+                dead = [p.name for p in self.procs if p.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"Embedding worker(s) died: {', '.join(dead)}")
+
+    def map(self, jobs):
+        """
+        `jobs` yields (payload, texts) and is consumed by the reader thread, so producing jobs
+        overlaps encoding and whatever the caller does with the results. Jobs whose texts are empty
+        skip the encoders and come back with vectors None.
+        """
+        slots = threading.Semaphore(self.inflight)
+        stop = threading.Event()
+        payloads = {}
+        failure = []
+
+        def read():
+            n = 0
+            try:
+                for payload, texts in jobs:
+                    while not slots.acquire(timeout=POLL_S):
+                        if stop.is_set():
+                            return
+                    payloads[n] = payload
+                    if texts:
+                        sent = self._put(self.tasks, (n, list(texts)), stop)
+                    else:
+                        sent = self._put(self.results, (n, None, None), stop)
+                    if not sent:
+                        return
+                    n += 1
+            except BaseException as e:
+                failure.append(e)
+            self._put(self.results, (_DONE, n, None), stop)
+
+        reader = threading.Thread(target=read, name="ingest-reader", daemon=True)
+        reader.start()
+        pending, next_seq, total = {}, 0, None
+        try:
+            while total is None or next_seq < total:
+                if next_seq in pending:
+                    vectors = pending.pop(next_seq)
+                    yield payloads.pop(next_seq), vectors
+                    next_seq += 1
+                    slots.release()
+                    continue
+                with metrics.span("ingest.wait"):
+                    seq, vectors, error = self._get()
+                if seq == _DONE:
+                    if failure:
+                        raise failure[0]
+                    total = vectors
+                elif error:
+                    raise RuntimeError(f"Embedding worker failed:\n{error}")
+                else:
+                    pending[seq] = vectors
+        finally:
+            stop.set()
+            reader.join(timeout=POLL_S * 4)
+
+
+def encode_chunks(chunks, cache=None, workers=INGEST_WORKERS, batch_size=ENCODE_BATCH, model_name=None, setup=None):
+    """
+    Pipelined counterpart of sharded_rag_update's in-process encode loop. `chunks` yields lists of
+    (item, content_hash); yields (chunk, float32 embeddings) in order. `chunks` is consumed and
+    cached vectors are looked up on the reader thread (the lookups on a connection of its own), new
+    vectors are stored by the writer on `cache`: anything `chunks` reads from the cache must use
+    another connection than `cache` (sharded_rag_update opens one for its dedupe lookups).
+    """
+    reader_cache = EmbeddingCache(cache.model_name, cache.path) if cache else None
+
+    def jobs():
+        for chunk in chunks:
+            found = reader_cache.get_many([key for _, key in chunk]) if reader_cache else {}
+            missing = [(item, key) for item, key in chunk if key not in found]
+            yield (chunk, found, missing), [item.get("text", "") for item, _ in missing]
+
+    try:
+        with EncodePool(workers, batch_size, model_name, setup) as pool:
+            for (chunk, found, missing), vectors in pool.map(jobs()):
+                if missing:
+                    keys = [key for _, key in missing]
+                    vectors = np.asarray(vectors, dtype="float32")
+                    if cache:
+                        cache.put_many(keys, vectors)
+                    found.update(zip(keys, vectors))
+                if cache:
+                    cache.hits += len(chunk) - len(missing)
+                    cache.misses += len(missing)
+                metrics.count("ingest.encoded", len(missing))
+                yield chunk, np.vstack([found[key] for _, key in chunk]).astype("float32")
+    finally:
+        if reader_cache:
+            reader_cache.close()
+
+
+# --------------------- throughput report ---------------------
+
+def _bench_one(texts, workers, chunk_size, batch_size, setup):
+    import faiss
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    index = None
+    start = time.perf_counter()
+    first = None
+    if workers == 0:
+        encoded = ((c, embedding_model.encode(c, batch_size=batch_size)) for c in chunks)
+        pool = None
+    else:
+        pool = EncodePool(workers, batch_size, setup=setup)
+        encoded = pool.map((c, c) for c in chunks)
+    try:
+        for _, vectors in encoded:
+            first = first or time.perf_counter() - start
+            if index is None:
+                index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(np.ascontiguousarray(vectors, dtype="float32"))
+    finally:
+        if pool:
+            pool.close()
+    elapsed = time.perf_counter() - start
+    return {"workers": workers, "docs": len(texts), "seconds": round(elapsed, 3),
+            "first_chunk_s": round(first or 0.0, 3), "docs_per_s": round(len(texts) / elapsed, 1)}
+
+
+def bench(worker_counts, docs, chunk_size, batch_size, fake_dim=None):
+    from benchmarks.corpus import iter_corpus
+
+    texts = [item["text"] for item in iter_corpus(docs)]
+    setup = None
+    if fake_dim:
+        from benchmarks.fake_embedder import install
+        setup = functools.partial(install, embedding_model.MODEL_NAME, fake_dim)
+        setup()
+    report = []
+    for workers in worker_counts:
+        row = _bench_one(texts, workers, chunk_size, batch_size, setup)
+        print(json.dumps(row), flush=True)
+        report.append(row)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="docs/sec per worker count on a synthetic corpus")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="worker counts (0 = in-process)")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=1024, help="texts per queued chunk")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH)
+    parser.add_argument("--fake", type=int, nargs="?", const=384, default=None, metavar="DIM",
+                        help="use the benchmark embedder (no model download)")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.workers, args.docs, args.chunk, args.batch_size, args.fake)
+    else:
+        parser.print_help()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+lexical_index.py
+- Per-segment BM25 index over the metadata `text` field, stored as a contentless SQLite FTS5
+  table (only the inverted index, not the text): metadata_0001.jsonl -> metadata_0001.fts.sqlite,
+  delta_000001.jsonl -> delta_000001.fts.sqlite; listed as "lexical_file" in manifest.json
+- rowid = the row's FAISS id in the same segment, so lexical and vector hits refer to the same rows
+- Built incrementally by sharded_rag_update as rows are added (committed when the segment is written)
+- Queries are split into word tokens and OR-ed, ranked with FTS5's bm25(); exact identifiers such as
+  `bucket4j`, class names or error codes match even when the embedding does not rank them
+- `python lexical_index.py --build` backfills indexes for segments written before they existed
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from metadata_store import open_metadata
+from shard_catalog import ShardCatalog
+
+RAG_DIR = Path("rag_storage")
+TOKENIZER = "unicode61 remove_diacritics 2 tokenchars '_'"
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_QUERY_TOKENS = 32
+
+
+def lexical_path_for(meta_path):
+    return Path(meta_path).with_suffix(".fts.sqlite")
+
+
+def match_expression(query):
+    """FTS5 MATCH string: every word token of `query` as a quoted term, OR-ed (None if no tokens)."""
+    tokens = list(dict.fromkeys(t.lower() for t in TOKEN_RE.findall(query or "")))[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return None
+    return " OR ".join(f'"{t}"' for t in tokens)
+
+
+class LexicalIndex:
+    """BM25 index of one segment. Writers call add_rows() then commit(); readers call search()."""
+
+    def __init__(self, path, readonly=False):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.db.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(text, content='', tokenize=\"{TOKENIZER}\")"
+            )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def max_row(self):
+        row = self.db.execute("SELECT MAX(rowid) FROM docs").fetchone()[0]
+        return -1 if row is None else row
+
+    def add_rows(self, start_row, metas):
+        """Index the `text` of `metas` as rows start_row, start_row + 1, ... (uncommitted)."""
+        self.db.executemany(
+            "INSERT INTO docs(rowid, text) VALUES (?, ?)",
+            [(start_row + i, meta.get("text", "")) for i, meta in enumerate(metas)],
+        )
+
+    def commit(self):
+        self.db.commit()
+
+    def search(self, query, k=10, max_row=None, allowed_rows=None, excluded_rows=None):
+        """
+        [(row, bm25)] best first; bm25 is FTS5's score (more negative = better).
+        Rows >= max_row are ignored; `allowed_rows` (e.g. a tag filter) restricts matches and
+        `excluded_rows` (e.g. tombstones) removes them, both before the LIMIT.
+        """
+        expr = match_expression(query)
+        if expr is None:
+            return []
+        sql = "SELECT rowid, bm25(docs) FROM docs WHERE docs MATCH ?"
+        args = [expr]
+        if max_row is not None:
+            sql += " AND rowid < ?"
+            args.append(int(max_row))
+        if allowed_rows is not None:
+            sql += " AND rowid IN (SELECT value FROM json_each(?))"
+            args.append(json.dumps([int(r) for r in allowed_rows]))
+        if excluded_rows is not None and len(excluded_rows):
+            sql += " AND rowid NOT IN (SELECT value FROM json_each(?))"
+            args.append(json.dumps([int(r) for r in excluded_rows]))
+        sql += " ORDER BY rank LIMIT ?"
+        args.append(int(k))
+        with self._lock:
+            return self.db.execute(sql, args).fetchall()
+
+
+def index_metadata(index, metas, limit=None, batch_size=10000):
+    """Add the first `limit` (default: all) metadata rows to an empty index, streaming in batches."""
+    batch, start = [], 0
+    for row, meta in enumerate(metas):
+        if limit is not None and row >= limit:
+            break
+        batch.append(meta)
+        if len(batch) >= batch_size:
+            index.add_rows(start, batch)
+            start += len(batch)
+            batch = []
+    if batch:
+        index.add_rows(start, batch)
+    index.commit()
+
+
+def open_for_append(meta_path, store, rows):
+    """
+    LexicalIndex for a segment that is about to get new rows after its first `rows` rows.
+    The index is (re)built from the metadata store when it is missing or holds rows the
+    FAISS index never got (a run that died between committing it and writing the index).
+    """
+    path = lexical_path_for(meta_path)
+    if path.exists():
+        index = LexicalIndex(path)
+        if index.max_row() < rows:
+            return index
+        index.close()
+        path.unlink()
+    index = LexicalIndex(path)
+    if rows:
+        index_metadata(index, store, limit=rows)
+    return index
+
+
+def build_missing(rag_dir=RAG_DIR):
+    """Build lexical indexes for manifest entries without one and record them. Returns the count built."""
+    rag_dir = Path(rag_dir)
+    catalog = ShardCatalog(rag_dir)
+    manifest = catalog.load()
+    built = 0
+    for entry in catalog.entries(manifest):
+        meta_file = entry.get("meta_file")
+        if not meta_file or (entry.get("lexical_file") and (rag_dir / entry["lexical_file"]).exists()):
+            continue
+        metas = open_metadata(rag_dir / meta_file)
+        path = lexical_path_for(rag_dir / meta_file)
+        if path.exists():
+            path.unlink()
+        index = LexicalIndex(path)
+        index_metadata(index, metas)
+        index.close()
+        entry["lexical_file"] = path.name
+        built += 1
+        print(f"[LEXICAL] Built {path.name} ({len(metas)} rows)")
+    if built:
+        catalog.save(manifest)
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--build", action="store_true", help="build lexical indexes for segments that lack one")
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    args = parser.parse_args()
+
+    if args.build:
+        build_missing(args.rag_dir)
+    else:
+        parser.print_help()
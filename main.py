@@ -2,22 +2,30 @@ from stackoverflow_scraper import fetch_stackoverflow_qa
 from train_buffer_manager import append_to_train_buffer, clear_train_buffer
 from rag_builder import build_rag_component
 from hf_rag_uploader import merge_and_upload_rag
+import metrics
 
 def run():
-    print("🔎 Scraping StackOverflow Q&A...")
-    qa = fetch_stackoverflow_qa()
+    # METRICS=1: per-stage timings in .cache/metrics/hourly.json (see metrics.py)
+    with metrics.run("hourly"):
+        print("🔎 Scraping StackOverflow Q&A...")
+        with metrics.span("fetch"):
+            qa = fetch_stackoverflow_qa()
 
-    print("✍ Writing to train.jsonl...")
-    append_to_train_buffer(qa)
+        print("✍ Writing to train.jsonl...")
+        with metrics.span("buffer"):
+            append_to_train_buffer(qa)
 
-    print("🧠 Converting train.jsonl → RAG...")
-    temp_rag = build_rag_component()
+        print("🧠 Converting train.jsonl → RAG...")
+        with metrics.span("rag_build"):
+            temp_rag = build_rag_component()
 
-    print("☁ Uploading RAG to HuggingFace (Versioned)...")
-    merge_and_upload_rag(temp_rag)
+        print("☁ Uploading RAG to HuggingFace (Versioned)...")
+        with metrics.span("upload"):
+            merge_and_upload_rag(temp_rag)
 
-    print("🧹 Clearing train.jsonl...")
-    clear_train_buffer()
+        print("🧹 Clearing train.jsonl...")
+        with metrics.span("clear"):
+            clear_train_buffer()
 
     print("✅ Completed hourly RAG update.")
 
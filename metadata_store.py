@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+metadata_store.py
+- Compact, append-only per-shard metadata: metadata_XXXX.jsonl (one compact JSON record per line)
+  plus metadata_XXXX.idx (fixed-width little-endian uint64 (offset, length) pair per row)
+- Row i is fetched with two pread() calls, so a search only parses its top_k rows
+- New rows are appended to both files; nothing is ever rewritten
+- `python metadata_store.py --migrate` converts legacy metadata_*.json lists in rag_storage/
+  and points manifest.json at the new files
+"""
+
+import argparse
+import json
+import os
+import struct
+from pathlib import Path
+
+RAG_DIR = Path("rag_storage")
+INDEX_ENTRY = struct.Struct("<QQ")   # (byte offset, byte length) of a row in the .jsonl file
+
+
+def dumps_record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def index_path_for(data_path):
+    return Path(data_path).with_suffix(".idx")
+
+
+class MetadataStore:
+    """
+    Random-access view over a metadata_XXXX.jsonl/.idx pair.
+    Supports len() and [row] so it can stand in for the old in-memory metadata list.
+    """
+
+    def __init__(self, data_path):
+        self.data_path = Path(data_path)
+        self.index_path = index_path_for(self.data_path)
+        self._data_fd = None
+        self._index_fd = None
+
+    def _fds(self):
+        if self._data_fd is None:
+            self._data_fd = os.open(self.data_path, os.O_RDONLY)
+            self._index_fd = os.open(self.index_path, os.O_RDONLY)
+        return self._data_fd, self._index_fd
+
+    def close(self):
+        for fd in (self._data_fd, self._index_fd):
+            if fd is not None:
+                os.close(fd)
+        self._data_fd = self._index_fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        if not self.index_path.exists():
+            return 0
+        return self.index_path.stat().st_size // INDEX_ENTRY.size
+
+    def __getitem__(self, row):
+        if row < 0:
+            raise IndexError(row)
+        data_fd, index_fd = self._fds()
+        entry = os.pread(index_fd, INDEX_ENTRY.size, row * INDEX_ENTRY.size)
+        if len(entry) < INDEX_ENTRY.size:
+            raise IndexError(row)
+        offset, length = INDEX_ENTRY.unpack(entry)
+        return json.loads(os.pread(data_fd, length, offset))
+
+    def get_many(self, rows):
+        """Fetch several rows; rows that do not exist come back as {}."""
+        out = []
+        for row in rows:
+            try:
+                out.append(self[row])
+            except IndexError:
+                out.append({})
+        return out
+
+    def __iter__(self):
+        """Stream every row in order without loading the file into memory."""
+        if not self.data_path.exists():
+            return
+        with open(self.data_path, "r", encoding="utf-8") as f:
+            for _ in range(len(self)):
+                yield json.loads(f.readline())
+
+    def append(self, records):
+        """Append records as new rows. Data is written before the index so the index never points past it."""
+        if not records:
+            return 0
+        self.data_path.parent.mkdir(parents=True, exist_ok=True)
+        entries = []
+        with open(self.data_path, "ab") as f:
+            offset = f.tell()
+            for rec in records:
+                line = dumps_record(rec).encode("utf-8")
+                f.write(line + b"\n")
+                entries.append(INDEX_ENTRY.pack(offset, len(line)))
+                offset += len(line) + 1
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(entries))
+        return len(entries)
+
+    def truncate(self, rows):
+        """Drop every row from `rows` on (used to discard rows whose vectors never made it to the index)."""
+        if rows >= len(self):
+            return
+        self.close()
+        with open(self.index_path, "rb") as f:
+            f.seek(rows * INDEX_ENTRY.size)
+            offset, _ = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+        os.truncate(self.data_path, offset)
+        os.truncate(self.index_path, rows * INDEX_ENTRY.size)
+
+
+def open_metadata(meta_path):
+    """
+    Open a shard's metadata for reading: a MetadataStore for .jsonl files,
+    or the parsed list for legacy metadata_XXXX.json files.
+    """
+    meta_path = Path(meta_path) if meta_path else None
+    if meta_path is None or not meta_path.exists():
+        return []
+    if meta_path.suffix == ".jsonl":
+        return MetadataStore(meta_path)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def metadata_path_for(rag_dir, num):
+    """Metadata file for shard number `num` ("0001"), preferring the compact format."""
+    compact = Path(rag_dir) / f"metadata_{num}.jsonl"
+    if compact.exists():
+        return compact
+    return Path(rag_dir) / f"metadata_{num}.json"
+
+
+def convert_legacy(json_path, keep=False):
+    """Convert one legacy metadata_XXXX.json list into the .jsonl/.idx format. Returns the new path."""
+    json_path = Path(json_path)
+    out = json_path.with_suffix(".jsonl")
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    # write to temp names first so an interrupted migration leaves the legacy file authoritative
+    tmp = out.with_name(out.name + ".tmp")
+    tmp_store = MetadataStore(tmp)
+    for p in (tmp, tmp_store.index_path):
+        if p.exists():
+            p.unlink()
+    tmp_store.append(records)
+    os.replace(tmp_store.index_path, index_path_for(out))
+    os.replace(tmp, out)
+    if not keep:
+        json_path.unlink()
+    return out
+
+
+def migrate(rag_dir=RAG_DIR, keep=False):
+    """Convert every legacy metadata_*.json in rag_dir and update manifest.json meta_file entries."""
+    rag_dir = Path(rag_dir)
+    converted = {}
+    for p in sorted(rag_dir.glob("metadata_*.json")):
+        out = convert_legacy(p, keep=keep)
+        converted[p.name] = out.name
+        print(f"[META] Converted {p.name} -> {out.name} (+{index_path_for(out).name})")
+
+    manifest_path = rag_dir / "manifest.json"
+    if converted and manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        for entry in manifest.get("shards", []):
+            if entry.get("meta_file") in converted:
+                entry["meta_file"] = converted[entry["meta_file"]]
+        tmp = manifest_path.with_name("manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, manifest_path)
+        print("[META] Updated manifest.json")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--migrate", action="store_true", help="convert legacy metadata_*.json files")
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    parser.add_argument("--keep", action="store_true", help="keep the legacy .json files after converting")
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate(args.rag_dir, keep=args.keep)
+    else:
+        parser.print_help()
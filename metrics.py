@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+metrics.py
+- Lightweight run instrumentation for the hourly pipeline and inference_search
+    with metrics.span("rag_update.encode"): ...      wall + CPU (calling thread) time, call count
+    metrics.count("rag_update.items", len(chunk))    counters for items, bytes, requests, ...
+  Peak RSS is sampled at the end of every span and reported per span and for the whole run
+- Disabled unless METRICS=1: span() then returns one shared no-op context manager and count()
+  returns immediately, so instrumented hot paths cost a function call
+- metrics.run("hourly") wraps a whole run: on exit it writes a JSON report to METRICS_REPORT
+  (default .cache/metrics/<run>.json) and, if METRICS_PROM is set, a Prometheus textfile
+  (node_exporter textfile collector format, replaced atomically)
+- `python metrics.py --show .cache/metrics/hourly.json` prints a report's spans slowest first
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+ENABLED = os.environ.get("METRICS", "0") == "1"
+REPORT_DIR = Path(os.environ.get("METRICS_DIR", ".cache/metrics"))
+REPORT_PATH = os.environ.get("METRICS_REPORT")
+PROM_PATH = os.environ.get("METRICS_PROM")
+PROM_PREFIX = os.environ.get("METRICS_PREFIX", "dreamflow_rag")
+
+_lock = threading.Lock()
+_spans = {}      # name -> {"count", "wall_s", "cpu_s", "max_wall_s", "peak_rss_mb"}
+_counters = {}   # name -> number
+_started = time.time()
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class _Span:
+    __slots__ = ("name", "wall", "cpu")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        rss = peak_rss_mb()
+        with _lock:
+            stats = _spans.get(self.name)
+            if stats is None:
+                stats = _spans[self.name] = {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "max_wall_s": 0.0,
+                                             "peak_rss_mb": 0.0}
+            stats["count"] += 1
+            stats["wall_s"] += wall
+            stats["cpu_s"] += cpu
+            stats["max_wall_s"] = max(stats["max_wall_s"], wall)
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], rss)
+        return False
+
+
+def span(name):
+    """Context manager timing the enclosed block under `name` (no-op unless METRICS=1)."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def count(name, n=1):
+    """Add `n` to counter `name` (no-op unless METRICS=1)."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def reset():
+    global _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def report(run_name=None):
+    with _lock:
+        spans = {name: dict(stats, wall_s=round(stats["wall_s"], 6), cpu_s=round(stats["cpu_s"], 6),
+                            max_wall_s=round(stats["max_wall_s"], 6))
+                 for name, stats in _spans.items()}
+        counters = dict(_counters)
+    return {
+        "run": run_name,
+        "started_at": datetime.fromtimestamp(_started, timezone.utc).isoformat(),
+        "duration_s": round(time.time() - _started, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "spans": spans,
+        "counters": counters,
+    }
+
+
+def _atomic_write(path, text):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return path
+
+
+def _prom_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text(rep, prefix=PROM_PREFIX):
+    """Prometheus exposition text for a report() dict."""
+    run = rep.get("run") or "run"
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in [("run", run)] + labels)
+            lines.append(f"{prefix}_{name}{{{label_text}}} {value}")
+
+    spans = sorted(rep["spans"].items())
+    metric("span_seconds", "gauge", "Wall time spent in a pipeline stage.",
+           [([("span", n)], s["wall_s"]) for n, s in spans])
+    metric("span_cpu_seconds", "gauge", "CPU time (calling thread) spent in a pipeline stage.",
+           [([("span", n)], s["cpu_s"]) for n, s in spans])
+    metric("span_calls", "gauge", "Number of times a pipeline stage ran.",
+           [([("span", n)], s["count"]) for n, s in spans])
+    for name, value in sorted(rep["counters"].items()):
+        metric(_prom_name(name), "gauge", f"Counter {name}.", [([], value)])
+    metric("run_duration_seconds", "gauge", "Duration of the run.", [([], rep["duration_s"])])
+    metric("run_peak_rss_megabytes", "gauge", "Peak resident set size of the run.", [([], rep["peak_rss_mb"])])
+    metric("run_last_completed_timestamp_seconds", "gauge", "When the run finished.", [([], round(time.time(), 3))])
+    return "\n".join(lines) + "\n"
+
+
+def write_report(run_name, path=None, prom_path=PROM_PATH):
+    """Write the JSON report (and the Prometheus textfile if configured). Returns the report."""
+    rep = report(run_name)
+    path = path or REPORT_PATH or REPORT_DIR / f"{run_name}.json"
+    _atomic_write(path, json.dumps(rep, indent=2))
+    if prom_path:
+        _atomic_write(prom_path, prometheus_text(rep))
+    print(f"[METRICS] Wrote {path}" + (f" and {prom_path}" if prom_path else ""), file=sys.stderr)
+    return rep
+
+
+@contextmanager
+def run(name):
+    """Instrument a whole run: a top-level span `name`, and the reports written on exit (if enabled)."""
+    if not ENABLED:
+        yield
+        return
+    reset()
+    try:
+        with span(name):
+            yield
+    finally:
+        write_report(name)
+
+
+def show(path):
+    with open(path, "r", encoding="utf-8") as f:
+        rep = json.load(f)
+    print(f"run={rep['run']} duration={rep['duration_s']}s peak_rss={rep['peak_rss_mb']}MB")
+    for name, s in sorted(rep["spans"].items(), key=lambda kv: -kv[1]["wall_s"]):
+        print(f"  {name:40} {s['wall_s']:10.3f}s wall {s['cpu_s']:10.3f}s cpu {s['count']:8d} calls")
+    for name, value in sorted(rep["counters"].items()):
+        print(f"  {name:40} {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--show", metavar="REPORT", help="print a JSON run report")
+    args = parser.parse_args()
+    if args.show:
+        show(args.show)
+    else:
+        parser.print_help()
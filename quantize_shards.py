@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+quantize_shards.py
+- Converts the float32 flat base shards listed in rag_storage/manifest.json to scalar-quantized
+  FAISS indexes (fp16: 2 bytes/dim, sq8: 1 byte/dim)
+- For every shard it reports size, mean query latency and recall@k before and after; with
+  --dry-run nothing is written, otherwise the shard file is swapped atomically and its manifest
+  entry ("index", "bytes", "sha256") is updated and saved right away, so an interrupted run leaves
+  no converted shard described as flat
+- Delta segments are left alone: they are folded into the (converted) base shards later, and new
+  shards pick their type from INDEX_TYPE (set INDEX_TYPE=fp16|sq8 to keep creating quantized ones)
+
+    python quantize_shards.py --type sq8 --dry-run
+    python quantize_shards.py --type fp16
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from index_factory import RECALL_K, RECALL_QUERIES, TRAIN_SAMPLE, build_shard_index
+from shard_catalog import ShardCatalog
+from shard_io import read_shard_index
+
+RAG_DIR = Path("rag_storage")
+QUANTIZED_TYPES = ("fp16", "sq8")
+
+
+def _latency_ms(index, queries, k):
+    """Mean per-query latency of one batched search, in ms."""
+    start = time.perf_counter()
+    index.search(queries, k)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def _recall(truth, got):
+    return sum(len(set(t) & set(g)) for t, g in zip(truth, got)) / float(truth.size)
+
+
+def quantize_shard(index, index_type):
+    """Build an `index_type` copy of flat `index` (trained on a sample of its own vectors)."""
+    vectors = index.reconstruct_n(0, index.ntotal)
+    step = max(1, len(vectors) // TRAIN_SAMPLE)
+    quantized, info = build_shard_index(index.d, vectors[::step], index_type=index_type)
+    quantized.add(vectors)
+    return quantized, info
+
+
+def quantize_shards(rag_dir=RAG_DIR, index_type="sq8", k=RECALL_K, n_queries=RECALL_QUERIES, dry_run=False):
+    if index_type not in QUANTIZED_TYPES:
+        raise ValueError(f"index_type must be one of {QUANTIZED_TYPES}")
+    rag_dir = Path(rag_dir)
+    catalog = ShardCatalog(rag_dir)
+    if not catalog.exists():
+        print("[QUANT] No manifest.json in", rag_dir)
+        return []
+    manifest = catalog.load()
+
+    report = []
+    for entry in manifest.get("shards", []):
+        if (entry.get("index") or {}).get("type", "flat") != "flat":
+            continue
+        shard_path = rag_dir / entry["shard_file"]
+        flat = read_shard_index(shard_path, mode="eager")
+        if flat.ntotal == 0:
+            continue
+
+        quantized, info = quantize_shard(flat, index_type)
+        rng = np.random.default_rng(0)
+        queries = flat.reconstruct_batch(rng.choice(flat.ntotal, size=min(n_queries, flat.ntotal), replace=False))
+        kk = min(k, flat.ntotal)
+        before_ms = _latency_ms(flat, queries, kk)
+        after_ms = _latency_ms(quantized, queries, kk)
+        _, truth = flat.search(queries, kk)
+        _, got = quantized.search(queries, kk)
+
+        tmp = shard_path.with_name(shard_path.name + ".tmp")
+        faiss.write_index(quantized, str(tmp))
+        row = {
+            "shard": entry["shard_file"],
+            "type": index_type,
+            "vectors": flat.ntotal,
+            "bytes_before": shard_path.stat().st_size,
+            "bytes_after": tmp.stat().st_size,
+            "latency_ms_before": round(before_ms, 4),
+            "latency_ms_after": round(after_ms, 4),
+            f"recall@{kk}_before": 1.0,
+            f"recall@{kk}_after": round(_recall(truth, got), 4),
+        }
+        if dry_run:
+            tmp.unlink()
+        else:
+            os.replace(tmp, shard_path)
+            entry.update(catalog.describe(shard_path, quantized.ntotal))
+            entry["index"] = info
+            entry["updated_at"] = catalog.update_totals(manifest)
+            catalog.save(manifest)
+        print(json.dumps(row))
+        report.append(row)
+
+    if report and not dry_run:
+        print(f"[QUANT] Converted {len(report)} shard(s) to {index_type}; manifest updated")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--type", choices=QUANTIZED_TYPES, default="sq8")
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    parser.add_argument("--k", type=int, default=RECALL_K)
+    parser.add_argument("--queries", type=int, default=RECALL_QUERIES)
+    parser.add_argument("--dry-run", action="store_true", help="report only; leave shards and manifest untouched")
+    args = parser.parse_args()
+    quantize_shards(args.rag_dir, args.type, k=args.k, n_queries=args.queries, dry_run=args.dry_run)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+query_cache.py
+- Two-level cache for inference_search:
+    embeddings: normalized query text -> query embedding          (QUERY_EMB_CACHE_MB)
+    results:    (query, top_k, tags, mode, fusion) -> merged hits  (QUERY_RESULT_CACHE_MB)
+- Both are size-bounded LRUs with hit/miss counters (stats())
+- Results are tied to the manifest's `last_updated`: when it changes (new segments, a fold,
+  a compaction) every cached result is dropped; embeddings only depend on the model and stay.
+  A search stores its result under the version it started with, so a result computed across a
+  refresh is not cached; callers get copies, never the cached lists themselves
+- QUERY_CACHE_DISK=path.sqlite adds an on-disk tier so both caches survive restarts;
+  QUERY_CACHE=0 disables caching
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+QUERY_CACHE_ENABLED = os.environ.get("QUERY_CACHE", "1") == "1"
+QUERY_EMB_CACHE_MB = float(os.environ.get("QUERY_EMB_CACHE_MB", "64"))
+QUERY_RESULT_CACHE_MB = float(os.environ.get("QUERY_RESULT_CACHE_MB", "64"))
+QUERY_CACHE_DISK = os.environ.get("QUERY_CACHE_DISK")
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by the total size of its values (as measured by `sizeof`)."""
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = int(max_bytes)
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()   # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {"entries": len(self._data), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
+
+
+class DiskTier:
+    """SQLite store behind the in-memory LRUs (embeddings and versioned results)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, payload TEXT NOT NULL)")
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def get_embedding(self, key):
+        with self._lock:
+            row = self.db.execute("SELECT vector FROM embeddings WHERE key=?", (key,)).fetchone()
+        return None if row is None else np.frombuffer(row[0], dtype="float32")
+
+    def put_embedding(self, key, vector):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO embeddings(key, vector) VALUES (?, ?)",
+                            (key, np.ascontiguousarray(vector, dtype="float32").tobytes()))
+            self.db.commit()
+
+    def get_results(self, key, version):
+        with self._lock:
+            row = self.db.execute("SELECT payload FROM results WHERE key=? AND version IS ?", (key, version)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_results(self, key, version, results):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO results(key, version, payload) VALUES (?, ?, ?)",
+                            (key, version, json.dumps(results, ensure_ascii=False)))
+            self.db.commit()
+
+    def drop_results(self, keep_version):
+        with self._lock:
+            self.db.execute("DELETE FROM results WHERE version IS NOT ?", (keep_version,))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def _results_size(results):
+    return len(json.dumps(results, ensure_ascii=False))
+
+
+class QueryCache:
+    """Query-embedding + result cache for one embedding model."""
+
+    def __init__(self, model_name, emb_mb=QUERY_EMB_CACHE_MB, result_mb=QUERY_RESULT_CACHE_MB, disk_path=QUERY_CACHE_DISK):
+        self.model_name = model_name
+        self.embeddings = LRUCache(emb_mb * 1024 * 1024, lambda v: v.nbytes)
+        self.results = LRUCache(result_mb * 1024 * 1024, _results_size)
+        self.disk = DiskTier(disk_path) if disk_path else None
+        self.version = None
+        self.invalidations = 0
+        self.disk_hits = 0
+        # a version change and a result write never interleave
+        self._version_lock = threading.Lock()
+
+    def set_version(self, version):
+        """Record the manifest's last_updated; cached results from another version are dropped."""
+        with self._version_lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                self.results.clear()
+                self.invalidations += 1
+            self.version = version
+            if self.disk is not None:
+                self.disk.drop_results(version)
+
+    def _embedding_key(self, query):
+        return f"{self.model_name}\0{normalize_text(query)}"
+
+    def result_key(self, query, top_k, tags=None, mode=None, fusion=None):
+        # the query embedding is a function of the normalized text, so the text stands in for it
+        return json.dumps([self._embedding_key(query), int(top_k), sorted(tags or []), mode, fusion])
+
+    def get_embedding(self, query):
+        key = self._embedding_key(query)
+        vec = self.embeddings.get(key)
+        if vec is None and self.disk is not None:
+            vec = self.disk.get_embedding(key)
+            if vec is not None:
+                self.disk_hits += 1
+                self.embeddings.put(key, vec)
+        return vec
+
+    def put_embedding(self, query, vector):
+        key = self._embedding_key(query)
+        vector = np.array(vector, dtype="float32")
+        self.embeddings.put(key, vector)
+        if self.disk is not None:
+            self.disk.put_embedding(key, vector)
+
+    def get_results(self, key):
+        results = self.results.get(key)
+        if results is None and self.disk is not None:
+            results = self.disk.get_results(key, self.version)
+            if results is not None:
+                self.disk_hits += 1
+                self.results.put(key, results)
+        return copy.deepcopy(results)
+
+    def put_results(self, key, results, version):
+        """
+        Cache `results` of a search that started at `version` (self.version when it began); skipped
+        if a refresh has moved the version on since, as they may predate it.
+        """
+        with self._version_lock:
+            if version != self.version:
+                return
+            self.results.put(key, copy.deepcopy(results))
+            if self.disk is not None:
+                self.disk.put_results(key, version, results)
+
+    def stats(self):
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats(),
+                "version": self.version, "invalidations": self.invalidations,
+                "disk": str(self.disk.path) if self.disk else None, "disk_hits": self.disk_hits}
@@ -1,6 +1,7 @@
 import json
 import uuid
 import os
+import metrics
 
 TRAIN_FILE = "datasets/train.jsonl"
 RAG_FOLDER = "rag"
@@ -16,6 +17,7 @@ def build_rag_component():
     # ✅ Make sure rag/ folder exists
     ensure_rag_folder_exists()
 
+    items = 0
     with open(TRAIN_FILE, "r", encoding="utf-8") as src, \
          open(TEMP_RAG_FILE, "w", encoding="utf-8") as dst:
 
@@ -23,11 +25,17 @@ def build_rag_component():
             data = json.loads(line)
 
             rag_entry = {
-                "id": str(uuid.uuid4()),
+                "id": str(data.get("question_id") or uuid.uuid4()),
                 "text": f"Q: {data['question']} A: {data['answer']}",
                 "tags": data["tags"]
             }
+            if data.get("question_id") is not None:
+                # stable doc_id for upserts / deletes (see id_map.py)
+                rag_entry["question_id"] = data["question_id"]
 
             dst.write(json.dumps(rag_entry) + "\n")
+            items += 1
 
+    metrics.count("rag_build.items", items)
+    metrics.count("rag_build.bytes", os.path.getsize(TEMP_RAG_FILE))
     return TEMP_RAG_FILE
@@ -1,21 +1,29 @@
 import json
 import os
 import uuid
+import metrics
 
 RAG_TEMP_FILE = "rag_components/rag_update_temp.jsonl"
 TRAIN_FILE = "datasets/train.jsonl"
 
 def build_rag_component():
+    items = 0
     with open(TRAIN_FILE, "r", encoding="utf-8") as src, \
          open(RAG_TEMP_FILE, "w", encoding="utf-8") as out:
 
         for line in src:
             data = json.loads(line)
             rag_entry = {
-                "id": str(uuid.uuid4()),
+                "id": str(data.get("question_id") or uuid.uuid4()),
                 "text": f"Q: {data['question']} A: {data['answer']}",
                 "tags": data["tags"]
             }
+            if data.get("question_id") is not None:
+                # stable doc_id for upserts / deletes (see id_map.py)
+                rag_entry["question_id"] = data["question_id"]
             out.write(json.dumps(rag_entry) + "\n")
+            items += 1
 
+    metrics.count("rag_build.items", items)
+    metrics.count("rag_build.bytes", os.path.getsize(RAG_TEMP_FILE))
     return RAG_TEMP_FILE
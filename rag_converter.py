@@ -1,24 +1,141 @@
+"""
+rag_converter.py
+- Turns datasets/*.jsonl records into "Title / Tags / Link" text documents in rag_ready_data.txt,
+  one document per block, each block terminated by a blank line (vector_db.py reads them back)
+- Incremental: a per-file watermark (byte offset + fingerprint of the already-converted prefix) in
+  RAG_CONVERTER_STATE means only lines appended since the last run are converted and appended to
+  the output. When a source file was truncated, rewritten or removed the output is started over
+- Streaming and parallel: every file is read line by line in its own worker process
+  (CONVERTER_WORKERS), which writes its documents to a part file; the parts are then appended to
+  the output in file order. Only complete lines are consumed, so a file still being written is
+  picked up where it stopped on the next run
+"""
+
+import hashlib
 import json
 import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 CLEAN_DATA_PATH = "rag_ready_data.txt"
+DATASETS_DIR = "datasets"
+STATE_PATH = os.environ.get("RAG_CONVERTER_STATE", ".cache/rag_converter_state.json")
+WORKERS = int(os.environ.get("CONVERTER_WORKERS", str(min(4, os.cpu_count() or 1))))
+FINGERPRINT_BYTES = 4096
 
-def convert_jsonl_to_text():
-    all_text = []
-
-    for file in os.listdir("datasets"):
-        if file.endswith(".jsonl"):
-            with open(f"datasets/{file}", "r", encoding="utf-8") as f:
-                for line in f:
-                    data = json.loads(line)
-                    text = f"""
-Title: {data['title']}
-Tags: {', '.join(data['tags'])}
-Link: {data['link']}
-"""
-                    all_text.append(text.strip())
 
-    with open(CLEAN_DATA_PATH, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(all_text))
+def fingerprint(path, upto):
+    """sha1 of the first and the last FINGERPRINT_BYTES before byte `upto`: tells an appended file from a rewritten one."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        h.update(f.read(min(upto, FINGERPRINT_BYTES)))
+        f.seek(max(0, upto - FINGERPRINT_BYTES))
+        h.update(f.read(min(upto, FINGERPRINT_BYTES)))
+    return h.hexdigest()
+
+
+def load_state(path):
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return None
+
+
+def save_state(state, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def resume_offset(path, mark):
+    """Where to continue reading `path` given its stored watermark (0 if it was truncated or rewritten)."""
+    if not mark:
+        return 0
+    offset = mark.get("offset", 0)
+    if os.path.getsize(path) < offset or fingerprint(path, offset) != mark.get("fingerprint"):
+        return 0
+    return offset
+
+
+def format_record(data):
+    # scraper records (question/answer) have no title/link of their own
+    return (f"Title: {data.get('title') or data.get('question', '')}\n"
+            f"Tags: {', '.join(data.get('tags') or [])}\n"
+            f"Link: {data.get('link', '')}")
+
+
+def iter_new_records(path, offset):
+    """Yield (record, end_offset) for every complete JSON line after byte `offset`."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break   # partial line still being written
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line), offset
+            except ValueError:
+                print(f"[CONVERT] Skipping malformed line in {path} before byte {offset}")
+
+
+def convert_file(path, offset, part_path):
+    """Append the documents of `path` after `offset` to `part_path`. Returns (path, new_offset, documents)."""
+    docs = 0
+    with open(part_path, "w", encoding="utf-8") as out:
+        for data, offset_after in iter_new_records(path, offset):
+            out.write(format_record(data).strip() + "\n\n")
+            offset, docs = offset_after, docs + 1
+    return path, offset, docs
+
+
+def convert_jsonl_to_text(datasets_dir=DATASETS_DIR, out_path=CLEAN_DATA_PATH, state_path=STATE_PATH, workers=WORKERS):
+    files = sorted(os.path.join(datasets_dir, f) for f in os.listdir(datasets_dir) if f.endswith(".jsonl"))
+    state = load_state(state_path)
+    fresh = not state or state.get("output") != out_path or not os.path.exists(out_path)
+    if not fresh:
+        offsets = {path: resume_offset(path, state["files"].get(path)) for path in files}
+        fresh = bool(set(state["files"]) - set(files)) or any(
+            offsets[path] == 0 and state["files"].get(path, {}).get("offset") for path in files)
+    if fresh:
+        # no watermarks, or a source was removed / truncated / rewritten: its old documents are in
+        # the output, so start the output over (vector_db.py then rebuilds its index)
+        state = {"output": out_path, "files": {}}
+        offsets = dict.fromkeys(files, 0)
+        open(out_path, "w").close()
+
+    jobs = [(path, offsets[path]) for path in files if offsets[path] < os.path.getsize(path)]
+    if not jobs:
+        print("[CONVERT] No new records")
+        return out_path
+
+    part_dir = tempfile.mkdtemp(prefix="rag_convert_")
+    try:
+        parts = [os.path.join(part_dir, f"{i:05d}.txt") for i in range(len(jobs))]
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                results = list(pool.map(convert_file, [p for p, _ in jobs], [o for _, o in jobs], parts))
+        else:
+            results = [convert_file(p, o, part) for (p, o), part in zip(jobs, parts)]
+
+        # parts are appended in file order; watermarks move only once the output holds their documents
+        with open(out_path, "a", encoding="utf-8") as out:
+            for part in parts:
+                with open(part, "r", encoding="utf-8") as f:
+                    shutil.copyfileobj(f, out)
+        for path, offset, _ in results:
+            state["files"][path] = {"offset": offset, "fingerprint": fingerprint(path, offset)}
+        save_state(state, state_path)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
 
-    return CLEAN_DATA_PATH
+    total = sum(docs for _, _, docs in results)
+    print(f"[CONVERT] Appended {total} documents from {sum(1 for r in results if r[2])} file(s) to {out_path}")
+    return out_path
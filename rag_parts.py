@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+rag_parts.py
+- Incremental publishing of the rag/ JSONL versions: each run uploads its new records as ONE
+  immutable part file plus a small index.json, in a single commit
+      <folder>/parts/rag_version_N/part_000001.jsonl
+      <folder>/index.json   {"versions": {"rag_version_N": {"parts": [...], "records", "bytes"}}, ...}
+- Nothing already on the Hub is downloaded or re-uploaded, so an hourly run costs only that hour's records
+- The commit is made on top of the revision index.json was read at (parent_commit): when another
+  run published in between, the index is re-read and the part renumbered (RAG_PUBLISH_RETRIES)
+- A version rolls over to rag_version_N+1 once its parts reach shard_manager.MAX_MB
+- Consumers rebuild a version by streaming its parts in index order (iter_version_records / reassemble);
+  `python rag_parts.py --reassemble rag_version_1 --out rag/rag_version_1.jsonl`
+- RAG_PUBLISH_MODE=parts (default) uses this; RAG_PUBLISH_MODE=full keeps the old
+  download-append-upload_folder behaviour in hf_rag_uploader / hf_rag_merger
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from huggingface_hub import CommitOperationAdd, HfApi, hf_hub_download
+from huggingface_hub.utils import EntryNotFoundError, HfHubHTTPError
+
+from shard_manager import MAX_MB
+import metrics
+
+RAG_PUBLISH_MODE = os.environ.get("RAG_PUBLISH_MODE", "parts")
+INDEX_FILE = "index.json"
+PUBLISH_RETRIES = int(os.environ.get("RAG_PUBLISH_RETRIES", "5"))
+# create_commit's answer when parent_commit is no longer the head of the branch
+CONFLICT_STATUS = (409, 412)
+VERSION_PREFIX = "rag_version_"
+
+
+def _repo_path(folder, *parts):
+    return "/".join(p for p in (folder, *parts) if p)
+
+
+def empty_index():
+    return {"versions": {}, "active": None, "updated_at": None}
+
+
+def load_remote_index(repo_id, repo_type, folder, revision=None):
+    """The published index.json (at `revision`), or an empty index if nothing has been published yet."""
+    try:
+        path = hf_hub_download(
+            repo_id=repo_id,
+            filename=_repo_path(folder, INDEX_FILE),
+            repo_type=repo_type,
+            revision=revision,
+            force_download=True,
+        )
+    except EntryNotFoundError:
+        return empty_index()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def active_version(index):
+    """Name of the version new parts go to, rolling over once the current one reaches MAX_MB."""
+    versions = index["versions"]
+    if not versions:
+        return f"{VERSION_PREFIX}1"
+    latest = max(versions, key=lambda v: int(v[len(VERSION_PREFIX):]))
+    if versions[latest]["bytes"] < MAX_MB * 1024 * 1024:
+        return latest
+    return f"{VERSION_PREFIX}{int(latest[len(VERSION_PREFIX):]) + 1}"
+
+
+def describe_part(path):
+    """(records, bytes, sha256) of a local JSONL file, in one pass."""
+    sha = hashlib.sha256()
+    records = size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                records += 1
+            size += len(line)
+            sha.update(line)
+    return records, size, sha.hexdigest()
+
+
+def _add_part(index, records, size, sha256):
+    """Append the next part of the active version to `index`. Returns (part entry, version)."""
+    version = active_version(index)
+    entry = index["versions"].setdefault(version, {"parts": [], "records": 0, "bytes": 0})
+    part = {
+        "file": _repo_path("parts", version, f"part_{len(entry['parts']) + 1:06d}.jsonl"),
+        "records": records,
+        "bytes": size,
+        "sha256": sha256,
+        "created_at": int(time.time()),
+    }
+    entry["parts"].append(part)
+    entry["records"] += records
+    entry["bytes"] += size
+    index["active"] = version
+    index["updated_at"] = part["created_at"]
+    return part, version
+
+
+def publish_part(temp_rag, repo_id, repo_type="model", folder="rag", api=None):
+    """
+    Upload `temp_rag` as the next immutable part of the active version, together with the
+    updated index, in one commit on top of the revision the index was read at. Returns the part's
+    index entry (None if there was nothing to upload).
+    """
+    records, size, sha256 = describe_part(temp_rag)
+    if not records:
+        print("[RAG-PARTS] No new records; nothing to publish")
+        return None
+
+    api = api or HfApi()
+    for attempt in range(1, PUBLISH_RETRIES + 1):
+        with metrics.span("upload.load_index"):
+            head = api.repo_info(repo_id=repo_id, repo_type=repo_type).sha
+            index = load_remote_index(repo_id, repo_type, folder, revision=head)
+        part, version = _add_part(index, records, size, sha256)
+        try:
+            with metrics.span("upload.commit"):
+                api.create_commit(
+                    repo_id=repo_id,
+                    repo_type=repo_type,
+                    operations=[
+                        CommitOperationAdd(path_in_repo=_repo_path(folder, part["file"]), path_or_fileobj=str(temp_rag)),
+                        CommitOperationAdd(
+                            path_in_repo=_repo_path(folder, INDEX_FILE),
+                            path_or_fileobj=json.dumps(index, indent=2).encode("utf-8"),
+                        ),
+                    ],
+                    commit_message=f"Add {part['file']} ({records} records)",
+                    parent_commit=head,
+                )
+            break
+        except HfHubHTTPError as e:
+            status = getattr(e.response, "status_code", None)
+            if status not in CONFLICT_STATUS or attempt == PUBLISH_RETRIES:
+                raise
+            # another run committed since `head`: its part may have the same name, start over from its index
+            print(f"[RAG-PARTS] {repo_id} moved past {head} (HTTP {status}); retrying ({attempt}/{PUBLISH_RETRIES})")
+    metrics.count("upload.records", records)
+    metrics.count("upload.bytes", size)
+    print(f"[RAG-PARTS] Published {part['file']} ({records} records, {size} bytes) to {version}")
+    return part
+
+
+def iter_version_records(repo_id, version, repo_type="model", folder="rag", index=None):
+    """Stream the JSON records of `version` part by part (each part's sha256 is checked)."""
+    index = index or load_remote_index(repo_id, repo_type, folder)
+    if version not in index["versions"]:
+        raise KeyError(f"{version} is not in {_repo_path(folder, INDEX_FILE)}")
+    for part in index["versions"][version]["parts"]:
+        path = hf_hub_download(repo_id=repo_id, filename=_repo_path(folder, part["file"]), repo_type=repo_type)
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for line in f:
+                sha.update(line)
+                if line.strip():
+                    yield json.loads(line)
+        if sha.hexdigest() != part["sha256"]:
+            raise ValueError(f"Checksum mismatch for {part['file']}")
+
+
+def reassemble(repo_id, version, out_path, repo_type="model", folder="rag"):
+    """Write `version` as a single JSONL file (the layout of the old rag_version_N.jsonl). Returns the record count."""
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    count = 0
+    with open(tmp, "w", encoding="utf-8") as out:
+        for record in iter_version_records(repo_id, version, repo_type, folder):
+            out.write(json.dumps(record) + "\n")
+            count += 1
+    os.replace(tmp, out_path)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", required=True)
+    parser.add_argument("--repo-type", default="model")
+    parser.add_argument("--folder", default="rag")
+    parser.add_argument("--list", action="store_true", help="print the published versions")
+    parser.add_argument("--reassemble", metavar="VERSION", help="stream VERSION's parts into --out")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    if args.list:
+        idx = load_remote_index(args.repo, args.repo_type, args.folder)
+        for name, v in sorted(idx["versions"].items(), key=lambda kv: int(kv[0][len(VERSION_PREFIX):])):
+            print(f"{name}: {len(v['parts'])} parts, {v['records']} records, {v['bytes']} bytes")
+    elif args.reassemble:
+        out = args.out or f"{args.folder or 'rag'}/{args.reassemble}.jsonl"
+        n = reassemble(args.repo, args.reassemble, out, args.repo_type, args.folder)
+        print(f"[RAG-PARTS] Wrote {n} records to {out}")
+    else:
+        parser.print_help()
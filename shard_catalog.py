@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+shard_catalog.py
+- One manifest file is the source of truth for a folder of segment files:
+    rag_storage/manifest.json -> FAISS shards ("shards") and delta segments ("deltas")
+    rag/catalog.json          -> rag_version_N.jsonl files (shard_manager)
+- Each entry records id, file, size in bytes, record count, sha256 checksum and the row offset
+  of its first record in the concatenated section
+- Entries are kept in id order, so the active (last) entry is an O(1) lookup; the next id comes
+  from a stored counter, never from counting or lexicographically sorting files
+- Saves go to a temp file that is fsynced and os.replace()d over the manifest, so readers always
+  see either the previous or the new manifest. Writers write segment files before saving the
+  manifest that lists them, so every listed file is complete
+- `python shard_catalog.py --verify` checks sizes and checksums of rag_storage/ against its manifest
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+RAG_DIR = Path("rag_storage")
+MANIFEST_NAME = "manifest.json"
+HASH_CHUNK = 8 * 1024 * 1024
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def numeric_suffix(name):
+    """Number at the end of a file stem (rag_version_10.jsonl -> 10), for scans without a catalog."""
+    m = re.search(r"(\d+)$", Path(name).stem)
+    return int(m.group(1)) if m else -1
+
+
+def utc_now():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class ShardCatalog:
+    """
+    Load/save a manifest atomically and keep its sections ({"shards": [...], "deltas": [...]})
+    consistent. The manifest dict is plain JSON so existing readers keep working.
+    """
+
+    def __init__(self, root=RAG_DIR, name=MANIFEST_NAME, file_key="shard_file", count_key="vectors"):
+        self.root = Path(root)
+        self.path = self.root / name
+        self.file_key = file_key
+        self.count_key = count_key
+
+    def exists(self):
+        return self.path.exists()
+
+    def mtime_ns(self):
+        return self.path.stat().st_mtime_ns if self.path.exists() else None
+
+    def load(self):
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {}
+        manifest.setdefault("shards", [])
+        manifest.setdefault("total_vectors" if self.count_key == "vectors" else "total_records", 0)
+        return manifest
+
+    def save(self, manifest):
+        """Atomically replace the manifest file (temp file + fsync + os.replace)."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        return manifest
+
+    # ---------------- entries ----------------
+
+    @staticmethod
+    def active(manifest, section="shards"):
+        """The entry new records go to (the last one), or None."""
+        entries = manifest.get(section)
+        return entries[-1] if entries else None
+
+    @staticmethod
+    def entries(manifest, sections=("shards", "deltas")):
+        out = []
+        for section in sections:
+            out.extend(manifest.get(section, []))
+        return out
+
+    @staticmethod
+    def next_id(manifest, section="shards"):
+        """Reserve the next id for `section` (stored counter; seeded from the highest existing id)."""
+        key = f"next_{section.rstrip('s')}_id"
+        nid = manifest.get(key)
+        if nid is None:
+            nid = max((e.get("id", 0) for e in manifest.get(section, [])), default=0) + 1
+        manifest[key] = nid + 1
+        return nid
+
+    def describe(self, path, records, checksum=True):
+        """Size / record count / checksum fields for a segment file."""
+        path = Path(path)
+        info = {"bytes": path.stat().st_size, self.count_key: records}
+        if checksum:
+            info["sha256"] = file_sha256(path)
+        return info
+
+    def record(self, manifest, section, entry):
+        """Insert or replace `entry` (matched by id) and recompute row offsets and totals."""
+        entries = manifest.setdefault(section, [])
+        if entries and entries[-1].get("id") == entry["id"]:
+            entries[-1] = entry
+        else:
+            for i, e in enumerate(entries):
+                if e.get("id") == entry["id"]:
+                    entries[i] = entry
+                    break
+            else:
+                entries.append(entry)
+                entries.sort(key=lambda e: e.get("id", 0))
+        self.update_totals(manifest)
+        return entry
+
+    def update_totals(self, manifest, sections=("shards", "deltas")):
+        total = 0
+        for section in sections:
+            offset = 0
+            for e in manifest.get(section, []):
+                e["row_offset"] = offset
+                offset += e.get(self.count_key, 0)
+            total += offset
+        manifest["total_vectors" if self.count_key == "vectors" else "total_records"] = total
+        manifest["last_updated"] = utc_now()
+        return manifest["last_updated"]
+
+    def verify(self, manifest=None, sections=("shards", "deltas")):
+        """[(file, problem)] for entries whose file is missing or whose size/checksum differ."""
+        manifest = manifest or self.load()
+        problems = []
+        for e in self.entries(manifest, sections):
+            path = self.root / e[self.file_key]
+            if not path.exists():
+                problems.append((e[self.file_key], "missing"))
+            elif "bytes" in e and path.stat().st_size != e["bytes"]:
+                problems.append((e[self.file_key], f"size {path.stat().st_size} != {e['bytes']}"))
+            elif e.get("sha256") and file_sha256(path) != e["sha256"]:
+                problems.append((e[self.file_key], "checksum mismatch"))
+        return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verify", action="store_true", help="check manifest sizes/checksums against the files")
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    args = parser.parse_args()
+
+    if args.verify:
+        issues = ShardCatalog(args.rag_dir).verify()
+        for fname, problem in issues:
+            print(f"[CATALOG] {fname}: {problem}")
+        print(f"[CATALOG] {len(issues)} problem(s)")
+        raise SystemExit(1 if issues else 0)
+    parser.print_help()
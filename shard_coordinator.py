@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+shard_coordinator.py
+- Scatter-gather search over shard servers (`inference_search.py --serve --shard-subset I/N`), each
+  holding one partition of the manifest's segments, so the corpus no longer has to fit one box's RAM
+- The coordinator encodes each query batch once and POSTs query texts + vectors to every partition
+  in parallel (/retrieve); per-retriever hits are merged across partitions (L2 distance / BM25) and,
+  for hybrid, fused exactly as a local ShardedSearcher would (same FUSION / RRF_K / HYBRID_CANDIDATES)
+- SHARD_NODES lists the partitions: comma-separated, replicas of one partition separated by "|"
+    SHARD_NODES="http://10.0.0.5:8801|http://10.0.0.6:8801,http://10.0.0.7:8802"
+- Per partition: a hedged request is sent to the next replica (or the same one again, on a new
+  connection) when no answer came within NODE_HEDGE_MS or an attempt failed, up to NODE_ATTEMPTS
+  attempts in total; the first answer wins. A partition without an answer after NODE_TIMEOUT_MS is
+  left out: results are then marked {"partial": true, "missing": [...]} instead of failing the query
+- `--serve` exposes the same HTTP API as `inference_search.py --serve` (/search, /search_batch,
+  /health, /metrics); `/health` also reports each partition's last latency and error
+- `--local N` starts N shard servers on this machine (ports --node-port .. +N-1, one process per
+  partition of ./rag_storage), e.g. to try scale-out or test failure handling locally:
+
+    python shard_coordinator.py --local 3 --serve --port 8765
+    python shard_coordinator.py --nodes http://127.0.0.1:8801,http://127.0.0.1:8802 "pandas merge"
+"""
+
+import argparse
+import heapq
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from embedding_model import encode, warm_up
+from inference_search import (ENCODE_BATCH, FUSION, FUSION_METHODS, HYBRID_CANDIDATES, MODEL_NAME, SEARCH_MODE,
+                              SEARCH_MODES, fuse_results, serve)
+from tag_index import parse_tags
+
+SHARD_NODES = os.environ.get("SHARD_NODES", "")
+NODE_TIMEOUT_MS = float(os.environ.get("NODE_TIMEOUT_MS", "2000"))
+NODE_HEDGE_MS = float(os.environ.get("NODE_HEDGE_MS", "200"))
+NODE_ATTEMPTS = int(os.environ.get("NODE_ATTEMPTS", "2"))
+LOCAL_NODE_PORT = 8801
+
+
+def parse_nodes(spec):
+    """"a|b,c" -> [["a", "b"], ["c"]]: one replica list per partition."""
+    partitions = []
+    for part in (spec or "").split(","):
+        replicas = [r.strip().rstrip("/") for r in part.split("|") if r.strip()]
+        if replicas:
+            partitions.append(replicas)
+    return partitions
+
+
+def _post(url, body, timeout):
+    request = urllib.request.Request(url + "/retrieve", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def merge_hits(lists, field, top_k):
+    """
+    Best `top_k` hits (smallest `field`, ties by shard and row like the local searcher) across
+    partitions; a (shard, row) seen twice (partitions overlapping during a manifest change) is kept once.
+    """
+    seen = set()
+    merged = []
+    for hit in heapq.merge(*lists, key=lambda h: (h[field], h["shard"], h["row"])):
+        key = (hit["shard"], hit["row"])
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(hit)
+        if len(merged) == top_k:
+            break
+    return merged
+
+
+class ShardCoordinator:
+    """
+    Drop-in for ShardedSearcher (search / search_batch / shards / cache_stats / last_status) whose
+    segments live on shard servers.
+    """
+
+    def __init__(self, partitions, timeout_ms=NODE_TIMEOUT_MS, hedge_ms=NODE_HEDGE_MS, attempts=NODE_ATTEMPTS):
+        if not partitions:
+            raise ValueError("No shard servers given (SHARD_NODES / --nodes)")
+        self.partitions = partitions
+        self.timeout = timeout_ms / 1000
+        self.hedge = hedge_ms / 1000
+        self.attempts = max(1, attempts)
+        # separate pools: a partition call waits on its attempts, which must never queue behind it
+        self._scatter_pool = ThreadPoolExecutor(max_workers=len(partitions) * 4, thread_name_prefix="shard-scatter")
+        # losing (hedged) attempts keep a thread until their own timeout
+        self._rpc_pool = ThreadPoolExecutor(max_workers=len(partitions) * self.attempts * 4, thread_name_prefix="shard-rpc")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._nodes = {i: {"replicas": replicas, "shards": [], "latency_ms": None, "error": None}
+                       for i, replicas in enumerate(partitions)}
+
+    # ---------------- one partition ----------------
+
+    def _call(self, partition, body):
+        """Hedged request to one partition. Returns (response or None, replica, errors)."""
+        replicas = self.partitions[partition]
+        deadline = time.monotonic() + self.timeout
+        inflight, errors = {}, []
+        sent = 0
+
+        def launch():
+            nonlocal sent
+            url = replicas[sent % len(replicas)]
+            inflight[self._rpc_pool.submit(_post, url, body, max(0.001, deadline - time.monotonic()))] = url
+            if sent:
+                metrics.count("coordinator.hedges")
+            sent += 1
+
+        launch()
+        while inflight:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(inflight, timeout=min(remaining, self.hedge) if sent < self.attempts else remaining,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                url = inflight.pop(future)
+                try:
+                    return future.result(), url, errors
+                except (OSError, ValueError, urllib.error.URLError, http.client.HTTPException) as e:
+                    # HTTPException: the node died mid-response (IncompleteRead, RemoteDisconnected)
+                    errors.append(f"{url}: {e}")
+            # slow (nothing done) or failed: hedge to the next replica while attempts remain
+            if sent < self.attempts:
+                launch()
+        if inflight:
+            errors.append(f"timeout after {self.timeout * 1000:.0f}ms")
+        return None, None, errors
+
+    # ---------------- scatter / gather ----------------
+
+    def scatter(self, queries, top_k=10, tags=None, mode=None, fusion=None):
+        """Returns (results per query, status) where status lists the partitions left out."""
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r} (expected one of {SEARCH_MODES})")
+        fusion = fusion or FUSION
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method {fusion!r} (expected one of {FUSION_METHODS})")
+        if not queries:
+            return [], {"partial": False, "missing": []}
+        metrics.count("coordinator.queries", len(queries))
+        n = top_k if mode != "hybrid" else max(top_k, HYBRID_CANDIDATES)
+        payload = {"queries": list(queries), "top_k": n, "tags": parse_tags(tags), "mode": mode}
+        if mode != "lexical":
+            with metrics.span("coordinator.encode"):
+                payload["embeddings"] = np.asarray(encode(list(queries), MODEL_NAME, batch_size=ENCODE_BATCH)).tolist()
+        body = json.dumps(payload).encode("utf-8")
+
+        with metrics.span("coordinator.scatter"):
+            start = time.monotonic()
+            futures = {self._scatter_pool.submit(self._call, i, body): i for i in range(len(self.partitions))}
+            answers, missing = [], []
+            for future, i in futures.items():
+                response, url, errors = future.result()
+                with self._lock:
+                    node = self._nodes[i]
+                    node["error"] = "; ".join(errors) or None
+                    if response is not None:
+                        node["latency_ms"] = round((time.monotonic() - start) * 1000, 2)
+                        node["shards"] = response.get("shards", [])
+                if response is None:
+                    missing.append({"partition": i, "replicas": self.partitions[i], "errors": errors})
+                    metrics.count("coordinator.partitions_missing")
+                    print(f"[COORD] Partition {i} left out: {'; '.join(errors)}", file=sys.stderr)
+                else:
+                    answers.append(response["results"])
+        if not answers:
+            raise RuntimeError("No shard server answered: " + "; ".join(e for m in missing for e in m["errors"]))
+
+        with metrics.span("coordinator.merge"):
+            results = []
+            for q in range(len(queries)):
+                parts = [answer[q] for answer in answers]
+                vector = merge_hits([p.get("vector") or [] for p in parts], "distance", n)
+                lexical = merge_hits([p.get("lexical") or [] for p in parts], "bm25", n)
+                if mode == "vector":
+                    results.append(vector[:top_k])
+                elif mode == "lexical":
+                    results.append(lexical[:top_k])
+                else:
+                    results.append(fuse_results(vector, lexical, top_k, method=fusion))
+        return results, {"partial": bool(missing), "missing": missing}
+
+    def search_batch(self, queries, top_k=10, tags=None, mode=None, fusion=None):
+        results, status = self.scatter(queries, top_k=top_k, tags=tags, mode=mode, fusion=fusion)
+        self._local.status = status
+        return results
+
+    def search(self, query, top_k=10, tags=None, mode=None, fusion=None):
+        return self.search_batch([query], top_k=top_k, tags=tags, mode=mode, fusion=fusion)[0]
+
+    def last_status(self):
+        """{"partial", "missing"} of this thread's last search (None before the first one)."""
+        return getattr(self._local, "status", None)
+
+    def shards(self):
+        with self._lock:
+            return [(name, None, None) for node in self._nodes.values() for name in node["shards"]]
+
+    def cache_stats(self):
+        with self._lock:
+            return {"partitions": [dict(node) for node in self._nodes.values()]}
+
+
+# --------------------- local nodes ---------------------
+
+def _wait_healthy(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/health", timeout=1) as resp:
+                return json.loads(resp.read())
+        except (OSError, ValueError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Shard server {url} did not come up within {timeout:g}s")
+
+
+def start_local_nodes(n, base_port=LOCAL_NODE_PORT, host="127.0.0.1", timeout=120):
+    """
+    Start n shard servers over ./rag_storage (partition i on base_port + i). Returns (processes,
+    node spec); terminate the processes when done.
+    """
+    script = str(Path(__file__).resolve().parent / "inference_search.py")
+    procs, urls = [], []
+    for i in range(n):
+        port = base_port + i
+        procs.append(subprocess.Popen([sys.executable, script, "--serve", "--host", host, "--port", str(port),
+                                       "--shard-subset", f"{i}/{n}"]))
+        urls.append(f"http://{host}:{port}")
+    try:
+        for url in urls:
+            health = _wait_healthy(url, timeout)
+            print(f"[COORD] {url} up ({health.get('shards')} shards)", file=sys.stderr)
+    except Exception:
+        for p in procs:
+            p.terminate()
+        raise
+    return procs, ",".join(urls)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query", type=str, nargs="?")
+    parser.add_argument("--nodes", default=SHARD_NODES, help="partitions: comma-separated, replicas joined with |")
+    parser.add_argument("--local", type=int, default=0, metavar="N", help="start N local shard servers first")
+    parser.add_argument("--node-port", type=int, default=LOCAL_NODE_PORT, help="first port of --local servers")
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--tags", default=None)
+    parser.add_argument("--mode", choices=SEARCH_MODES, default=SEARCH_MODE)
+    parser.add_argument("--fusion", choices=FUSION_METHODS, default=FUSION)
+    parser.add_argument("--timeout-ms", type=float, default=NODE_TIMEOUT_MS, help="per-partition deadline")
+    parser.add_argument("--hedge-ms", type=float, default=NODE_HEDGE_MS, help="hedge to another replica after this long")
+    parser.add_argument("--attempts", type=int, default=NODE_ATTEMPTS, help="requests per partition, hedges included")
+    parser.add_argument("--serve", action="store_true", help="run the coordinator as a query server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-warm-up", action="store_true")
+    args = parser.parse_args()
+
+    procs = []
+    if args.local:
+        # SIGTERM too should run the finally below, which stops the local shard servers
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        procs, args.nodes = start_local_nodes(args.local, args.node_port)
+    try:
+        coordinator = ShardCoordinator(parse_nodes(args.nodes), args.timeout_ms, args.hedge_ms, args.attempts)
+        if args.serve:
+            if not args.no_warm_up:
+                print(f"[COORD] Model warm-up took {warm_up(MODEL_NAME):.2f}s", file=sys.stderr)
+            serve(coordinator, host=args.host, port=args.port)
+        else:
+            if not args.query:
+                parser.error("query is required unless --serve is given")
+            results, status = coordinator.scatter([args.query], top_k=args.top_k, tags=args.tags, mode=args.mode,
+                                                  fusion=args.fusion)
+            print(json.dumps({"results": results[0], **status}, indent=2, ensure_ascii=False))
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+shard_io.py
+- Shared FAISS shard loading for inference_search.py and sharded_rag_update.py
+- SHARD_LOAD_MODE=eager -> faiss.read_index copies the whole shard into RAM (writable)
+- SHARD_LOAD_MODE=mmap  -> shard is memory-mapped read-only; pages are faulted in on demand and
+  every worker process on the host shares them through the page cache
+- `python shard_io.py --report` loads rag_storage/ once per mode (fresh process each) and prints
+  startup time and RSS for each mode
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+RAG_DIR = Path("rag_storage")
+LOAD_MODES = ("eager", "mmap")
+SHARD_LOAD_MODE = os.environ.get("SHARD_LOAD_MODE", "eager")
+
+# newer FAISS builds can mmap flat codes (IndexFlat*, SQ); older ones only mmap IVF lists
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def read_shard_index(path, mode=None):
+    """
+    Read a shard index in the given load mode (default: SHARD_LOAD_MODE).
+    mmap'd indexes are read-only: never add() to them. Falls back to an eager
+    read if this FAISS build cannot map the index type.
+    """
+    mode = mode or SHARD_LOAD_MODE
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown shard load mode {mode!r} (expected one of {LOAD_MODES})")
+    if mode == "mmap":
+        try:
+            return faiss.read_index(str(path), MMAP_FLAGS)
+        except RuntimeError as e:
+            print(f"[SHARD-IO] mmap not supported for {Path(path).name}, reading eagerly:", e, file=sys.stderr)
+    return faiss.read_index(str(path))
+
+
+def _proc_status_mb(key):
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc; falls back to peak RSS)."""
+    rss = _proc_status_mb("VmRSS")
+    if rss is not None:
+        return rss
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _probe(mode, rag_dir):
+    """Load every shard in `rag_dir` with `mode`, run one query, print stats as JSON."""
+    rss_before = current_rss_mb()
+    anon_before = _proc_status_mb("RssAnon") or 0.0
+    start = time.perf_counter()
+    shards = [read_shard_index(p, mode) for p in sorted(Path(rag_dir).glob("shard_*.faiss"))]
+    load_s = time.perf_counter() - start
+    rss_loaded = current_rss_mb()
+
+    start = time.perf_counter()
+    for idx in shards:
+        if idx.ntotal:
+            idx.search(np.random.rand(1, idx.d).astype("float32"), 10)
+    first_query_s = time.perf_counter() - start
+
+    print(json.dumps({
+        "mode": mode,
+        "shards": len(shards),
+        "vectors": sum(idx.ntotal for idx in shards),
+        "startup_s": round(load_s, 4),
+        "rss_after_load_mb": round(rss_loaded - rss_before, 1),
+        "first_query_s": round(first_query_s, 4),
+        "rss_after_query_mb": round(current_rss_mb() - rss_before, 1),
+        # private memory; mmap'd shard pages show up as shared file-backed RSS instead
+        "anon_rss_after_query_mb": round((_proc_status_mb("RssAnon") or 0.0) - anon_before, 1),
+    }))
+
+
+def load_report(rag_dir=RAG_DIR, modes=LOAD_MODES):
+    """Measure each load mode in a fresh interpreter so RSS numbers do not bleed into each other."""
+    report = []
+    for mode in modes:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--probe", mode, "--rag-dir", str(rag_dir)],
+            capture_output=True, text=True, check=True,
+        )
+        report.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report", action="store_true", help="compare eager vs mmap startup time and RSS")
+    parser.add_argument("--probe", choices=LOAD_MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--rag-dir", default=str(RAG_DIR))
+    args = parser.parse_args()
+
+    if args.probe:
+        _probe(args.probe, args.rag_dir)
+    elif args.report:
+        for row in load_report(args.rag_dir):
+            print(json.dumps(row))
+    else:
+        parser.print_help()
@@ -1,28 +1,76 @@
 import os
 
+from shard_catalog import ShardCatalog, numeric_suffix
+
 MAX_MB = 90
 RAG_FOLDER = "rag"
+COMPONENTS_FOLDER = "rag_components"
+CATALOG_NAME = "catalog.json"
+
 
 def file_size_mb(path):
     return os.path.getsize(path) / (1024 * 1024)
 
-def get_active_rag_version():
-    files = sorted([f for f in os.listdir(RAG_FOLDER) if f.startswith("rag_version_")])
 
-    # If no version exists, create version 1
-    if not files:
-        path = f"{RAG_FOLDER}/rag_version_1.jsonl"
-        open(path, "w").close()
-        return path
+def _catalog(folder):
+    return ShardCatalog(folder, CATALOG_NAME, file_key="file", count_key="records")
+
+
+def _count_lines(path):
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def _bootstrap(catalog, prefix):
+    """First run with a catalog: register the existing version files in numeric order."""
+    manifest = catalog.load()
+    files = sorted(
+        (f for f in os.listdir(catalog.root) if f.startswith(prefix) and f.endswith(".jsonl")),
+        key=numeric_suffix,
+    )
+    for f in files:
+        path = catalog.root / f
+        catalog.record(manifest, "shards", {"id": numeric_suffix(f), "file": f, **catalog.describe(path, _count_lines(path))})
+    return catalog.save(manifest)
+
+
+def get_active_rag_version(folder=RAG_FOLDER, prefix="rag_version_"):
+    os.makedirs(folder, exist_ok=True)
+    catalog = _catalog(folder)
+    manifest = catalog.load() if catalog.exists() else _bootstrap(catalog, prefix)
+
+    # O(1): the active version is the catalog's last entry, only its size is checked
+    active = catalog.active(manifest)
+    if active is not None:
+        path = f"{folder}/{active['file']}"
+        if not os.path.exists(path):
+            open(path, "w").close()
+        if file_size_mb(path) < MAX_MB:
+            return path
+
+    # Create the next version file (id from the catalog counter, not from counting files)
+    # and publish it with one atomic catalog save
+    new_version = catalog.next_id(manifest)
+    fname = f"{prefix}{new_version}.jsonl"
+    open(f"{folder}/{fname}", "w").close()
+    catalog.record(manifest, "shards", {"id": new_version, "file": fname, "bytes": 0, "records": 0})
+    catalog.save(manifest)
+    return f"{folder}/{fname}"
+
 
-    latest = f"{RAG_FOLDER}/{files[-1]}"
+def get_active_rag_shard():
+    return get_active_rag_version(COMPONENTS_FOLDER, prefix="rag_shard_")
 
-    # If the latest is under limit, use it
-    if file_size_mb(latest) < MAX_MB:
-        return latest
 
-    # Else create new version file
-    new_version = len(files) + 1
-    path = f"{RAG_FOLDER}/rag_version_{new_version}.jsonl"
-    open(path, "w").close()
-    return path
+def record_append(path):
+    """Refresh the catalog entry (size, records, checksum) of `path` after data was appended to it."""
+    folder, fname = os.path.split(path)
+    catalog = _catalog(folder)
+    manifest = catalog.load()
+    for entry in manifest["shards"]:
+        if entry["file"] == fname:
+            entry.update(catalog.describe(path, _count_lines(path)))
+            catalog.record(manifest, "shards", entry)
+            catalog.save(manifest)
+            return entry
+    return None
@@ -1,38 +1,81 @@
 #!/usr/bin/env python3
 """
 sharded_rag_update.py (patched)
-- Downloads existing manifest + shards from HF (correct filenames)
-- Loads latest shard (if any)
-- Checks real file size of the last shard (MB)
-- If shard >= MAX_SHARD_MB -> create new shard
-- Otherwise append to the same shard
+- Downloads existing manifest + shards/deltas from HF (correct filenames)
+- Each run writes its new vectors as a small immutable delta segment (delta_XXXXXX.faiss/.jsonl)
+  listed under "deltas" in manifest.json; base shards are left untouched
+- Once DELTA_MAX_SEGMENTS deltas exist or they total DELTA_FOLD_MB, deltas are folded into the
+  base shards (also on demand with --fold):
+  - Checks real file size of the last shard (MB)
+  - If shard >= MAX_SHARD_MB -> create new shard (the full shard is never read)
+  - Otherwise load latest shard (eagerly - it is appended to) and append to it
 - Writes updated shard files and manifest into rag_storage/
+- train.jsonl is streamed in INGEST_CHUNK-line chunks: each chunk is encoded and added to FAISS
+  in one bulk call, and rollover at MAX_SHARD_MB is checked between chunks, so memory stays
+  bounded by one chunk plus the open segment
+- Embeddings go through a persistent content-hash cache (embedding_cache.py); texts whose hash is
+  already in rag_storage/ (or repeated within the run) are skipped instead of added again
+- New shards use the index type from INDEX_TYPE (see index_factory.py); trained types are
+  trained at rollover on a sample of the previous shard plus the new vectors
+- Metadata lives in append-only metadata_XXXX.jsonl/.idx files (see metadata_store.py):
+  each run appends only its new rows
+- The embedding model is loaded lazily (embedding_model.py) and the HF download is skipped when
+  train.jsonl has nothing to add, so a no-op run never imports torch or loads the model
+- Each segment gets a tag -> row id inverted index (tag_index.py) next to its metadata, used by
+  inference_search's tag-filtered search
+- ...and a BM25 lexical index (lexical_index.py, SQLite FTS5) over the row texts for hybrid search
+  (LEXICAL_INDEX=0 disables it)
+- manifest.json is handled by shard_catalog.py: atomic saves, stored next ids, and per-segment
+  bytes / sha256 / row_offset
+- Every row carries a stable doc_id (id_map.py; the StackOverflow question id when known): the run
+  records where each doc_id now lives, tombstoning the rows it replaces (upsert), and then saves the
+  manifest listing the new rows once; fold_deltas drops tombstoned delta rows
+- INGEST_WORKERS > 1 encodes in that many model-holding worker processes while the next chunks are
+  read and earlier ones are written (ingest_pipeline.py)
+- METRICS=1 times download / encode / index add / shard write / fold and writes a run report
+  (metrics.py)
 """
 
+import argparse
 import os
 import json
 from pathlib import Path
 from datetime import datetime
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
-from huggingface_hub import hf_hub_download, HfApi, login as hf_login
+from shard_io import read_shard_index
+from metadata_store import MetadataStore, convert_legacy, index_path_for, open_metadata
+from index_factory import (FLAT_INFO, TRAIN_SAMPLE, build_shard_index, estimate_index_mb, needs_training,
+                           reconstruct_vectors, sample_shard_vectors)
+from embedding_cache import EMBED_CACHE_ENABLED, EmbeddingCache, content_hash
+from shard_catalog import ShardCatalog
+from tag_index import TagIndex, tags_path_for
+from lexical_index import lexical_path_for, open_for_append
+from id_map import ID_MAP_NAME, forget_content, id_map_path, open_id_map, publish as publish_id_map, stable_id
+from ingest_pipeline import INGEST_WORKERS, encode_chunks
+import embedding_model
+import metrics
 
 # ------- CONFIG -------
 TRAIN_JSON = "train.jsonl"
 RAG_DIR = Path("rag_storage")
-MODEL_NAME = os.environ.get("EMBED_MODEL", "all-MiniLM-L6-v2")
+MODEL_NAME = embedding_model.MODEL_NAME
 DIM = int(os.environ.get("EMBED_DIM", "384"))
 MAX_SHARD_MB = int(os.environ.get("MAX_SHARD_MB", "90"))   # rollover limit in MB
+DELTA_MAX_SEGMENTS = int(os.environ.get("DELTA_MAX_SEGMENTS", "24"))   # fold after this many delta segments
+DELTA_FOLD_MB = float(os.environ.get("DELTA_FOLD_MB", "16"))           # ...or once deltas total this many MB
+CARRY_INDEX_TYPES = ("flat", "ivf", "hnsw")   # base shards whose vectors read back exactly: a fold may rewrite them
+DELTA_AUTO_FOLD = os.environ.get("DELTA_AUTO_FOLD", "1") == "1"        # fold at the end of a run when due
+INGEST_CHUNK = int(os.environ.get("INGEST_CHUNK", "1024"))   # train.jsonl lines encoded per chunk
+ENCODE_BATCH = int(os.environ.get("ENCODE_BATCH", "64"))
+LEXICAL_INDEX = os.environ.get("LEXICAL_INDEX", "1") == "1"   # build per-segment BM25 indexes
 HF_REPO = os.environ.get("HF_REPO")
 HF_TOKEN = os.environ.get("HF_TOKEN")
 # ----------------------
 
 RAG_DIR.mkdir(exist_ok=True)
-MANIFEST = RAG_DIR / "manifest.json"
-
-model = SentenceTransformer(MODEL_NAME)
-
+CATALOG = ShardCatalog(RAG_DIR)
+MANIFEST = CATALOG.path
 
 # --------------------- UTILS ---------------------
 
@@ -53,6 +96,8 @@ def download_manifest_and_shards_from_hf():
     if not HF_REPO or not HF_TOKEN:
         print("[HF] HF_REPO or HF_TOKEN not set — skipping HF download.")
         return
+    # imported here: the hub client pulls in its whole HTTP stack, which no-op runs never need
+    from huggingface_hub import hf_hub_download, login as hf_login
 
     print("[HF] Logging in to HuggingFace hub...")
     try:
@@ -84,8 +129,10 @@ def download_manifest_and_shards_from_hf():
             print("[HF] Failed to read downloaded manifest.json:", e)
             return
 
-        for entry in manifest.get("shards", []):
-            for fname in (entry.get("shard_file"), entry.get("meta_file")):
+        for entry in manifest.get("shards", []) + manifest.get("deltas", []):
+            meta_fname = entry.get("meta_file")
+            idx_fname = index_path_for(meta_fname).name if meta_fname and meta_fname.endswith(".jsonl") else None
+            for fname in (entry.get("shard_file"), meta_fname, idx_fname, entry.get("tags_file"), entry.get("lexical_file")):
                 if not fname:
                     continue
                 out = RAG_DIR / fname
@@ -104,24 +151,32 @@ def download_manifest_and_shards_from_hf():
                 except Exception as e:
                     print(f"[HF] Could not download {fname}:", e)
 
+        # the id map changes every run and holds the tombstones (without it replaced rows come back):
+        # always fetch the remote copy
+        if manifest.get("id_map"):
+            try:
+                hf_hub_download(repo_id=HF_REPO, filename=manifest["id_map"], local_dir=str(RAG_DIR), token=HF_TOKEN,
+                                force_download=True)
+                print(f"[HF] Downloaded {manifest['id_map']}")
+            except Exception as e:
+                print(f"[HF] Could not download {manifest['id_map']}:", e)
+
 
 def load_local_manifest():
-    if MANIFEST.exists():
-        with open(MANIFEST, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"shards": [], "total_vectors": 0}
+    return CATALOG.load()
 
 
 def save_local_manifest(m):
-    with open(MANIFEST, "w", encoding="utf-8") as f:
-        json.dump(m, f, indent=2, ensure_ascii=False)
+    # atomic: inference_search may be reading rag_storage/ while this job writes
+    CATALOG.save(m)
 
 
-def read_train_json(path=TRAIN_JSON):
-    items = []
+def iter_train_chunks(path=TRAIN_JSON, chunk_size=INGEST_CHUNK):
+    """Yield lists of at most `chunk_size` parsed train.jsonl items, reading the file lazily."""
     if not os.path.exists(path):
         print(f"[RAG] No train file found at {path}")
-        return items
+        return
+    chunk = []
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
@@ -131,15 +186,30 @@ def read_train_json(path=TRAIN_JSON):
                 obj = json.loads(line)
                 if "text" not in obj:
                     obj["text"] = obj.get("content") or obj.get("body") or ""
-                items.append(obj)
+                chunk.append(obj)
             except Exception as e:
                 print("[RAG] Skipping invalid train.jsonl line:", e)
-    return items
+                continue
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def has_train_items(path=TRAIN_JSON):
+    """True if train.jsonl has at least one non-blank line (reads only up to the first one)."""
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        return any(line.strip() for line in f)
 
 
 def load_last_shard(manifest):
     """
-    Return (index_obj or None, metadata_list or [], shard_id or None)
+    Return (index_obj or None, MetadataStore or [], shard_id or None)
+    A legacy metadata_XXXX.json is converted to the .jsonl/.idx format on the way in
+    (the manifest entry is updated in place).
     """
     if not manifest.get("shards"):
         return None, [], None
@@ -156,11 +226,19 @@ def load_last_shard(manifest):
 
     if shard_path.exists():
         try:
-            idx = faiss.read_index(str(shard_path))
-            metas = []
-            if meta_path and meta_path.exists():
-                with open(meta_path, "r", encoding="utf-8") as f:
-                    metas = json.load(f)
+            # always eager: this index is mutated, mmap'd indexes are read-only
+            idx = read_shard_index(shard_path, mode="eager")
+            if meta_path and meta_path.suffix == ".json" and meta_path.exists():
+                meta_path = convert_legacy(meta_path)
+                last["meta_file"] = meta_path.name
+                print(f"[RAG] Converted legacy metadata to {meta_path.name}")
+            if meta_path is None or meta_path.suffix != ".jsonl":
+                meta_path = RAG_DIR / f"metadata_{sid:04d}.jsonl"
+            metas = MetadataStore(meta_path)
+            if len(metas) > idx.ntotal:
+                # rows appended by a run that died before its index was written
+                print(f"[RAG] Dropping {len(metas) - idx.ntotal} orphan metadata rows from {meta_path.name}")
+                metas.truncate(idx.ntotal)
             return idx, metas, sid
         except Exception as e:
             print("[RAG] Failed to load last shard:", e)
@@ -168,109 +246,463 @@ def load_last_shard(manifest):
     return None, [], None
 
 
-def write_shard(index_obj, metadata_list, shard_id):
-    fname = f"shard_{shard_id:04d}.faiss"
-    meta_fname = f"metadata_{shard_id:04d}.json"
+def write_index_file(index_obj, fname):
+    """Write an index next to its final name and swap it in, so readers never see a partial file."""
     out_idx = RAG_DIR / fname
-    out_meta = RAG_DIR / meta_fname
-    faiss.write_index(index_obj, str(out_idx))
-    with open(out_meta, "w", encoding="utf-8") as f:
-        json.dump(metadata_list, f, indent=2, ensure_ascii=False)
-    print(f"[RAG] Wrote shard: {out_idx.name} ({len(metadata_list)} vectors) and {out_meta.name}")
-    return out_idx.name, out_meta.name
+    tmp_idx = RAG_DIR / (fname + ".tmp")
+    faiss.write_index(index_obj, str(tmp_idx))
+    os.replace(tmp_idx, out_idx)
+    return out_idx
+
+
+def build_metadata_entry(item, text_hash=None):
+    return {
+        "text": item.get("text", ""),
+        "source": item.get("source"),
+        "id": item.get("id"),
+        "created_at": item.get("created_at") or datetime.utcnow().isoformat() + "Z",
+        "content_hash": text_hash or content_hash(item.get("text", ""), MODEL_NAME),
+        "doc_id": stable_id(item),
+        "extra": {k: v for k, v in item.items() if k not in ("text", "source", "id", "created_at")}
+    }
 
 
-# --------------------- MAIN ---------------------
+def encode_texts(texts):
+    # the shared model is loaded on the first call, i.e. only when there is something to embed
+    return embedding_model.encode(texts, MODEL_NAME, batch_size=ENCODE_BATCH)
 
-def main():
-    # Download manifest and shard files from HF into rag_storage/
-    download_manifest_and_shards_from_hf()
 
-    manifest = load_local_manifest()
-    print("[RAG] Manifest shards=", len(manifest.get("shards", [])), "total_vectors=", manifest.get("total_vectors", 0))
-
-    # Load last shard (if manifest points to any)
-    last_index, last_meta, last_id = load_last_shard(manifest)
-
-    if last_index is not None:
-        shard_path = RAG_DIR / f"shard_{last_id:04d}.faiss"
-        size_mb = get_shard_size_mb(shard_path)
-
-        if size_mb >= MAX_SHARD_MB:
-            # rollover: create new shard id
-            current_shard_id = last_id + 1
-            current_index = faiss.IndexFlatL2(DIM)
-            current_meta = []
-            current_vectors = 0
-            print(f"[RAG] Last shard size {size_mb:.2f}MB >= {MAX_SHARD_MB}MB -> creating shard {current_shard_id}")
+def iter_fresh_chunks(cache, run_keys, stats):
+    """train.jsonl chunks as lists of (item, content_hash), minus texts already indexed or seen earlier in the run."""
+    for n, chunk in enumerate(iter_train_chunks()):
+        metrics.count("rag_update.items", len(chunk))
+        with metrics.span("rag_update.dedupe"):
+            keys = [content_hash(it.get("text", ""), MODEL_NAME) for it in chunk]
+            already = cache.is_indexed_many(keys) if cache else set()
+        fresh = []
+        for item, key in zip(chunk, keys):
+            if key in already or key in run_keys:
+                continue
+            run_keys.add(key)
+            fresh.append((item, key))
+        stats["skipped"] += len(chunk) - len(fresh)
+        if fresh:
+            print(f"[RAG] Chunk {n + 1}: {len(fresh)} new items, {len(chunk) - len(fresh)} duplicates skipped")
+            yield fresh
+
+
+def encode_chunks_inline(chunks, cache):
+    """Encode each chunk in this process; yields (chunk, embeddings). See ingest_pipeline.encode_chunks."""
+    for fresh in chunks:
+        texts = [item.get("text", "") for item, _ in fresh]
+        with metrics.span("rag_update.encode"):
+            if cache:
+                embeddings = cache.encode(texts, encode_texts, keys=[key for _, key in fresh])
+            else:
+                embeddings = encode_texts(texts)
+        yield fresh, embeddings
+
+
+def open_embedding_cache(manifest):
+    """EmbeddingCache for MODEL_NAME whose indexed-content set matches rag_storage/ (None if disabled)."""
+    if not EMBED_CACHE_ENABLED:
+        return None
+    cache = EmbeddingCache(MODEL_NAME)
+    if manifest.get("total_vectors") and not cache.indexed_count():
+        # fresh cache file (e.g. new CI machine): re-derive which texts are already indexed
+        entries = manifest.get("shards", []) + manifest.get("deltas", [])
+        n = cache.rebuild_indexed(open_metadata(RAG_DIR / e["meta_file"]) for e in entries if e.get("meta_file"))
+        print(f"[RAG] Rebuilt indexed-content set from shard metadata ({n} rows)")
+    return cache
+
+
+def update_manifest_totals(manifest):
+    return CATALOG.update_totals(manifest)
+
+
+def record_locations(manifest, locations, dropped_segments=(), cache=None):
+    """
+    Publish `manifest` (already listing the rows in `locations` and no longer `dropped_segments`):
+    point doc_ids at the new rows, tombstoning the rows they replace (their texts are forgotten in
+    `cache`, see id_map.forget_content), then save the manifest once.
+    Rows moved out of `dropped_segments` (fold / compaction) are not tombstoned; their id-map
+    entries are forgotten after the save. Returns the number of rows replaced.
+    """
+    missing = not id_map_path(RAG_DIR).exists()
+    id_map = open_id_map(RAG_DIR)
+    try:
+        listed = {e["shard_file"] for e in CATALOG.entries(manifest)}
+        # entries for segments no manifest lists: a writer died between its id-map update and its save
+        stale = id_map.segments() - listed - set(dropped_segments)
+        if manifest.get("total_vectors") and (missing or stale):
+            # index the rows of every listed segment (includes `locations`) from their metadata
+            replaced = id_map.rebuild(CATALOG, manifest)
+            print(f"[RAG] Built {ID_MAP_NAME} from shard metadata: {id_map.stats()}")
         else:
+            replaced = id_map.apply(locations, moved_from=dropped_segments)
+        # before the save: a crash after it must not leave a replaced text marked as indexed
+        forget_content(CATALOG, manifest, replaced, cache)
+        publish_id_map(CATALOG, manifest, id_map)
+        if dropped_segments:
+            # only now: until the save above the dropped segments are still searched, with their tombstones
+            id_map.drop_segments(dropped_segments)
+    finally:
+        id_map.close()
+    return len(replaced)
+
+
+class ShardWriter:
+    """
+    Adds vectors + metadata to rag_storage/ segments and records them in the manifest,
+    rolling over to a new segment when the open one reaches MAX_SHARD_MB.
+    kind="delta": every writer starts a fresh, immutable flat delta_XXXXXX segment
+    kind="shard": continues the last base shard (or starts a new INDEX_TYPE shard)
+    max_mb / max_vectors cap each segment (compact_shards.py uses both to write balanced shards);
+    index_type overrides INDEX_TYPE for new shards; a shard writer of a trained type (ivf / sq) holds
+    its first rows back until it has TRAIN_SAMPLE of them (or is flushed), so a new shard is trained
+    on a full sample rather than on whatever batch came first
+    """
+
+    def __init__(self, manifest, kind="delta", max_mb=None, max_vectors=None, index_type=None):
+        self.manifest = manifest
+        self.kind = kind
+        self.max_mb = max_mb or MAX_SHARD_MB
+        self.max_vectors = max_vectors
+        self.index_type = index_type
+        self.index = None
+        self.info = None
+        self.segment_id = None
+        self.store = None
+        self.tags = None
+        self.lexical = None
+        self.segment_rows = 0
+        self.added = 0
+        self.pending = [] if kind == "shard" and needs_training(index_type) else None
+        self.pending_target = min(TRAIN_SAMPLE, max_vectors or TRAIN_SAMPLE)
+        # (doc_id, segment, row) of every row added, recorded in the id map once published
+        self.locations = []
+
+    def _segment_files(self):
+        if self.kind == "delta":
+            return f"delta_{self.segment_id:06d}.faiss", f"delta_{self.segment_id:06d}.jsonl"
+        return f"shard_{self.segment_id:04d}.faiss", f"metadata_{self.segment_id:04d}.jsonl"
+
+    def _open_store(self, fresh=False):
+        # metadata rows are appended as chunks arrive (before the index is written)
+        fname, meta_fname = self._segment_files()
+        tags_path = tags_path_for(RAG_DIR / meta_fname)
+        lexical_path = lexical_path_for(RAG_DIR / meta_fname)
+        if fresh:
+            # leftovers from a run that died before publishing this segment id
+            for p in (RAG_DIR / fname, RAG_DIR / meta_fname, index_path_for(RAG_DIR / meta_fname), tags_path, lexical_path):
+                if p.exists():
+                    p.unlink()
+        self.store = MetadataStore(RAG_DIR / meta_fname)
+        if tags_path.exists():
+            self.tags = TagIndex.load(tags_path)
+            # tags are saved before the index, so they may list rows the index never got
+            self.tags.truncate(self.index.ntotal)
+        else:
+            # shards written before tag indexes existed: index their existing rows once
+            self.tags = TagIndex.from_metadata(self.store)
+        self._close_lexical()
+        if LEXICAL_INDEX:
+            self.lexical = open_for_append(RAG_DIR / meta_fname, self.store, self.index.ntotal)
+        self.segment_rows = 0
+
+    def _close_lexical(self):
+        if self.lexical is not None:
+            self.lexical.close()
+            self.lexical = None
+
+    def _open_delta(self):
+        self.segment_id = CATALOG.next_id(self.manifest, "deltas")
+        self.index = faiss.IndexFlatL2(DIM)
+        self.info = dict(FLAT_INFO)
+        self._open_store(fresh=True)
+        print(f"[RAG] Starting delta segment {self.segment_id}")
+
+    def _open_shard(self, vectors, rollover=False):
+        # Check the last shard's size before reading it: a full shard is never loaded
+        last_entry = CATALOG.active(self.manifest)
+        size_mb = 0.0
+        if last_entry and last_entry.get("shard_file"):
+            size_mb = get_shard_size_mb(RAG_DIR / last_entry["shard_file"])
+
+        last_index, last_id = None, None
+        if last_entry and (rollover or size_mb >= self.max_mb):
+            last_id = last_entry.get("id")
+        else:
+            # Load last shard (if manifest points to any)
+            last_index, _, last_id = load_last_shard(self.manifest)
+            if last_index is None and last_entry:
+                # unreadable last shard: never reuse its id
+                last_id = last_entry.get("id")
+
+        if last_index is not None:
             # append to existing last shard
-            current_shard_id = last_id
-            current_index = last_index
-            current_meta = last_meta
-            current_vectors = current_index.ntotal
-            print(f"[RAG] Appending to existing shard {current_shard_id} (size={size_mb:.2f}MB, vectors={current_vectors})")
-    else:
-        # No valid last shard found -> create shard 1
-        current_shard_id = 1
-        current_index = faiss.IndexFlatL2(DIM)
-        current_meta = []
-        current_vectors = 0
-        print("[RAG] No previous shards -> starting shard 1")
-
-    # Read new training items
-    new_items = read_train_json()
-    if not new_items:
-        print("[RAG] No new items. Exiting.")
-        return
+            self.segment_id = last_id
+            self.index = last_index
+            self.info = last_entry.get("index") or dict(FLAT_INFO)
+            self._open_store()
+            print(f"[RAG] Appending to existing shard {last_id} (size={size_mb:.2f}MB, vectors={last_index.ntotal})")
+            return
 
-    texts = [it.get("text", "") for it in new_items]
-    print(f"[RAG] Encoding {len(texts)} new items with model {MODEL_NAME} ...")
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-    if embeddings.dtype != np.float32:
-        embeddings = embeddings.astype("float32")
-
-    added = 0
-    for emb_vec, item in zip(embeddings, new_items):
-        # Add vector + metadata
-        current_index.add(emb_vec.reshape(1, -1))
-        metadata_entry = {
-            "text": item.get("text", ""),
-            "source": item.get("source"),
-            "id": item.get("id"),
-            "created_at": item.get("created_at") or datetime.utcnow().isoformat() + "Z",
-            "extra": {k: v for k, v in item.items() if k not in ("text", "source", "id", "created_at")}
+        # ids come from the manifest counter, so an unreadable or removed shard's id is never reused
+        self.segment_id = CATALOG.next_id(self.manifest, "shards")
+        if last_id is not None:
+            print(f"[RAG] Last shard size {size_mb:.2f}MB >= {self.max_mb}MB -> creating shard {self.segment_id}")
+        else:
+            print(f"[RAG] No previous shards -> starting shard {self.segment_id}")
+
+        train_vectors = vectors
+        if last_entry and last_entry.get("shard_file"):
+            # rollover: the previous full shard is a far better training sample than one batch
+            prev = sample_shard_vectors(RAG_DIR / last_entry["shard_file"])
+            if prev is not None:
+                train_vectors = np.vstack([prev, vectors])
+        self.index, self.info = build_shard_index(DIM, train_vectors, index_type=self.index_type)
+        self._open_store(fresh=True)
+        print(f"[RAG] New shard {self.segment_id} index: {self.info['type']}")
+
+    def _room(self):
+        """How many more vectors fit in the open segment before it reaches max_mb (or max_vectors)."""
+        size_mb = estimate_index_mb(self.index)
+        per_vector_mb = size_mb / self.index.ntotal if self.index.ntotal else DIM * 4 / (1024 * 1024)
+        room = int((self.max_mb - size_mb) / per_vector_mb)
+        if self.max_vectors is not None:
+            room = min(room, self.max_vectors - self.index.ntotal)
+        return room
+
+    def add(self, vectors, metadata_list):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.pending is not None:
+            self.pending.append((vectors, list(metadata_list)))
+            if sum(len(v) for v, _ in self.pending) < self.pending_target:
+                return
+            vectors, metadata_list = self._take_pending()
+        start, rollover = 0, False
+        while start < len(vectors):
+            if self.index is None:
+                if self.kind == "delta":
+                    self._open_delta()
+                else:
+                    self._open_shard(vectors[start:], rollover=rollover)
+            room = self._room()
+            if room <= 0 and self.index.ntotal:
+                # segment is full: write it and continue in a new one
+                self.flush()
+                self.index = None
+                rollover = True
+                continue
+            end = len(vectors) if room <= 0 else min(len(vectors), start + room)
+            fname = self._segment_files()[0]
+            self.locations.extend((stable_id(meta), fname, self.index.ntotal + offset)
+                                  for offset, meta in enumerate(metadata_list[start:end]))
+            with metrics.span("rag_update.metadata_append"):
+                self.store.append(metadata_list[start:end])
+                self.tags.add_rows(self.index.ntotal, metadata_list[start:end])
+                if self.lexical is not None:
+                    self.lexical.add_rows(self.index.ntotal, metadata_list[start:end])
+            with metrics.span("rag_update.index_add"):
+                self.index.add(vectors[start:end])
+            self.segment_rows += end - start
+            self.added += end - start
+            start = end
+
+    def _take_pending(self):
+        pending, self.pending = self.pending, None
+        return np.vstack([v for v, _ in pending]), [meta for _, metas in pending for meta in metas]
+
+    def flush(self):
+        """Write the open segment and record it in the manifest."""
+        if self.pending:
+            self.add(*self._take_pending())
+        if self.index is None:
+            return
+        fname, meta_fname = self._segment_files()
+        with metrics.span("rag_update.shard_write"):
+            tags_file = self.tags.save(tags_path_for(RAG_DIR / meta_fname)).name
+            if self.lexical is not None:
+                # committed before the index is written; readers ignore rows the index does not have yet
+                self.lexical.commit()
+            write_index_file(self.index, fname)
+        print(f"[RAG] Wrote {fname} ({self.index.ntotal} vectors, +{self.segment_rows} metadata rows) and {meta_fname}")
+
+        rec = {
+            "id": self.segment_id,
+            "shard_file": fname,
+            "meta_file": meta_fname,
+            "tags_file": tags_file,
+            "lexical_file": self.lexical.path.name if self.lexical is not None else None,
+            **CATALOG.describe(RAG_DIR / fname, self.index.ntotal),
+            "index": self.info,
+            "updated_at": datetime.utcnow().isoformat() + "Z"
         }
-        current_meta.append(metadata_entry)
-        current_vectors += 1
-        added += 1
-
-    # Write the updated (or new) shard to disk
-    fname, meta_fname = write_shard(current_index, current_meta, current_shard_id)
-
-    # Update manifest: either replace last entry or append a new one
-    now = datetime.utcnow().isoformat() + "Z"
-    shard_rec = {
-        "id": current_shard_id,
-        "shard_file": fname,
-        "meta_file": meta_fname,
-        "vectors": len(current_meta),
-        "updated_at": now
-    }
+        metrics.count("rag_update.segments_written")
+        metrics.count("rag_update.bytes_written", rec["bytes"])
+        # replaces the entry of the shard being appended to, or adds the new segment
+        CATALOG.record(self.manifest, "deltas" if self.kind == "delta" else "shards", rec)
+
+    def close(self):
+        self.flush()
+        self._close_lexical()
+        update_manifest_totals(self.manifest)
+
+
+def _live_rows(entry, id_map):
+    """
+    (vectors, metadata, rows in the segment) of the rows of a published segment that are not
+    tombstoned, or None if its vectors cannot be read back.
+    """
+    index = read_shard_index(RAG_DIR / entry["shard_file"], mode="eager")
+    if index.ntotal == 0:
+        return np.zeros((0, DIM), dtype="float32"), [], 0
+    vectors = reconstruct_vectors(index)
+    if vectors is None:
+        return None
+    metas = list(MetadataStore(RAG_DIR / entry["meta_file"]))[:index.ntotal]
+    dead = id_map.dead_rows(entry["shard_file"]) if id_map else []
+    if len(dead):
+        keep = np.setdiff1d(np.arange(index.ntotal), dead)
+        vectors, metas = vectors[keep], [metas[i] for i in keep]
+    return vectors, metas, index.ntotal
+
+
+def fold_deltas(manifest, force=False):
+    """
+    Fold delta segments into the base shards once there are DELTA_MAX_SEGMENTS of them or
+    they total DELTA_FOLD_MB (always, with force=True). Returns the number of vectors folded.
+    Like compact_shards, the rows are written to new shard ids and the manifest swaps them in
+    once: a crash leaves the published segments untouched, and searchers never see a row twice.
+    """
+    deltas = manifest.get("deltas", [])
+    if not deltas:
+        return 0
+    delta_mb = sum(d.get("bytes", 0) for d in deltas) / (1024 * 1024)
+    if not force and len(deltas) < DELTA_MAX_SEGMENTS and delta_mb < DELTA_FOLD_MB:
+        print(f"[RAG] {len(deltas)} delta segments ({delta_mb:.2f}MB) below fold thresholds")
+        return 0
+
+    print(f"[RAG] Folding {len(deltas)} delta segments ({delta_mb:.2f}MB) into base shards")
+    id_map = open_id_map(RAG_DIR, readonly=True)
+    sources = []
+    # a last base shard with room left is rewritten along with the deltas (its vectors must read
+    # back exactly), so folds do not leave a trail of small shards
+    last = CATALOG.active(manifest)
+    if (last and last.get("shard_file") and last.get("meta_file")
+            and (last.get("index") or FLAT_INFO)["type"] in CARRY_INDEX_TYPES
+            and get_shard_size_mb(RAG_DIR / last["shard_file"]) < MAX_SHARD_MB):
+        rows = _live_rows(last, id_map)
+        if rows is not None:
+            sources.append((last, rows))
+    work = {"shards": [], "deltas": [],
+            "next_shard_id": ShardCatalog.next_id(dict(manifest), "shards"),
+            "next_delta_id": ShardCatalog.next_id(dict(manifest), "deltas")}
+    writer = ShardWriter(work, kind="shard")
+    dropped = 0
+    for entry, rows in sources + [(d, None) for d in deltas]:
+        vectors, metas, total = rows or _live_rows(entry, id_map)
+        # replaced / deleted rows are not carried into the base shards
+        dropped += total - len(metas)
+        if len(vectors):
+            writer.add(vectors, metas)
+        del vectors, metas
+    if id_map:
+        id_map.close()
+    writer.close()
+
+    # one manifest save swaps the new shards in and the folded segments out; their files go after
+    folded = [entry for entry, _ in sources] + deltas
+    manifest["shards"] = [e for e in manifest["shards"] if e not in folded] + work["shards"]
+    manifest["deltas"] = []
+    manifest["next_shard_id"] = work["next_shard_id"]
+    update_manifest_totals(manifest)
+    record_locations(manifest, writer.locations, [e["shard_file"] for e in folded])
+    for entry in folded:
+        meta_path = RAG_DIR / entry["meta_file"]
+        for p in (RAG_DIR / entry["shard_file"], meta_path, index_path_for(meta_path), tags_path_for(meta_path),
+                  lexical_path_for(meta_path)):
+            if p.exists():
+                p.unlink()
+    print(f"[RAG] Folded {writer.added} vectors ({dropped} tombstoned rows dropped). Base shards={len(manifest['shards'])}")
+    return writer.added
+
+
+# --------------------- MAIN ---------------------
+
+def main(fold=False):
+    if not fold and not has_train_items():
+        # hourly no-op: nothing to embed, so skip the HF download and the model load
+        print(f"[RAG] No items in {TRAIN_JSON}. Exiting.")
+        return
 
-    if manifest.get("shards") and manifest["shards"][-1].get("id") == current_shard_id:
-        manifest["shards"][-1] = shard_rec
-    else:
-        manifest.setdefault("shards", []).append(shard_rec)
+    # Download manifest and shard files from HF into rag_storage/
+    with metrics.span("rag_update.download"):
+        download_manifest_and_shards_from_hf()
 
-    manifest["total_vectors"] = sum(x.get("vectors", 0) for x in manifest.get("shards", []))
-    manifest["last_updated"] = now
+    manifest = load_local_manifest()
+    print("[RAG] Manifest shards=", len(manifest.get("shards", [])), "deltas=", len(manifest.get("deltas", [])),
+          "total_vectors=", manifest.get("total_vectors", 0))
 
-    save_local_manifest(manifest)
+    if fold:
+        with metrics.span("rag_update.fold"):
+            fold_deltas(manifest, force=True)
+        return
 
-    print(f"[RAG] Finished. Added {added} vectors. Manifest shards={len(manifest['shards'])}, total_vectors={manifest['total_vectors']}.")
+    cache = open_embedding_cache(manifest)
+    run_keys = set()
+    stats = {"skipped": 0}
+
+    # Each run writes its own small immutable delta segment(s); base shards are not touched
+    writer = ShardWriter(manifest, kind="delta")
+    # Stream new training items chunk by chunk: encode, then one bulk add per chunk
+    dedupe_cache = cache
+    if INGEST_WORKERS > 1 and cache:
+        # the chunks are read (and deduplicated) on the pipeline's reader thread while this thread
+        # stores vectors: the lookups get their own connection
+        dedupe_cache = EmbeddingCache(cache.model_name, cache.path)
+    try:
+        chunks = iter_fresh_chunks(dedupe_cache, run_keys, stats)
+        if INGEST_WORKERS > 1:
+            # reading, encoding (one model per worker process) and index adds overlap
+            print(f"[RAG] Encoding with {INGEST_WORKERS} worker processes (model {MODEL_NAME}) ...")
+            encoded = encode_chunks(chunks, cache, INGEST_WORKERS, ENCODE_BATCH, MODEL_NAME)
+        else:
+            encoded = encode_chunks_inline(chunks, cache)
+        for fresh, embeddings in encoded:
+            metrics.count("rag_update.encoded", len(fresh))
+            writer.add(embeddings, [build_metadata_entry(item, key) for item, key in fresh])
+    finally:
+        if dedupe_cache is not cache:
+            dedupe_cache.close()
+    skipped = stats["skipped"]
+
+    if not writer.added:
+        print(f"[RAG] No new items ({skipped} duplicates skipped). Exiting.")
+        return
+    writer.close()
+    # the id map is updated first, then this run's deltas are published in one manifest save
+    replaced = record_locations(manifest, writer.locations, cache=cache)
+    metrics.count("rag_update.duplicates_skipped", skipped)
+    metrics.count("rag_update.rows_replaced", replaced)
+    if cache:
+        # only once the manifest lists the new segments do these texts count as indexed
+        cache.mark_indexed(run_keys)
+        print("[RAG] Embedding cache:", cache.stats())
+
+    print(f"[RAG] Finished. Added {writer.added} vectors ({skipped} duplicates skipped, {replaced} rows replaced). Manifest shards={len(manifest.get('shards', []))}, "
+          f"deltas={len(manifest.get('deltas', []))}, total_vectors={manifest['total_vectors']}.")
+
+    if DELTA_AUTO_FOLD:
+        with metrics.span("rag_update.fold"):
+            fold_deltas(manifest)
     print("[RAG] To upload results to HF, run sharded_upload_to_hf.py or let the workflow do it.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fold", action="store_true", help="fold all delta segments into base shards and exit")
+    args = parser.parse_args()
+    with metrics.run("rag_update"):
+        main(fold=args.fold)
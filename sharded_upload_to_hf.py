@@ -1,72 +1,213 @@
 #!/usr/bin/env python3
 """
 Upload rag_storage/ to HuggingFace
-- Compares local file size with remote file size
-- Uploads if file is new OR updated
+- Compares each local file's content hash with the remote one (LFS sha256 oid, or the git blob
+  sha1 for small non-LFS files); same-size rewrites are detected
+- Local hashes are cached in a sidecar file keyed by (size, mtime), so unchanged shards are not re-hashed
+- Every new/changed file goes up in ONE multi-file commit; large shards are transferred in parallel
+  (UPLOAD_THREADS) and failed commits are retried (already uploaded LFS objects are not re-sent)
+- Remote rag_storage/ files that the remote manifest lists but the local one dropped (segments
+  removed by a delta fold or a compaction) are deleted in that same commit; nothing is deleted when
+  the remote manifest is newer than the local copy
+- HF_ENDPOINT points the uploader at another Hub API (e.g. a local stand-in server)
 """
 
+import hashlib
+import json
 import os
-from pathlib import Path
 import time
-from huggingface_hub import HfApi, login, upload_file
+from pathlib import Path
+from huggingface_hub import CommitOperationAdd, CommitOperationDelete, HfApi
+from huggingface_hub.utils import EntryNotFoundError, RepositoryNotFoundError
+from metadata_store import index_path_for
+from shard_catalog import MANIFEST_NAME, ShardCatalog
+import metrics
 
 HF_REPO = os.environ.get("HF_REPO")
 HF_TOKEN = os.environ.get("HF_TOKEN")
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT")
 RAG_DIR = Path("rag_storage")
+HASH_CACHE_PATH = Path(os.environ.get("UPLOAD_HASH_CACHE", ".cache/upload_hashes.json"))
+UPLOAD_THREADS = int(os.environ.get("UPLOAD_THREADS", "8"))
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", "3"))
+HASH_CHUNK = 8 * 1024 * 1024
 
-if not HF_REPO or not HF_TOKEN:
-    raise SystemExit("HF_REPO and HF_TOKEN must be set")
 
 def list_local():
-    return sorted([p for p in RAG_DIR.iterdir() if p.is_file()])
+    return sorted([p for p in RAG_DIR.iterdir() if p.is_file() and not p.name.endswith(".tmp")])
 
-def main():
-    print("[HF-UPLOAD] Logging in...")
-    login(HF_TOKEN)
-    api = HfApi()
 
-    print("[HF-UPLOAD] Getting remote file info...")
-    try:
-        remote_info = api.list_repo_files(repo_id=HF_REPO, repo_type="model", expand=True)
-    except:
-        remote_info = []
+def load_hash_cache(path=HASH_CACHE_PATH):
+    if path.exists():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+def save_hash_cache(cache, path=HASH_CACHE_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, path)
 
-    # Map: path_in_repo -> size
-    remote_sizes = {
-        item.rfilename: item.size
-        for item in remote_info
-    }
 
-    local_files = list_local()
+def hash_file(p):
+    """(sha256, git blob sha1) of a file in one streaming pass."""
+    size = p.stat().st_size
+    sha256 = hashlib.sha256()
+    sha1 = hashlib.sha1(f"blob {size}\0".encode("ascii"))
+    with open(p, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            sha1.update(chunk)
+    return sha256.hexdigest(), sha1.hexdigest()
+
+
+def local_hashes(p, cache):
+    """Hashes for `p`, reusing the sidecar cache entry while size and mtime are unchanged."""
+    st = p.stat()
+    key = str(p)
+    entry = cache.get(key)
+    if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        return entry
+    sha256, sha1 = hash_file(p)
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256, "sha1": sha1}
+    cache[key] = entry
+    return entry
+
+
+def remote_file_info(api, repo_id):
+    """{path_in_repo: RepoFile} for everything under rag_storage/ on the Hub."""
+    try:
+        items = api.list_repo_tree(repo_id=repo_id, path_in_repo=RAG_DIR.name, recursive=True, repo_type="model")
+        return {item.path: item for item in items if hasattr(item, "blob_id")}
+    except (EntryNotFoundError, RepositoryNotFoundError):
+        return {}
+
 
-    for p in local_files:
-        path_in_repo = f"rag_storage/{p.name}"
-        local_size = p.stat().st_size
+def is_unchanged(hashes, remote):
+    if remote is None or remote.size != hashes["size"]:
+        return False
+    if remote.lfs is not None:
+        return remote.lfs.sha256 == hashes["sha256"]
+    return remote.blob_id == hashes["sha1"]
 
-        remote_size = remote_sizes.get(path_in_repo)
 
-        # ----------------------------
-        # FIX: Upload if NEW or CHANGED
-        # ----------------------------
-        if remote_size == local_size:
+def changed_files(remote, cache):
+    changed = []
+    for p in list_local():
+        path_in_repo = f"{RAG_DIR.name}/{p.name}"
+        hashes = local_hashes(p, cache)
+        if is_unchanged(hashes, remote.get(path_in_repo)):
             print(f"[HF-UPLOAD] {p.name} unchanged → skipping")
             continue
+        print(f"[HF-UPLOAD] {p.name} changed (sha256={hashes['sha256'][:12]}, {hashes['size']} bytes)")
+        changed.append((p, path_in_repo))
+    return changed
 
-        print(f"[HF-UPLOAD] Uploading {p.name} (local={local_size}, remote={remote_size})")
+
+def manifest_files(manifest):
+    """Names of the files `manifest` refers to: its segments and their sidecars, and the id map."""
+    names = set()
+    if manifest.get("id_map"):
+        names.add(manifest["id_map"])
+    for entry in ShardCatalog.entries(manifest):
+        names.update(entry.get(key) for key in ("shard_file", "meta_file", "tags_file", "lexical_file"))
+        if entry.get("meta_file"):
+            names.add(index_path_for(RAG_DIR / entry["meta_file"]).name)
+    names.discard(None)
+    return names
+
+
+def remote_manifest(api, repo_id, remote):
+    """The manifest.json currently on the Hub (None if there is none)."""
+    path_in_repo = f"{RAG_DIR.name}/{MANIFEST_NAME}"
+    if path_in_repo not in remote:
+        return None
+    with open(api.hf_hub_download(repo_id=repo_id, filename=path_in_repo, repo_type="model"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def stale_files(remote, published):
+    """
+    Remote rag_storage/ paths the remote manifest (`published`) lists and the local one dropped
+    (segments removed by a fold or compaction), and which are not on disk either. Files the remote
+    manifest does not know are never touched, nor is anything when the remote is ahead of us.
+    """
+    catalog = ShardCatalog(RAG_DIR)
+    if not catalog.exists() or published is None:
+        return []
+    local = catalog.load()
+    if published.get("generation", 0) > local.get("generation", 0):
+        # another machine published after our copy was downloaded: what we lack may be live
+        print(f"[HF-UPLOAD] Remote manifest is newer (generation {published.get('generation')} > "
+              f"{local.get('generation', 0)}); not deleting any remote file")
+        return []
+    dropped = manifest_files(published) - manifest_files(local) - {p.name for p in list_local()}
+    stale = sorted(path for path in remote if path.rsplit("/", 1)[-1] in dropped)
+    for path in stale:
+        print(f"[HF-UPLOAD] {path} removed locally → deleting")
+    return stale
+
+
+def commit_with_retries(api, repo_id, operations, message):
+    """
+    One commit for all operations. LFS objects are uploaded before the commit call and marked as
+    uploaded on the operation objects, so a retry after a failed commit only re-sends what is missing.
+    """
+    for attempt in range(1, UPLOAD_RETRIES + 1):
         try:
-            upload_file(
-                path_or_fileobj=str(p),
-                path_in_repo=path_in_repo,
-                repo_id=HF_REPO,
+            return api.create_commit(
+                repo_id=repo_id,
                 repo_type="model",
-                token=HF_TOKEN
+                operations=operations,
+                commit_message=message,
+                num_threads=UPLOAD_THREADS,
             )
-            print(f"[HF-UPLOAD] Uploaded {p.name}")
-            time.sleep(0.2)
         except Exception as e:
-            print("[HF-UPLOAD] Upload FAILED:", e)
+            if attempt == UPLOAD_RETRIES:
+                raise
+            wait = 2 ** attempt
+            print(f"[HF-UPLOAD] Commit attempt {attempt} failed ({e}); retrying in {wait}s")
+            time.sleep(wait)
+
+
+def main(repo_id=HF_REPO, token=HF_TOKEN, endpoint=HF_ENDPOINT):
+    if not repo_id or not token:
+        raise SystemExit("HF_REPO and HF_TOKEN must be set")
+
+    api = HfApi(endpoint=endpoint, token=token)
+    cache = load_hash_cache()
+
+    print("[HF-UPLOAD] Comparing local hashes with remote files...")
+    with metrics.span("hf_upload.compare"):
+        remote = remote_file_info(api, repo_id)
+        changed = changed_files(remote, cache)
+        stale = stale_files(remote, remote_manifest(api, repo_id, remote))
+        save_hash_cache(cache)
+    if not changed and not stale:
+        print("[HF-UPLOAD] Nothing to upload.")
+        return None
+
+    operations = [CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=str(p)) for p, path_in_repo in changed]
+    operations += [CommitOperationDelete(path_in_repo=path) for path in stale]
+    print(f"[HF-UPLOAD] Uploading {len(changed)} file(s) and deleting {len(stale)} in one commit...")
+    with metrics.span("hf_upload.commit"):
+        info = commit_with_retries(api, repo_id, operations, f"Update rag_storage ({len(operations)} files)")
+    metrics.count("hf_upload.files", len(changed))
+    metrics.count("hf_upload.deleted", len(stale))
+    metrics.count("hf_upload.bytes", sum(p.stat().st_size for p, _ in changed))
+    print("[HF-UPLOAD] Done.", getattr(info, "commit_url", ""))
+    return info
 
-    print("[HF-UPLOAD] Done.")
 
 if __name__ == "__main__":
-    main()
+    with metrics.run("hf_upload"):
+        main()
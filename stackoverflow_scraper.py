@@ -1,27 +1,163 @@
+"""
+stackoverflow_scraper.py
+- Pooled requests.Session (keep-alive, retries on 5xx/connection errors) against the StackExchange API
+- Questions are paged through with pagesize=100; answers are fetched for up to 100 question ids per
+  call via /questions/{id;id;...}/answers, with those batches running concurrently
+- Honours the API's `backoff` field and stops before `quota_remaining` runs out
+- Persists a watermark so each run only pulls questions with activity since the last run
+  (the `fromdate` value is sent as `min`, because with sort=activity the API applies min/max to
+  last_activity_date while fromdate would filter on creation date)
+- STACKEXCHANGE_API points the fetcher at another base URL (e.g. a local stub server)
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def fetch_stackoverflow_qa():
-    q_url = "https://api.stackexchange.com/2.3/questions"
-    params = {
-        "order": "desc",
-        "sort": "activity",
-        "site": "stackoverflow",
-        "pagesize": 10,
-        "filter": "withbody"
-    }
-
-    questions = requests.get(q_url, params=params).json()["items"]
-    qa_pairs = []
+import metrics
 
-    for q in questions:
-        ans_url = f"https://api.stackexchange.com/2.3/questions/{q['question_id']}/answers"
-        ans_data = requests.get(ans_url, params={"site": "stackoverflow", "filter": "withbody"}).json()
+API_BASE = os.environ.get("STACKEXCHANGE_API", "https://api.stackexchange.com/2.3")
+API_KEY = os.environ.get("SO_API_KEY")
+SITE = "stackoverflow"
+STATE_FILE = os.environ.get("SO_STATE_FILE", "datasets/.so_watermark.json")
+MAX_PAGES = int(os.environ.get("SO_MAX_PAGES", "5"))
+PAGE_SIZE = 100
+IDS_PER_CALL = 100          # API limit for vectorized {ids} routes
+FETCH_WORKERS = int(os.environ.get("SO_FETCH_WORKERS", "4"))
+MIN_QUOTA = 10              # leave some quota for other tools sharing the key
+FIRST_RUN_LOOKBACK = 3600   # seconds of activity to pull when there is no watermark yet
+
+
+def make_session(pool_size=FETCH_WORKERS):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def load_watermark(path=STATE_FILE):
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("fromdate")
+        except (OSError, ValueError):
+            pass
+    return None
+
+
+def save_watermark(fromdate, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fromdate": int(fromdate)}, f)
+    os.replace(tmp, path)
+
+
+class StackExchangeClient:
+    """Thin API client: shared session, global backoff and quota tracking."""
+
+    def __init__(self, api_base=API_BASE, session=None, api_key=API_KEY):
+        self.api_base = api_base.rstrip("/")
+        self.session = session or make_session()
+        self.api_key = api_key
+        self.quota_remaining = None
+        self._lock = threading.Lock()
+        self._not_before = 0.0
+
+    def get(self, path, **params):
+        params.setdefault("site", SITE)
+        if self.api_key:
+            params["key"] = self.api_key
+        with self._lock:
+            wait = self._not_before - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
 
-        if ans_data["items"]:
+        with metrics.span("so.request"):
+            resp = self.session.get(f"{self.api_base}{path}", params=params, timeout=30)
+            data = resp.json()
+        metrics.count("so.requests")
+        metrics.count("so.response_bytes", len(resp.content))
+        if "error_id" in data:
+            raise RuntimeError(f"StackExchange API error {data.get('error_id')}: {data.get('error_message')}")
+        with self._lock:
+            if data.get("backoff"):
+                # the API asks us not to hit this method again for `backoff` seconds
+                self._not_before = max(self._not_before, time.monotonic() + data["backoff"])
+            if "quota_remaining" in data:
+                self.quota_remaining = data["quota_remaining"]
+        return data
+
+    def out_of_quota(self):
+        return self.quota_remaining is not None and self.quota_remaining <= MIN_QUOTA
+
+    def paged(self, path, max_pages=MAX_PAGES, **params):
+        """Yield items across pages until has_more is false, max_pages is hit or quota runs low."""
+        for page in range(1, max_pages + 1):
+            data = self.get(path, page=page, pagesize=PAGE_SIZE, **params)
+            yield from data.get("items", [])
+            if not data.get("has_more") or self.out_of_quota():
+                break
+
+
+def pick_answer(answers):
+    """Accepted answer if there is one, otherwise the highest-scored."""
+    return max(answers, key=lambda a: (a.get("is_accepted", False), a.get("score", 0)))
+
+
+def fetch_answers(client, question_ids):
+    """{question_id: [answers]} using one vectorized call (plus pages) per 100 ids."""
+    batches = [question_ids[i:i + IDS_PER_CALL] for i in range(0, len(question_ids), IDS_PER_CALL)]
+
+    def fetch(batch):
+        ids = ";".join(str(q) for q in batch)
+        return list(client.paged(f"/questions/{ids}/answers", order="desc", sort="votes", filter="withbody"))
+
+    by_question = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        for answers in pool.map(fetch, batches):
+            for ans in answers:
+                by_question.setdefault(ans["question_id"], []).append(ans)
+    return by_question
+
+
+def fetch_stackoverflow_qa(api_base=None, state_file=STATE_FILE, update_watermark=True):
+    client = StackExchangeClient(api_base or API_BASE)
+    fromdate = load_watermark(state_file)
+    if fromdate is None:
+        fromdate = int(time.time()) - FIRST_RUN_LOOKBACK
+
+    # oldest activity first: if max_pages cuts the run short, the next run resumes from the watermark
+    with metrics.span("so.questions"):
+        questions = list(client.paged(
+            "/questions", order="asc", sort="activity", min=fromdate, filter="withbody"
+        ))
+    with metrics.span("so.answers"):
+        answers = fetch_answers(client, [q["question_id"] for q in questions]) if questions else {}
+
+    qa_pairs = []
+    for q in questions:
+        q_answers = answers.get(q["question_id"])
+        if q_answers:
             qa_pairs.append({
+                "question_id": q["question_id"],
                 "question": q["title"],
-                "answer": ans_data["items"][0]["body"],
+                "answer": pick_answer(q_answers)["body"],
                 "tags": q["tags"]
             })
 
+    metrics.count("so.questions", len(questions))
+    metrics.count("so.qa_pairs", len(qa_pairs))
+    if update_watermark and questions:
+        save_watermark(max(q.get("last_activity_date", fromdate) for q in questions) + 1, state_file)
+    print(f"[SO] {len(questions)} questions since {fromdate}, {len(qa_pairs)} with answers "
+          f"(quota_remaining={client.quota_remaining})")
     return qa_pairs
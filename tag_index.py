@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+tag_index.py
+- Per-segment inverted index: StackOverflow tag -> row ids (= FAISS ids) of that segment
+- Stored next to the segment's metadata: metadata_0001.jsonl -> metadata_0001.tags.json,
+  delta_000001.jsonl -> delta_000001.tags.json; listed as "tags_file" in manifest.json
+- Built by sharded_rag_update as rows are added; inference_search turns a tag filter into a FAISS
+  id selector so only the matching rows are scored
+- Segments written before tag indexes existed are indexed from their metadata on first filtered search
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def normalize_tag(tag):
+    return str(tag).strip().lower()
+
+
+def parse_tags(tags):
+    """Tag filter from a list or a comma-separated string ("python,pandas") -> normalized list."""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return sorted({normalize_tag(t) for t in tags if str(t).strip()})
+
+
+def item_tags(item):
+    """Tags of a train.jsonl item or of a shard metadata row (where they live under "extra")."""
+    tags = item.get("tags")
+    if tags is None:
+        tags = (item.get("extra") or {}).get("tags")
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = [tags]
+    return [normalize_tag(t) for t in tags]
+
+
+def tags_path_for(meta_path):
+    return Path(meta_path).with_suffix(".tags.json")
+
+
+class TagIndex:
+    """tag -> sorted row ids for one segment."""
+
+    def __init__(self, postings=None):
+        self.postings = {tag: list(rows) for tag, rows in (postings or {}).items()}
+        self._arrays = {}
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_metadata(cls, metas):
+        index = cls()
+        for row, meta in enumerate(metas):
+            index.add(row, item_tags(meta))
+        return index
+
+    def __len__(self):
+        return len(self.postings)
+
+    def add(self, row, tags):
+        for tag in set(tags):
+            self.postings.setdefault(tag, []).append(int(row))
+            self._arrays.pop(tag, None)
+
+    def add_rows(self, start_row, items):
+        """Index `items` as rows start_row, start_row + 1, ..."""
+        for offset, item in enumerate(items):
+            self.add(start_row + offset, item_tags(item))
+
+    def truncate(self, rows):
+        """Forget row ids >= rows (mirrors MetadataStore.truncate)."""
+        for tag in list(self.postings):
+            kept = [r for r in self.postings[tag] if r < rows]
+            if kept:
+                self.postings[tag] = kept
+            else:
+                del self.postings[tag]
+        self._arrays.clear()
+
+    def ids_for(self, tags):
+        """Sorted int64 row ids carrying ANY of `tags`."""
+        arrays = []
+        for tag in parse_tags(tags):
+            if tag not in self.postings:
+                continue
+            if tag not in self._arrays:
+                self._arrays[tag] = np.asarray(self.postings[tag], dtype="int64")
+            arrays.append(self._arrays[tag])
+        if not arrays:
+            return np.zeros(0, dtype="int64")
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.unique(np.concatenate(arrays))
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.postings, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        return path
@@ -0,0 +1,43 @@
+"""
+Shared fixtures: every test runs in an empty working directory (the pipeline modules resolve
+rag_storage/, train.jsonl and .cache/ relative to it) with the benchmark embedder installed, so no
+model, network or HF account is needed.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "rag_storage").mkdir()
+    import embedding_model
+    import sharded_rag_update
+    from benchmarks import fake_embedder
+
+    fake_embedder.install(embedding_model.MODEL_NAME, dim=sharded_rag_update.DIM)
+    monkeypatch.setattr(sharded_rag_update, "HF_REPO", None)
+    monkeypatch.setattr(sharded_rag_update, "DELTA_AUTO_FOLD", False)
+    return tmp_path
+
+
+def write_train(items, path="train.jsonl"):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+
+
+def ingest(items):
+    """One sharded_rag_update run over `items`; returns the manifest afterwards."""
+    import sharded_rag_update
+
+    write_train(items)
+    sharded_rag_update.main()
+    return sharded_rag_update.load_local_manifest()
@@ -0,0 +1,55 @@
+import json
+
+from conftest import ingest
+
+from embedding_cache import content_hash
+from id_map import open_id_map
+
+
+def _items(n, offset=0):
+    return [{"question_id": i, "id": str(i), "text": f"compaction test question {i}"} for i in range(offset, offset + n)]
+
+
+def test_deletions_go_through_the_id_map(workdir):
+    import compact_shards
+    import sharded_rag_update
+
+    ingest(_items(30))
+    deleted = compact_shards.delete_rows(ids=["4"], content_hashes=[
+        content_hash("compaction test question 9", sharded_rag_update.MODEL_NAME)])
+    assert deleted == [4, 9]
+    assert not (workdir / "rag_storage" / "tombstones.json").exists()
+    id_map = open_id_map("rag_storage", readonly=True)
+    assert id_map.lookup(4) is None and id_map.lookup(9) is None
+    id_map.close()
+
+    # a fold honours the same deletions
+    sharded_rag_update.main(fold=True)
+    manifest = sharded_rag_update.load_local_manifest()
+    assert manifest["total_vectors"] == 28
+
+
+def test_compaction_drops_deleted_rows_and_balances_shards(workdir):
+    import compact_shards
+
+    ingest(_items(600))
+    ingest(_items(400, offset=600))
+    compact_shards.delete_rows(ids=[str(i) for i in range(100)])
+    report = compact_shards.compact(target_mb=0.5, grace=0)
+    assert report["replaced_or_deleted"] == 100
+    assert report["vectors_after"] == 900
+
+    manifest = json.loads((workdir / "rag_storage" / "manifest.json").read_text())
+    sizes = [entry["vectors"] for entry in manifest["shards"]]
+    assert sum(sizes) == 900 and max(sizes) - min(sizes) <= 1
+    assert manifest["deltas"] == [] and manifest["tombstones"] == 0
+
+
+def test_legacy_tombstones_file_is_applied_once(workdir):
+    import compact_shards
+
+    ingest(_items(10))
+    (workdir / "rag_storage" / "tombstones.json").write_text(json.dumps({"ids": ["2", "3"], "content_hashes": []}))
+    report = compact_shards.compact(grace=0)
+    assert report["vectors_after"] == 8
+    assert not (workdir / "rag_storage" / "tombstones.json").exists()
@@ -0,0 +1,22 @@
+from conftest import ingest
+
+
+def _items(n, offset=0):
+    return [{"question_id": i, "id": str(i), "text": f"fold test question {i}"} for i in range(offset, offset + n)]
+
+
+def test_new_ivf_shard_is_trained_on_all_folded_rows(workdir, monkeypatch):
+    import index_factory
+    import sharded_rag_update
+
+    for run in range(5):
+        ingest(_items(100, offset=run * 100))
+    monkeypatch.setattr(index_factory, "INDEX_TYPE", "ivf")
+    sharded_rag_update.main(fold=True)
+
+    manifest = sharded_rag_update.load_local_manifest()
+    [shard] = manifest["shards"]
+    assert shard["vectors"] == 500
+    # trained on the first delta alone this would be 100 // 39 = 2 lists
+    assert shard["index"]["type"] == "ivf"
+    assert shard["index"]["params"]["nlist"] == 500 // index_factory.MIN_POINTS_PER_CENTROID
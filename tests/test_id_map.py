@@ -0,0 +1,52 @@
+from conftest import ingest
+
+from id_map import delete_records, open_id_map, row_metadata
+from shard_catalog import ShardCatalog
+
+
+def live_text(doc_id):
+    """Text of the live row of `doc_id` (None if it has none)."""
+    catalog = ShardCatalog("rag_storage")
+    id_map = open_id_map("rag_storage", readonly=True)
+    try:
+        location = id_map.lookup(doc_id)
+    finally:
+        id_map.close()
+    if location is None:
+        return None
+    (meta,) = row_metadata(catalog, catalog.load(), [location])
+    return meta["text"]
+
+
+def test_upsert_replaces_the_live_copy(workdir):
+    ingest([{"question_id": 3, "text": "how to sort a dict"}])
+    manifest = ingest([{"question_id": 3, "text": "how to sort a dict by value"}])
+    assert live_text(3) == "how to sort a dict by value"
+    assert manifest["tombstones"] == 1
+
+
+def test_reverted_text_is_ingested_again(workdir):
+    ingest([{"question_id": 3, "text": "text A"}])
+    ingest([{"question_id": 3, "text": "text B"}])
+    manifest = ingest([{"question_id": 3, "text": "text A"}])
+    assert live_text(3) == "text A"
+    assert manifest["total_vectors"] == 3
+    assert manifest["tombstones"] == 2
+
+
+def test_deleted_record_can_come_back(workdir, capsys):
+    ingest([{"question_id": 5, "text": "deleted then restored"}, {"question_id": 6, "text": "kept"}])
+    assert set(delete_records([5])) == {5}
+    assert live_text(5) is None
+
+    ingest([{"question_id": 5, "text": "deleted then restored"}])
+    assert "No new items" not in capsys.readouterr().out
+    assert live_text(5) == "deleted then restored"
+    assert live_text(6) == "kept"
+
+
+def test_unchanged_text_is_still_skipped(workdir, capsys):
+    ingest([{"question_id": 7, "text": "same text"}])
+    manifest = ingest([{"question_id": 7, "text": "same text"}])
+    assert "No new items (1 duplicates skipped)" in capsys.readouterr().out
+    assert manifest["total_vectors"] == 1
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+
+from conftest import REPO_ROOT
+
+
+def test_encode_chunks_matches_inline_order(workdir):
+    import embedding_model
+    from benchmarks import fake_embedder
+    from ingest_pipeline import encode_chunks
+
+    chunks = [[({"text": f"doc {i} {j}"}, f"k{i}-{j}") for j in range(7)] for i in range(5)]
+    setup = fake_embedder.install
+    out = list(encode_chunks(iter(chunks), None, workers=2, setup=setup))
+    assert [chunk for chunk, _ in out] == chunks
+    for chunk, vectors in out:
+        expected = embedding_model.encode([item["text"] for item, _ in chunk])
+        assert np.allclose(vectors, expected, atol=1e-6)
+
+
+def test_dead_encoder_fails_the_run_instead_of_hanging(tmp_path):
+    # the pool's task pipe is full when the workers die: the parent used to wait on it at exit
+    (tmp_path / "crash_setup.py").write_text("import os\n\ndef die():\n    os._exit(3)\n")
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path[:0] = [{str(REPO_ROOT)!r}, {str(tmp_path)!r}]
+        import crash_setup
+        from ingest_pipeline import encode_chunks
+        chunks = ([({{"text": "x" * 100000}}, f"{{i}}-{{j}}") for j in range(50)] for i in range(20))
+        for _ in encode_chunks(chunks, None, workers=2, setup=crash_setup.die):
+            pass
+    """)
+    run = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, capture_output=True, text=True, timeout=60)
+    assert run.returncode != 0
+    assert "Embedding worker(s) died" in run.stderr
+
+
+def test_pipelined_ingest_reads_on_its_own_connection(workdir, monkeypatch):
+    import functools
+    import threading
+
+    import ingest_pipeline
+    import sharded_rag_update
+    from benchmarks import fake_embedder
+    from conftest import ingest
+    from embedding_cache import EmbeddingCache
+
+    monkeypatch.setattr(sharded_rag_update, "INGEST_WORKERS", 2)
+    monkeypatch.setattr(sharded_rag_update, "encode_chunks",
+                        functools.partial(ingest_pipeline.encode_chunks, setup=fake_embedder.install))
+    used = {"lookup": set(), "store": set()}
+    for method, role in (("is_indexed_many", "lookup"), ("put_many", "store")):
+        original = getattr(EmbeddingCache, method)
+
+        def spy(self, *args, _original=original, _role=role):
+            used[_role].add((threading.current_thread().name, id(self.db)))
+            return _original(self, *args)
+        monkeypatch.setattr(EmbeddingCache, method, spy)
+
+    items = [{"question_id": i, "text": f"question {i % 180}"} for i in range(200)]
+    manifest = ingest(items)
+    assert manifest["total_vectors"] == 180
+    lookups = {db for thread, db in used["lookup"]}
+    stores = {db for thread, db in used["store"]}
+    assert {thread for thread, _ in used["lookup"]} == {"ingest-reader"}
+    assert lookups and stores and not lookups & stores
@@ -0,0 +1,28 @@
+from query_cache import QueryCache
+
+
+def test_results_of_a_search_that_spans_a_refresh_are_not_cached():
+    cache = QueryCache("model", disk_path=None)
+    cache.set_version("v1")
+    key = cache.result_key("how to sort a list", 5)
+    started = cache.version
+    cache.set_version("v2")
+    cache.put_results(key, [{"id": "old"}], started)
+    assert cache.get_results(key) is None
+
+    cache.put_results(key, [{"id": "new"}], cache.version)
+    assert cache.get_results(key) == [{"id": "new"}]
+
+
+def test_cached_results_are_copies(tmp_path):
+    cache = QueryCache("model", disk_path=tmp_path / "query_cache.sqlite")
+    cache.set_version("v1")
+    key = cache.result_key("how to sort a list", 5)
+    results = [{"id": "1", "score": 0.5}]
+    cache.put_results(key, results, "v1")
+    results[0]["score"] = 0.0
+
+    hits = cache.get_results(key)
+    hits.append({"id": "2"})
+    hits[0]["id"] = "changed"
+    assert cache.get_results(key) == [{"id": "1", "score": 0.5}]
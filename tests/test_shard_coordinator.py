@@ -0,0 +1,38 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class DyingNode(BaseHTTPRequestHandler):
+    """A shard server that dies halfway through its answer."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "1000")
+        self.end_headers()
+        self.wfile.write(b'{"results": [')
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dying_node():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DyingNode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_node_dying_mid_response_is_left_out(dying_node):
+    from shard_coordinator import ShardCoordinator
+
+    coordinator = ShardCoordinator([[dying_node]], timeout_ms=5000, attempts=1)
+    response, url, errors = coordinator._call(0, b"{}")
+    assert response is None and url is None
+    assert len(errors) == 1 and errors[0].startswith(dying_node)
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+QUESTIONS = [{"question_id": i, "title": f"question {i}", "tags": ["python"], "last_activity_date": 1000 + i}
+             for i in range(1, 6)]
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """StackExchange API stand-in: /questions filtered on `min`, /questions/{ids}/answers."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        server = self.server
+        server.calls.append((url.path, params, time.monotonic()))
+        if url.path == "/questions":
+            items = [q for q in QUESTIONS if q["last_activity_date"] >= int(params["min"])]
+        else:
+            ids = [int(i) for i in url.path.split("/")[2].split(";")]
+            items = [{"question_id": i, "body": f"answer {i}", "score": 1} for i in ids if i % 2]
+        data = {"items": items, "has_more": server.has_more, "quota_remaining": server.quota}
+        if server.backoff and len(server.calls) == 1:
+            data["backoff"] = server.backoff
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPI)
+    server.calls, server.has_more, server.quota, server.backoff = [], False, 1000, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_watermark_resumes_after_the_last_activity(stub_api, tmp_path):
+    from stackoverflow_scraper import fetch_stackoverflow_qa, load_watermark
+
+    state = str(tmp_path / "watermark.json")
+    with open(state, "w", encoding="utf-8") as f:
+        json.dump({"fromdate": 1003}, f)
+    pairs = fetch_stackoverflow_qa(stub_api.url, state_file=state)
+    assert [p["question_id"] for p in pairs] == [3, 5]
+    assert stub_api.calls[0][1]["min"] == "1003"
+    assert load_watermark(state) == 1006
+
+    # nothing new since: the watermark stays where it is
+    assert fetch_stackoverflow_qa(stub_api.url, state_file=state) == []
+    assert stub_api.calls[-1][1]["min"] == "1006"
+    assert load_watermark(state) == 1006
+
+
+def test_backoff_delays_the_next_request(stub_api, tmp_path):
+    from stackoverflow_scraper import fetch_stackoverflow_qa
+
+    stub_api.backoff = 1
+    state = str(tmp_path / "watermark.json")
+    with open(state, "w", encoding="utf-8") as f:
+        json.dump({"fromdate": 0}, f)
+    assert len(fetch_stackoverflow_qa(stub_api.url, state_file=state)) == 3
+    (_, _, first), (_, _, second) = stub_api.calls[:2]
+    assert second - first >= 0.9
+
+
+def test_paging_stops_when_quota_runs_low(stub_api):
+    from stackoverflow_scraper import MIN_QUOTA, StackExchangeClient
+
+    stub_api.has_more, stub_api.quota = True, MIN_QUOTA
+    client = StackExchangeClient(stub_api.url)
+    assert len(list(client.paged("/questions", max_pages=5, min=0))) == len(QUESTIONS)
+    assert len(stub_api.calls) == 1
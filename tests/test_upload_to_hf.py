@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import pytest
+
+from conftest import ingest
+
+REPO = "user/rag"
+
+
+def _blob_id(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class StubHub(BaseHTTPRequestHandler):
+    """
+    Hub stand-in for one model repo: the tree listing, file downloads (resolve), preupload (every
+    file goes up as a regular, non-LFS file) and the NDJSON commit endpoint.
+    """
+
+    def _send(self, status, payload=b"", content_type="application/json", headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        files = self.server.files
+        tree = f"/api/models/{REPO}/tree/main/"
+        resolve = f"/{REPO}/resolve/main/"
+        if path.startswith(tree):
+            prefix = path[len(tree):].rstrip("/") + "/"
+            self._send(200, [{"type": "file", "path": name, "size": len(data), "oid": _blob_id(data)}
+                             for name, data in sorted(files.items()) if name.startswith(prefix)])
+        elif path.startswith(resolve) and path[len(resolve):] in files:
+            data = files[path[len(resolve):]]
+            self._send(200, data, "application/octet-stream",
+                       {"ETag": f'"{_blob_id(data)}"', "X-Repo-Commit": self.server.commit_oid()})
+        else:
+            self._send(404, {"error": "not found"}, headers={"X-Error-Code": "EntryNotFound"})
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        path = unquote(urlparse(self.path).path)
+        body = self._body()
+        if path == f"/api/models/{REPO}/preupload/main":
+            files = json.loads(body)["files"]
+            self._send(200, {"files": [{"path": f["path"], "uploadMode": "regular", "shouldIgnore": False}
+                                       for f in files]})
+        elif path == f"/api/models/{REPO}/commit/main":
+            added, deleted = [], []
+            for line in body.decode("utf-8").splitlines():
+                op = json.loads(line)
+                if op["key"] == "file":
+                    self.server.files[op["value"]["path"]] = base64.b64decode(op["value"]["content"])
+                    added.append(op["value"]["path"])
+                elif op["key"] == "deletedFile":
+                    self.server.files.pop(op["value"]["path"], None)
+                    deleted.append(op["value"]["path"])
+            self.server.commits.append((sorted(added), sorted(deleted)))
+            oid = self.server.commit_oid()
+            self._send(200, {"commitUrl": f"{self.server.url}/{REPO}/commit/{oid}", "commitOid": oid})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def hub(tmp_path, monkeypatch):
+    from huggingface_hub import constants
+
+    monkeypatch.setattr(constants, "HF_HUB_CACHE", str(tmp_path / "hf_cache"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHub)
+    server.files, server.commits = {}, []
+    server.commit_oid = lambda: hashlib.sha1(str(len(server.commits)).encode()).hexdigest()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _items(n, offset=0):
+    return [{"question_id": i, "id": str(i), "text": f"upload test question {i}"} for i in range(offset, offset + n)]
+
+
+def _upload(hub):
+    import sharded_upload_to_hf
+
+    return sharded_upload_to_hf.main(REPO, "token", hub.url)
+
+
+def _local_files(workdir):
+    return {f"rag_storage/{p.name}": p.read_bytes() for p in (workdir / "rag_storage").iterdir()}
+
+
+def test_incremental_upload_and_stale_deletion(workdir, hub):
+    import sharded_rag_update
+
+    ingest(_items(50))
+    _upload(hub)
+    assert hub.files == _local_files(workdir)
+
+    # nothing changed: no commit at all
+    assert _upload(hub) is None
+    assert len(hub.commits) == 1
+
+    # a new delta only sends the new segment, the manifest and the id map
+    second = ingest(_items(50, offset=50))["deltas"][1]["shard_file"].split(".")[0]
+    _upload(hub)
+    added, deleted = hub.commits[-1]
+    assert deleted == []
+    assert {name.split("/")[1].split(".")[0] for name in added} == {second, "manifest", "idmap"}
+    assert hub.files == _local_files(workdir)
+
+    # a fold drops the deltas: their remote files go in the same commit as the new shard
+    sharded_rag_update.main(fold=True)
+    _upload(hub)
+    added, deleted = hub.commits[-1]
+    assert deleted and all(name.startswith("rag_storage/delta_") for name in deleted)
+    assert hub.files == _local_files(workdir)
+
+
+def test_nothing_deleted_when_the_remote_is_ahead(workdir, hub):
+    ingest(_items(20))
+    _upload(hub)
+
+    # another machine published a newer manifest with a segment this checkout does not have
+    remote = json.loads(hub.files["rag_storage/manifest.json"])
+    remote["generation"] += 5
+    remote["deltas"].append(dict(remote["deltas"][0], id=7, shard_file="delta_000007.faiss",
+                                 meta_file="delta_000007.jsonl"))
+    hub.files["rag_storage/manifest.json"] = json.dumps(remote).encode("utf-8")
+    hub.files["rag_storage/delta_000007.faiss"] = b"live segment"
+    # and a file no manifest knows about
+    hub.files["rag_storage/notes.txt"] = b"keep me"
+
+    _upload(hub)
+    assert hub.files["rag_storage/delta_000007.faiss"] == b"live segment"
+    assert hub.files["rag_storage/notes.txt"] == b"keep me"
+    assert hub.commits[-1][1] == []
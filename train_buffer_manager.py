@@ -1,5 +1,6 @@
 import json
 import os
+import metrics
 
 TRAIN_FILE = "datasets/train.jsonl"
 
@@ -16,6 +17,7 @@ def append_to_train_buffer(data):
     with open(TRAIN_FILE, "a", encoding="utf-8") as f:
         for item in data:
             f.write(json.dumps(item) + "\n")
+    metrics.count("buffer.items", len(data))
 
 
 def clear_train_buffer():
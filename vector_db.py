@@ -1,19 +1,97 @@
-from sentence_transformers import SentenceTransformer
+"""
+vector_db.py
+- Embeds the documents of rag_ready_data.txt (blank-line separated, see rag_converter.py) into
+  rag_index.faiss
+- Incremental: rag_index.faiss.state.json keeps a watermark (byte offset + fingerprint of the text
+  file, vector count of the index). A re-run streams only the documents after the watermark, encodes
+  them in batches of VECTOR_DB_BATCH and appends them to the existing index, so it costs time
+  proportional to the new text. The index is rebuilt from scratch when the watermark does not match
+  (text file truncated or rewritten, index missing or of another size)
+- The index and then the watermark are replaced atomically; a crash in between re-appends at most
+  the last run's documents
+"""
+
+import os
+
 import faiss
 import numpy as np
 
-MODEL = SentenceTransformer("all-MiniLM-L6-v2")
+import metrics
+from embedding_model import encode
+from index_factory import build_shard_index
+from rag_converter import fingerprint, load_state, resume_offset, save_state
+from shard_io import read_shard_index
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+INDEX_PATH = "rag_index.faiss"
+BATCH = int(os.environ.get("VECTOR_DB_BATCH", "1024"))
+
+
+def iter_documents(text_file, offset=0):
+    """Yield (document, end_offset) for every blank-line terminated document after byte `offset`."""
+    lines = []
+    with open(text_file, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                lines.append(line)
+            elif lines:
+                yield b"".join(lines).decode("utf-8").strip(), offset
+                lines = []
+    # an unterminated last document is still being written: it is picked up on the next run
+
+
+def iter_batches(text_file, offset, size=BATCH):
+    batch, end = [], offset
+    for doc, end in iter_documents(text_file, offset):
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch, end
+            batch = []
+    if batch:
+        yield batch, end
+
+
+def _resume(text_file, index_path, state_path):
+    """(index, offset) to continue from, or (None, 0) when the index has to be rebuilt."""
+    state = load_state(state_path)
+    if not state or state.get("source") != os.path.abspath(text_file) or not os.path.exists(index_path):
+        return None, 0
+    offset = resume_offset(text_file, state)
+    if offset == 0:
+        return None, 0
+    index = read_shard_index(index_path, mode="eager")
+    if index.ntotal != state.get("vectors"):
+        print(f"[VECTOR-DB] {index_path} holds {index.ntotal} vectors, watermark says {state.get('vectors')}: rebuilding")
+        return None, 0
+    return index, offset
+
 
-def ingest_into_vector_db(text_file):
-    with open(text_file, "r", encoding="utf-8") as f:
-        documents = f.read().split("\n\n")
+def ingest_into_vector_db(text_file, index_path=INDEX_PATH):
+    state_path = index_path + ".state.json"
+    index, offset = _resume(text_file, index_path, state_path)
+    added = 0
 
-    embeddings = MODEL.encode(documents)
+    for docs, end in iter_batches(text_file, offset):
+        with metrics.span("vector_db.encode"):
+            embeddings = np.asarray(encode(docs, MODEL_NAME), dtype="float32")
+        if index is None:
+            # INDEX_TYPE picks flat / ivf / hnsw / ivfpq (see index_factory.py); trained on the first batch
+            index, _ = build_shard_index(embeddings.shape[1], embeddings)
+        index.add(embeddings)
+        offset, added = end, added + len(docs)
+    metrics.count("vector_db.documents", added)
 
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(embeddings))
+    if not added:
+        print("[VECTOR-DB] No new documents")
+        return
 
-    faiss.write_index(index, "rag_index.faiss")
+    with metrics.span("vector_db.write"):
+        tmp = index_path + ".tmp"
+        faiss.write_index(index, tmp)
+        os.replace(tmp, index_path)
+        save_state({"source": os.path.abspath(text_file), "offset": offset,
+                    "fingerprint": fingerprint(text_file, offset), "vectors": index.ntotal}, state_path)
 
-    print("✅ RAG Vector Database Updated")
+    print(f"✅ RAG Vector Database Updated (+{added} documents, {index.ntotal} total)")